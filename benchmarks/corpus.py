@@ -0,0 +1,164 @@
+import hashlib
+import lzma
+import pickle
+import random
+import sqlite3
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from evernote.edam.type.ttypes import Data, Note, NoteAttributes, Notebook, Resource, ResourceAttributes
+from evernote_backup.note_storage import initialize_db
+
+from evernote2md.notes_service import NoteTO, mostly_articles_notebooks
+
+WORDS = (
+    "map note idea link stack graph concept value system model process goal plan learn team market product user "
+    "design data flow change growth question answer context pattern signal risk habit focus energy time"
+).split()
+
+ENML_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+    '<!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd">\n'
+)
+
+
+@dataclass
+class CorpusSpec:
+    notes: int = 1000
+    notebooks: int = 50
+    stacks: int = 5
+    # note content size in bytes is lognormal around content_size
+    content_size: int = 2000
+    content_sigma: float = 1.0
+    links_per_note: float = 2.0
+    broken_link_ratio: float = 0.05
+    trash_link_ratio: float = 0.05
+    trash_notes_ratio: float = 0.02
+    resource_ratio: float = 0.1
+    resource_size: int = 20000
+    articles_ratio: float = 0.05
+    seed: int = 0
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def generate_corpus(spec: CorpusSpec) -> tuple[list[NoteTO], list[NoteTO]]:
+    """Active and trashed notes of a synthetic backup, deterministic for a given spec."""
+    rnd = random.Random(spec.seed)
+
+    notebooks = [_notebook(rnd, i, spec) for i in range(spec.notebooks)]
+    articles = Notebook(guid=_guid(rnd), name=mostly_articles_notebooks[0], stack=None)
+    n_trash = int(spec.notes * spec.trash_notes_ratio)
+
+    def pick_notebook():
+        return articles if rnd.random() < spec.articles_ratio else rnd.choice(notebooks)
+
+    active = [NoteTO(_note(rnd, i), pick_notebook(), status=None) for i in range(spec.notes)]
+    trash = [NoteTO(_note(rnd, spec.notes + i, active=False), rnd.choice(notebooks), None) for i in range(n_trash)]
+
+    for note in active + trash:
+        note.note.notebookGuid = note.notebook.guid
+        _fill_content(rnd, note.note, active, trash, spec)
+
+    return active, trash
+
+
+def write_backup_db(path: Path, notes: list[NoteTO]):
+    """Write notes in the en_backup.db format of evernote-backup: lzma compressed pickles in the notes table."""
+    path.unlink(missing_ok=True)
+    initialize_db(path)
+
+    notebooks = {note.notebook.guid: note.notebook for note in notes}
+    with sqlite3.connect(path) as con:
+        con.executemany(
+            "replace into notebooks(guid, name, stack) values (?, ?, ?)",
+            ((nb.guid, nb.name, nb.stack) for nb in notebooks.values()),
+        )
+        con.executemany(
+            "replace into notes(guid, title, notebook_guid, is_active, raw_note) values (?, ?, ?, ?, ?)",
+            (
+                (n.guid, n.title, n.notebook.guid, n.note.active, lzma.compress(pickle.dumps(n.note), preset=0))
+                for n in notes
+            ),
+        )
+    con.close()
+
+
+def write_corpus(spec: CorpusSpec, context_dir: str, db="en_backup.db", pickle_file="notes.pickle"):
+    """en_backup.db with active and trashed notes plus the pickle db_to_pickle_flow would produce from it."""
+    active, trash = generate_corpus(spec)
+    target = Path(context_dir)
+    target.mkdir(parents=True, exist_ok=True)
+
+    write_backup_db(target / db, active + trash)
+    with open(target / pickle_file, "wb") as f:
+        pickle.dump(active, f)
+
+
+def _guid(rnd: random.Random) -> str:
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def _notebook(rnd: random.Random, i: int, spec: CorpusSpec) -> Notebook:
+    # every tenth notebook is outside of stacks
+    stack = f"Stack {i % spec.stacks}" if spec.stacks and i % 10 != 9 else None
+    return Notebook(guid=_guid(rnd), name=f"Notebook {i}", stack=stack)
+
+
+def _note(rnd: random.Random, i: int, active=True) -> Note:
+    created = 1_500_000_000_000 + rnd.randrange(200_000_000_000)
+    return Note(
+        guid=_guid(rnd),
+        title=f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS)} {i}",
+        created=created,
+        updated=created + rnd.randrange(10_000_000_000),
+        active=active,
+        tagNames=rnd.sample(WORDS, rnd.randrange(3)) or None,
+        attributes=NoteAttributes(),
+    )
+
+
+def _fill_content(rnd: random.Random, note: Note, active: list[NoteTO], trash: list[NoteTO], spec: CorpusSpec):
+    size = int(rnd.lognormvariate(0, spec.content_sigma) * spec.content_size)
+    n_links = int(rnd.expovariate(1 / spec.links_per_note)) if spec.links_per_note else 0
+
+    paragraphs = []
+    for _ in range(n_links):
+        paragraphs.append(f"<div>{_link(rnd, active, trash, spec)}</div>")
+
+    if rnd.random() < spec.resource_ratio:
+        body = rnd.randbytes(max(1, int(rnd.expovariate(1 / spec.resource_size))))
+        body_hash = hashlib.md5(body).digest()
+        note.resources = [
+            Resource(
+                data=Data(body=body, bodyHash=body_hash, size=len(body)),
+                mime="image/png",
+                attributes=ResourceAttributes(fileName=f"image-{body_hash.hex()[:8]}.png"),
+            )
+        ]
+        paragraphs.append(f'<div><en-media hash="{body_hash.hex()}" type="image/png"/></div>')
+
+    text_size = sum(len(p) for p in paragraphs)
+    while text_size < size:
+        paragraph = " ".join(rnd.choices(WORDS, k=rnd.randint(5, 60)))
+        paragraphs.append(f"<div>{paragraph}</div>")
+        text_size += len(paragraph) + 11
+    rnd.shuffle(paragraphs)
+
+    note.content = ENML_HEAD + "<en-note>" + "".join(paragraphs) + "</en-note>"
+    note.contentLength = len(note.content.encode("utf-8"))
+
+
+def _link(rnd: random.Random, active: list[NoteTO], trash: list[NoteTO], spec: CorpusSpec) -> str:
+    draw = rnd.random()
+    if draw < spec.broken_link_ratio:
+        guid, title = _guid(rnd), "Missing note"
+    elif draw < spec.broken_link_ratio + spec.trash_link_ratio and trash:
+        target = rnd.choice(trash)
+        guid, title = target.guid, target.title
+    else:
+        target = rnd.choice(active)
+        guid, title = target.guid, target.title
+    return f'<a href="evernote:///view/1/s1/{guid}/{guid}/">{title}</a>'
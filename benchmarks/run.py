@@ -0,0 +1,142 @@
+"""Times pipeline stages on synthetic corpora.
+
+PYTHONPATH=. python -m benchmarks.run --sizes 1000,10000,100000
+PYTHONPATH=. python -m benchmarks.run --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import time
+
+from benchmarks.corpus import CorpusSpec, write_corpus
+from evernote2md.flow import ALL_NOTES, ENEX_FOLDER, IN_DB, export_enex2
+from evernote2md.tasks.source import (
+    convert_db_to_pickle,
+    read_links_dataframe,
+    read_notes_dataframe,
+    read_pickled_notes,
+    write_links_dataframe,
+    write_notes_dataframe,
+)
+from evernote2md.tasks.transforms import build_note_index, clean_articles, fix_links
+from graph.flow import build_d3_json, build_graph_ml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = "1000,10000,100000"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, fn, *args, **kwargs):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn(*args, **kwargs)
+        self.stages[name] = {
+            "wall_s": round(time.perf_counter() - wall, 4),
+            "cpu_s": round(time.process_time() - cpu, 4),
+        }
+        logger.info(f"{name}: {self.stages[name]['wall_s']}s")
+        return result
+
+
+def run_pipeline(context_dir: str, workers=1) -> dict:
+    """Runs the stages of evernote_to_obsidian_flow and build_graph_stuff on context_dir, without Prefect."""
+    timer = StageTimer()
+    timer.run("convert_db_to_pickle", convert_db_to_pickle.fn, context_dir, IN_DB, ALL_NOTES)
+
+    notes = timer.run("read_pickled_notes", read_pickled_notes.fn, context_dir, predicate=None)
+    timer.run("write_notes_dataframe", write_notes_dataframe.fn, context_dir, notes=notes)
+    notes_df = timer.run("read_notes_dataframe", read_notes_dataframe.fn, context_dir)
+    note_index = timer.run("build_note_index", build_note_index, notes)
+
+    notes = timer.run("clean_articles", clean_articles.fn, notes, workers=workers)
+    notes, links = timer.run("fix_links", fix_links.fn, note_index, notes, workers=workers)
+    write_links_dataframe.fn(context_dir, links=links)
+    timer.run("export_enex2", export_enex2.fn, notes, context_dir, ENEX_FOLDER, workers=workers)
+
+    links_df = read_links_dataframe.fn(context_dir)
+    graph = timer.run("build_graph_ml", build_graph_ml.fn, context_dir, notes_df, links_df)
+    timer.run("build_d3_json", build_d3_json.fn, context_dir, notes_df, links_df, graph)
+    return timer.stages
+
+
+def benchmark(sizes: list[int], work_dir: str, workers=1, seed=0) -> dict:
+    results = {
+        "commit": _git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "workers": workers,
+        "sizes": {},
+    }
+    for size in sizes:
+        spec = CorpusSpec(notes=size, notebooks=max(5, size // 200), seed=seed)
+        corpus_dir = os.path.join(work_dir, f"corpus_{size}_{seed}")
+        if not os.path.exists(os.path.join(corpus_dir, IN_DB)):
+            logger.info(f"Generating corpus of {size} notes in {corpus_dir}")
+            write_corpus(spec, corpus_dir)
+
+        # Stages write their outputs next to the backup, run on a fresh copy so every run starts from the same state
+        context_dir = os.path.join(work_dir, f"run_{size}")
+        shutil.rmtree(context_dir, ignore_errors=True)
+        os.makedirs(context_dir)
+        shutil.copy(os.path.join(corpus_dir, IN_DB), context_dir)
+
+        results["sizes"][str(size)] = {"corpus": spec.as_dict(), "stages": run_pipeline(context_dir, workers)}
+    return results
+
+
+def compare(baseline: dict, candidate: dict):
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+    for size, result in candidate["sizes"].items():
+        before = baseline["sizes"].get(size, {}).get("stages", {})
+        for stage, timing in result["stages"].items():
+            if stage in before:
+                ratio = timing["wall_s"] / max(before[stage]["wall_s"], 1e-9)
+                print(
+                    f"{size:>7} {stage:<24} {before[stage]['wall_s']:>9.3f}s {timing['wall_s']:>9.3f}s {ratio:>6.2f}x"
+                )
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--work-dir", default="data/benchmarks")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"))
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline, candidate = (json.load(open(path)) for path in args.compare)
+        compare(baseline, candidate)
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    results = benchmark([int(size) for size in args.sizes.split(",")], args.work_dir, args.workers, args.seed)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+from benchmarks.corpus import CorpusSpec, generate_corpus, write_corpus
+from evernote2md.flow import ALL_NOTES
+from evernote2md.prepared.link_corrector import find_link_targets
+from evernote2md.tasks.source import (
+    _as_sqllite,
+    _deep_notes_iterator,
+    read_note_index,
+)
+
+
+def test_corpus_is_deterministic():
+    spec = CorpusSpec(notes=50, notebooks=5, seed=3)
+    first, _ = generate_corpus(spec)
+    second, _ = generate_corpus(spec)
+    assert [n.note.content for n in first] == [n.note.content for n in second]
+
+
+def test_backup_db_reads_like_evernote_backup(tmp_path):
+    spec = CorpusSpec(notes=200, notebooks=10, links_per_note=3, broken_link_ratio=0.2, trash_link_ratio=0.2)
+    write_corpus(spec, str(tmp_path))
+
+    cnx = _as_sqllite(str(tmp_path / "en_backup.db"))
+    active, trash = read_note_index(cnx)
+    notes = list(_deep_notes_iterator(cnx, ALL_NOTES))
+    assert len(active) == len(notes) == 200
+    assert len(trash) == 4
+
+    targets = [target for note in notes for target in find_link_targets(note.content)]
+    assert any(t in trash for t in targets)
+    assert any(t not in active and t not in trash for t in targets)
+    assert all(note.note.contentLength == len(note.content.encode("utf-8")) for note in notes)
@@ -1,46 +1,77 @@
+import csv
+import itertools
 import json
 import logging
 import os
+import shutil
 import subprocess
 import sys
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
+from evernote.edam.type.ttypes import Note, Notebook
 from evernote_backup.note_exporter_util import SafePath
-from evernote_backup.note_formatter import NoteFormatter
-from prefect import flow, serve, task
-from prefect_shell import ShellOperation
+from prefect import Task, flow, serve, task
+from prefect.futures import PrefectFuture, as_completed
 from tqdm import tqdm
 
-from evernote2md.notes_service import NoteTO, mostly_articles_notebooks
-from evernote2md.prepared.note_classifier import categorise_notebooks
+from evernote2md.metrics import collect_metrics, measured
+from evernote2md.note_filter import NoteFilter
+from evernote2md.notes_service import NOTE_COLUMNS, NoteTO, mostly_articles_notebooks, release_notes
+from evernote2md.prepared.link_corrector import (
+    LINK_COLUMNS,
+    ArticleCleaner,
+    LinkFixer,
+    TransformerChain,
+    stream_notes,
+)
+from evernote2md.prepared.markdown_converter import MarkdownConverter
+from evernote2md.prepared.markdown_rules import post_process_markdown
+from evernote2md.prepared.note_classifier import NoteClassifier, categorise_notebooks
+from evernote2md.tasks.attachments import ATTACHMENTS_DIR, AttachmentStore, StreamingNoteFormatter
+from evernote2md.tasks.conversion_cache import CACHE_DIR, ConversionCache, note_cache_key
+from evernote2md.tasks.incremental import build_manifest, detect_changes, merge_links, read_manifest, write_manifest
 from evernote2md.tasks.source import (
+    DEFAULT_FORMAT,
+    LINKS_CSV,
+    NOTES_CSV,
+    _as_sqllite,
+    _deep_notes_iterator,
+    convert_db_to_intermediate,
     convert_db_to_pickle,
+    convert_db_to_store,
     convert_notebooks_db_to_csv,
-    read_notes_dataframe,
+    read_backup_notes,
+    read_db_notes,
+    read_links_dataframe,
+    read_note_index,
+    read_note_titles,
     read_pickled_notes,
+    read_stored_notes,
+    update_link_index,
     write_links_dataframe,
     write_notes_dataframe,
 )
-from evernote2md.tasks.transforms import clean_articles, enrich_data, fix_links
+from evernote2md.tasks.transforms import build_note_index, transform_notes
+from evernote2md.tasks.vault import VaultWriter, prune_vault, sync_folder
 
 ENEX_FOLDER = "enex2"
 IN_DB = "en_backup.db"
+YARLE_WORK_DIR = "yarle_work"
 
-
-def ALL_EXCEPT_ARTICLES_FILTER(nb):
-    return nb.name not in mostly_articles_notebooks
-
-
-def ALL_NOTES(nb):
-    return True
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+YARLE_CONFIG = os.path.join(PROJECT_ROOT, "evernote2md", "yarle", "config.json")
+YARLE_TEMPLATE = os.path.join(PROJECT_ROOT, "evernote2md", "yarle", "noteTemplate.tmpl")
 
 
-def TEXT_MAPS(nb):
-    return nb.stack in ["Core", "Maps"]
+ALL_EXCEPT_ARTICLES_FILTER = NoteFilter(exclude_notebooks=frozenset(mostly_articles_notebooks))
+ALL_NOTES = NoteFilter()
+TEXT_MAPS = NoteFilter(stacks=frozenset(["Core", "Maps"]))
 
 
-def specific_notebook(name: str):
-    return lambda n: n.notebook.name == name
+def specific_notebook(name: str) -> NoteFilter:
+    return NoteFilter(notebooks=frozenset([name]))
 
 
 logger = logging.getLogger("evernote2md")
@@ -58,41 +89,127 @@ ENEX_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
 ENEX_TAIL = "</en-export>\n"
 
 
-def _write_export_file(file_path: Path, notebook_name: str, notes, note_formatter: NoteFormatter):
-    """Write notes to an ENEX file without requiring storage for tasks."""
+def _write_export_file(file_path: Path, notebook_name: str, notes, note_formatter: StreamingNoteFormatter):
+    """Write notes to an ENEX file without requiring storage for tasks, resource bodies are streamed into the file."""
     with file_path.open("w", encoding="utf-8") as f:
         f.write(ENEX_HEAD)
         f.write('<en-export application="Evernote" version="10.134.4">\n')
 
         for note in notes:
             # Pass empty list for note_tasks since we don't have storage
-            f.write(note_formatter.format_note(note, notebook_name, []))
+            note_formatter.write_note(f, note, notebook_name, [])
 
         f.write(ENEX_TAIL)
 
 
+def _write_notebook_file(job):
+    notebook_path, notebook_name, notes, attachments = job
+    logger.info(f"Exporting notebook {notebook_name}")
+    formatter = StreamingNoteFormatter(attachments, add_guid=False, add_metadata=False)
+    _write_export_file(notebook_path, notebook_name, (note.note for note in notes), formatter)
+    release_notes(notes)
+    return len(notes)
+
+
 @task
-def export_enex2(notes: list[NoteTO], context_dir: str, target_dir: str, single_notes=False):
+@measured
+def export_enex2(notes: list[NoteTO], context_dir: str, target_dir: str, single_notes=False, workers=1):
     safe_paths = SafePath(Path(context_dir), overwrite=True)
-    note_formatter = NoteFormatter(add_guid=False, add_metadata=False)
+    attachments = AttachmentStore(os.path.join(context_dir, ATTACHMENTS_DIR))
 
     print(context_dir)
-    # Use dict to store unique notebooks by guid (Notebook objects are not hashable)
-    notebooks_dict = {note.notebook.guid: note.notebook for note in notes}
-    notebooks = list(notebooks_dict.values())
-    for nb in tqdm(notebooks):
-        logger.info(f"Exporting notebook {nb.name}")
-        current_notes = [note.note for note in notes if note.notebook.name == nb.name]
+    # Group notes by notebook guid in one pass (Notebook objects are not hashable)
+    notebooks_dict = {}
+    notebook_notes = defaultdict(list)
+    for note in notes:
+        notebooks_dict[note.notebook.guid] = note.notebook
+        notebook_notes[note.notebook.guid].append(note)
+
+    jobs = []
+    for guid, nb in notebooks_dict.items():
         pathes = target_dir.split("/")
         if nb.stack:
             pathes.append(nb.stack)
         notebook_path = safe_paths.get_file(*pathes, f"{nb.name}.enex")
-        _write_export_file(notebook_path, nb.name, current_notes, note_formatter)
+        jobs.append((notebook_path, nb.name, notebook_notes[guid], attachments))
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor, tqdm(total=len(jobs)) as progress:
+            # Keep at most two notebooks per worker in flight, so pickled copies of notes stay bounded
+            pending = {}
+            for job in jobs:
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                        release_notes(pending.pop(future)[2])
+                    progress.update(len(done))
+                pending[executor.submit(_write_notebook_file, job)] = job
+            for future, job in pending.items():
+                future.result()
+                release_notes(job[2])
+            progress.update(len(pending))
+    else:
+        for job in tqdm(jobs):
+            _write_notebook_file(job)
+
+    return target_dir
 
+
+@task
+@measured
+def stream_db_to_enex(context_dir: str, db: str, q, target_dir: str):
+    """Stream notes from the backup db through the transformers into per-notebook ENEX files.
+
+    Only the guid -> title index is kept in memory, notes.csv and links.csv are appended note by note.
+    """
+    cnx = _as_sqllite(context_dir + "/" + db)
+    notes_index, notes_trash = read_note_index(cnx)
+    logger.info(f"Indexed {len(notes_index)} notes, {len(notes_trash)} in trash")
+
+    safe_paths = SafePath(Path(context_dir), overwrite=True)
+    note_formatter = StreamingNoteFormatter(add_guid=False, add_metadata=False)
+    link_fixer = LinkFixer(notes_index, notes_trash)
+    chain = TransformerChain([ArticleCleaner(), link_fixer, NoteClassifier()])
+
+    with (
+        open(f"{context_dir}/{NOTES_CSV}", "w", newline="", encoding="utf-8") as notes_file,
+        open(f"{context_dir}/{LINKS_CSV}", "w", newline="", encoding="utf-8") as links_file,
+    ):
+        notes_writer = csv.DictWriter(notes_file, fieldnames=NOTE_COLUMNS)
+        links_writer = csv.DictWriter(links_file, fieldnames=LINK_COLUMNS)
+        notes_writer.writeheader()
+        links_writer.writeheader()
+
+        def record_notes(notes):
+            for note in notes:
+                notes_writer.writerow(note.as_dict(include_content=False))
+                yield note
+
+        def flush_links(notes):
+            for note in notes:
+                links_writer.writerows(link_fixer.buffer)
+                link_fixer.buffer.clear()
+                yield note
+
+        # _deep_notes_iterator yields notes notebook by notebook, so each ENEX file is written in one go
+        for nb, nb_notes in itertools.groupby(_deep_notes_iterator(cnx, q), key=lambda note: note.notebook):
+            logger.info(f"Exporting notebook {nb.name}")
+
+            notes = flush_links(stream_notes(record_notes(nb_notes), chain))
+
+            pathes = target_dir.split("/")
+            if nb.stack:
+                pathes.append(nb.stack)
+            notebook_path = safe_paths.get_file(*pathes, f"{nb.name}.enex")
+            _write_export_file(notebook_path, nb.name, (note.note for note in notes), note_formatter)
+
+    chain.log_statuses()
     return target_dir
 
 
 @task
+@measured
 def read_stacks(context_dir, source_folder, p=lambda x: True):
     original_dir = os.getcwd()  # Save the original working directory
 
@@ -103,85 +220,394 @@ def read_stacks(context_dir, source_folder, p=lambda x: True):
 
 
 @task
-def yarle(context_dir, root_source, source, target, root_target="md", stream_output=False):
+@measured
+def yarle(
+    context_dir,
+    root_source,
+    source,
+    target,
+    root_target="md",
+    stream_output=False,
+    work_dir=None,
+    max_old_space_size=1024,
+):
     print(f"Processing stack {source}")
 
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-    config_path = os.path.join(project_root, "evernote2md", "yarle", "config.json")
-    template_path = os.path.join(project_root, "evernote2md", "yarle", "noteTemplate.tmpl")
-
     # Step 2: Open the config.json file in read mode
-    with open(config_path) as file:
+    with open(YARLE_CONFIG) as file:
         data = json.load(file)
 
     folder_source = root_source + "/" + source
     logger.info(f"Processing {len(os.listdir(context_dir + '/' + folder_source))} notes")
 
-    data["enexSources"] = [folder_source]
-    data["templateFile"] = os.path.abspath(template_path)
+    # Every stack gets its own work dir, so config.json and md_temp are neither shared by concurrent stacks nor carried
+    # over into the next stack or run
+    prefix = f"[{source}] " if work_dir else ""
+    run_dir = os.path.join(context_dir, work_dir or f"{YARLE_WORK_DIR}/{target}")
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+
+    data["enexSources"] = [os.path.relpath(os.path.join(context_dir, folder_source), run_dir)]
+    data["templateFile"] = os.path.abspath(YARLE_TEMPLATE)
 
     # Step 5: Open the config.json file in write mode
-    with open(f"{context_dir}/config.json", "w") as file:
+    with open(f"{run_dir}/config.json", "w") as file:
         # Step 6: Dump the updated JSON data back into the file
         json.dump(data, file, indent=4)
 
-    yarle_script = os.path.join(project_root, "node_modules", "yarle-evernote-to-md", "dist", "dropTheRope.js")
+    yarle_script = os.path.join(PROJECT_ROOT, "node_modules", "yarle-evernote-to-md", "dist", "dropTheRope.js")
 
     # Call node directly (shebang with args doesn't work on Linux)
-    command = f"node --max-old-space-size=1024 {yarle_script} --configFile config.json"
+    command = f"node --max-old-space-size={max_old_space_size} {yarle_script} --configFile config.json"
     logger.info(f"Running: {command}")
 
     # Use subprocess with real-time output
     process = subprocess.Popen(
-        command, shell=True, cwd=context_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
+        command, shell=True, cwd=run_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
     )
 
     for line in process.stdout:
-        print(line, end="", flush=True)
+        print(prefix + line, end="", flush=True)
         sys.stdout.flush()
 
     return_code = process.wait()
     if return_code != 0:
         raise RuntimeError(f"yarle failed with return code {return_code}")
-    # source_enex = source[:-len('.enex')]
-    ShellOperation(
-        commands=[
-            # replace ![[ to [[ (cross-platform: try GNU sed first, then BSD sed)
-            "find md_temp -type f -name '*.md' -exec sed -i 's/!\\[\\[/\\[\\[/g' {} + 2>/dev/null || find md_temp -type f -name '*.md' -exec sed -i '' 's/!\\[\\[/\\[\\[/g' {} +",
-            f'rm -rf "{root_target}/{target}"',
-            f'mkdir -p "{root_target}/{target}"',
-            f'mv md_temp/notes/* "{root_target}/{target}"',
-        ],
-        working_dir=context_dir,
-    ).run()
+    post_process_markdown(os.path.join(run_dir, "md_temp"))
+    sync_folder(os.path.join(run_dir, "md_temp", "notes"), os.path.join(context_dir, root_target, target))
+    shutil.rmtree(run_dir)
+
+
+@task
+@measured
+def convert_notes_native(
+    notes: list[NoteTO],
+    context_dir,
+    root_target="md",
+    p=lambda x: True,
+    cache=True,
+    cache_max_mb=1024,
+    notebooks: list[Notebook] | None = None,
+):
+    """Convert notes to Markdown in-process, without the ENEX round trip through yarle.
+
+    notebooks are all notebooks of the vault, folders of other stacks and notebooks are removed. Without them only the
+    folders of the converted notebooks are cleaned up.
+    """
+    converter = MarkdownConverter.from_files(YARLE_CONFIG, YARLE_TEMPLATE)
+    attachments = AttachmentStore(os.path.join(context_dir, ATTACHMENTS_DIR))
+    conversion_cache = ConversionCache(os.path.join(context_dir, CACHE_DIR), cache_max_mb * 1024 * 1024)
+
+    # Like the yarle path, only notebooks in a stack are converted
+    stacks = defaultdict(list)
+    for note in notes:
+        if note.notebook.stack and p(note.notebook.stack):
+            stacks[note.notebook.stack].append(note)
+
+    for stack, stack_notes in stacks.items():
+        print(f"Processing stack {stack}")
+        writer = VaultWriter(os.path.join(context_dir, root_target, converter.safe_name(stack)))
+
+        taken = set()
+        for note in tqdm(stack_notes):
+            if converter.skip(note):
+                continue
+            notebook_dir = converter.safe_name(note.notebook.name)
+            file_name = _unique_name(converter.safe_name(note.title or "Untitled"), notebook_dir, taken)
+
+            key = note_cache_key(note, notebook_dir, file_name, converter.version) if cache else None
+            files = conversion_cache.get(key) if cache else None
+            if files is None:
+                files = converter.convert(note, notebook_dir, file_name, attachments)
+                if cache:
+                    conversion_cache.put(key, files)
+
+            for path, data in files.items():
+                writer.write(path, data)
+
+        # Incremental runs convert only the affected notebooks of a stack, the others stay as they are
+        writer.finish(sorted({converter.safe_name(note.notebook.name) for note in stack_notes}))
+        release_notes(stack_notes)
+
+    if notebooks is not None:
+        folders = defaultdict(set)
+        for nb in notebooks:
+            if nb.stack:
+                folders[converter.safe_name(nb.stack)].add(converter.safe_name(nb.name))
+        prune_vault(os.path.join(context_dir, root_target), folders)
+
+    if cache:
+        conversion_cache.evict()
+
+
+def _unique_name(name: str, folder: str, taken: set) -> str:
+    unique, i = name, 0
+    while (folder, unique.lower()) in taken:
+        i += 1
+        unique = f"{name}.{i}"
+    taken.add((folder, unique.lower()))
+    return unique
+
+
+def remove_stale_enex(context_dir: str, notebooks: list[Notebook]):
+    """Remove ENEX files of deleted or renamed notebooks, and the Markdown of stacks left without ENEX files."""
+    safe_paths = SafePath(Path(context_dir), overwrite=True)
+    root = ENEX_FOLDER.split("/")
+    current = {safe_paths.get_file(*root, *([nb.stack] if nb.stack else []), f"{nb.name}.enex") for nb in notebooks}
+
+    enex_dir = Path(context_dir, *root)
+    if not enex_dir.is_dir():
+        return
+    for path in sorted(enex_dir.rglob("*.enex")):
+        if path not in current:
+            logger.info(f"Removing {path} of a deleted notebook")
+            path.unlink()
+    for stack_dir in enex_dir.iterdir():
+        if stack_dir.is_dir() and not any(stack_dir.iterdir()):
+            stack_dir.rmdir()
+            shutil.rmtree(Path(context_dir, "md", stack_dir.name), ignore_errors=True)
+
+
+def convert_stacks(context_dir, stacks, yarle_workers=1, max_old_space_size=1024):
+    if yarle_workers <= 1:
+        for stack in stacks:
+            yarle(
+                context_dir,
+                root_source=ENEX_FOLDER,
+                root_target="md",
+                source=stack,
+                target=stack,
+                max_old_space_size=max_old_space_size,
+            )
+        return
+
+    # Sliding window of at most yarle_workers node processes
+    pending = []
+    for stack in stacks:
+        _submit_in_window(
+            pending,
+            yarle_workers,
+            yarle,
+            context_dir,
+            root_source=ENEX_FOLDER,
+            root_target="md",
+            source=stack,
+            target=stack,
+            work_dir=f"{YARLE_WORK_DIR}/{stack}",
+            max_old_space_size=max_old_space_size,
+        )
+    _wait_all(pending)
+
+
+def _submit_in_window(pending: list[PrefectFuture], size: int, task_to_submit: Task, *args, **kwargs):
+    """Submit the task once fewer than size runs are pending, after the first of them finished otherwise. Errors of
+    finished runs are raised here."""
+    if len(pending) >= size:
+        finished = next(as_completed(pending))
+        pending.remove(finished)
+        finished.result()
+    pending.append(task_to_submit.submit(*args, **kwargs))
+
+
+def _wait_all(futures: list[PrefectFuture]):
+    for future in futures:
+        future.result()
+
+
+def export_and_convert_stacks(
+    notes: list[NoteTO],
+    context_dir,
+    p=lambda x: True,
+    workers=1,
+    yarle_workers=1,
+    max_old_space_size=1024,
+    notebooks: list[Notebook] | None = None,
+):
+    """Export and convert stack by stack, so yarle starts on a stack as soon as its ENEX files are written.
+
+    Exports run one after another and at most one stack is exported ahead of the yarle window, so export of the next
+    stack overlaps with conversion of the previous ones. notebooks are all notebooks of the vault, ENEX files of other
+    notebooks are removed first so that yarle doesn't convert them again.
+    """
+    if notebooks is not None:
+        remove_stale_enex(context_dir, notebooks)
+
+    stack_notes = defaultdict(list)
+    # Stacks of the vault are converted from their ENEX files also when none of their notes is exported again, as
+    # after the deletion of one of their notebooks
+    for nb in notebooks or []:
+        if nb.stack:
+            stack_notes.setdefault(nb.stack, [])
+    for note in notes:
+        stack_notes[note.notebook.stack].append(note)
+
+    # Notebooks outside of stacks are exported but not converted, like before
+    loose_notes = stack_notes.pop(None, [])
+    # the last export submitted, none or one, the next export and yarle runs wait for it
+    previous_export = []
+    if loose_notes:
+        previous_export = [
+            export_enex2.submit(notes=loose_notes, context_dir=context_dir, target_dir=ENEX_FOLDER, workers=workers)
+        ]
+
+    safe_paths = SafePath(Path(context_dir), overwrite=True)
+    pending = []
+    for stack, notes_of_stack in stack_notes.items():
+        if notes_of_stack:
+            previous_export = [
+                export_enex2.submit(
+                    notes=notes_of_stack,
+                    context_dir=context_dir,
+                    target_dir=ENEX_FOLDER,
+                    workers=workers,
+                    wait_for=previous_export,
+                )
+            ]
+        if not p(stack):
+            continue
+
+        folder = safe_paths.get(ENEX_FOLDER, stack).name
+        _submit_in_window(
+            pending,
+            yarle_workers,
+            yarle,
+            context_dir,
+            root_source=ENEX_FOLDER,
+            root_target="md",
+            source=folder,
+            target=folder,
+            work_dir=f"{YARLE_WORK_DIR}/{folder}" if yarle_workers > 1 else None,
+            max_old_space_size=max_old_space_size,
+            wait_for=previous_export,
+        )
+
+    _wait_all(previous_export + pending)
 
 
 @flow
-def evernote_to_obsidian_flow(context_dir):
+@collect_metrics
+def evernote_to_obsidian_flow(
+    context_dir,
+    incremental=False,
+    workers=1,
+    notes_format="pickle",
+    converter="yarle",
+    conversion_cache=True,
+    yarle_workers=1,
+    yarle_memory_mb=1024,
+    note_filter: NoteFilter | None = None,
+):
     categorise_notebooks(context_dir)
 
+    # With the db format notes, the notes frame and links all live in the intermediate store
+    frame_format = "db" if notes_format == "db" else DEFAULT_FORMAT
+    if note_filter is not None:
+        # A filtered run converts a subset, its links still resolve against all notes. The manifest, link index, notes
+        # and links frames describe the whole vault and are left to unfiltered runs.
+        if incremental:
+            logger.info("Filtered runs are not incremental, processing all selected notes")
+        notes, note_index = _read_filtered_notes(context_dir, notes_format, note_filter)
+        manifest = changes = notes_frame_future = notebooks = None
+    else:
+        notes = _read_notes(context_dir, notes_format, None)
+        notebooks = list({note.notebook.guid: note.notebook for note in notes}.values())
+        manifest = build_manifest(notes, read_manifest(context_dir))
+        # Links are resolved against all notes, also in incremental runs
+        note_index = update_link_index(context_dir, manifest)
+        changes = detect_changes(context_dir, manifest) if incremental else None
+        # notes.csv is a side output nothing downstream waits for, write it while the notes are transformed
+        notes_frame_future = write_notes_dataframe.submit(context_dir, notes=notes, format=frame_format)
+
+    if changes is not None:
+        if changes.is_empty():
+            logger.info("No changes since the previous run")
+            notes_frame_future.result()
+            return
+        notes = changes.select(notes)
+        logger.info(f"Reprocessing {len(notes)} notes of {len(changes.notebooks)} affected notebooks")
+
+    notes_enriched, links = transform_notes(note_index, notes, workers=workers)
+    if changes is not None:
+        previous_links = read_links_dataframe(context_dir, format=frame_format)
+        links = merge_links(previous_links, links, changes, {note.guid for note in notes})
+    if manifest is not None:
+        write_links_dataframe(context_dir, links=links, format=frame_format)
+
+    stack_filter = (lambda stack: stack in changes.stacks) if changes is not None else (lambda x: True)
+    if converter == "native":
+        convert_notes_native(
+            notes_enriched, context_dir, root_target="md", p=stack_filter, cache=conversion_cache, notebooks=notebooks
+        )
+    else:
+        export_and_convert_stacks(
+            notes_enriched,
+            context_dir,
+            p=stack_filter,
+            workers=workers,
+            yarle_workers=yarle_workers,
+            max_old_space_size=yarle_memory_mb,
+            notebooks=notebooks,
+        )
+
+    if manifest is not None:
+        notes_frame_future.result()
+        write_manifest(context_dir, manifest)
+
+
+def _read_filtered_notes(
+    context_dir, notes_format, note_filter: NoteFilter
+) -> tuple[list[NoteTO], tuple[dict[str, Note], dict[str, Note]]]:
+    """Selected notes and the guid -> title index of all notes, taken from metadata. The pickle is loaded whole anyway,
+    so it is filtered in memory."""
+    if notes_format in ("store", "backup", "db"):
+        return _read_notes(context_dir, notes_format, note_filter), read_note_titles(context_dir, notes_format, IN_DB)
     notes = read_pickled_notes(context_dir, predicate=None)
-    notes_cleaned = clean_articles(notes)
-    write_notes_dataframe(context_dir, notes=notes_cleaned)
+    return note_filter.apply(notes), build_note_index(notes)
 
-    raw_notes_pd = read_notes_dataframe(context_dir)
-    notes_w_fixed_links, links = fix_links(raw_notes_pd, notes_cleaned)
-    write_links_dataframe(context_dir, links=links)
 
-    notes_enriched = enrich_data(notes_w_fixed_links)
-    enex_folder_future = export_enex2.submit(notes=notes_enriched, context_dir=context_dir, target_dir=ENEX_FOLDER)
+def _read_notes(context_dir, notes_format, note_filter: NoteFilter | None) -> list[NoteTO]:
+    if notes_format == "store":
+        return read_stored_notes(context_dir, predicate=note_filter)
+    if notes_format == "backup":
+        return read_backup_notes(context_dir, db=IN_DB, q=note_filter or ALL_NOTES)
+    if notes_format == "db":
+        return read_db_notes(context_dir, predicate=note_filter)
+    return read_pickled_notes(context_dir, predicate=note_filter)
 
-    stacks_future = read_stacks.submit(context_dir, source_folder=ENEX_FOLDER, wait_for=[enex_folder_future])
-    stacks = stacks_future.result()
 
-    for stack in stacks:
-        yarle(context_dir, root_source=ENEX_FOLDER, root_target="md", source=stack, target=stack)
+@flow
+@collect_metrics
+def evernote_to_obsidian_streaming_flow(context_dir, yarle_workers=1, yarle_memory_mb=1024):
+    categorise_notebooks(context_dir)
+
+    enex_folder_future = stream_db_to_enex.submit(
+        context_dir=context_dir, db=IN_DB, q=ALL_NOTES, target_dir=ENEX_FOLDER
+    )
+    stacks = read_stacks.submit(context_dir, source_folder=ENEX_FOLDER, wait_for=[enex_folder_future]).result()
+
+    convert_stacks(context_dir, stacks, yarle_workers=yarle_workers, max_old_space_size=yarle_memory_mb)
 
 
 @flow
-def db_to_pickle_flow(context_dir):
-    convert_db_to_pickle(context_dir=context_dir, db=IN_DB, q=ALL_NOTES)
+@collect_metrics
+def db_to_pickle_flow(
+    context_dir,
+    notes_format="pickle",
+    resume=False,
+    note_filter: NoteFilter | None = None,
+    workers=1,
+    attachments=True,
+):
+    q = note_filter or ALL_NOTES
+    if notes_format == "store":
+        convert_db_to_store(context_dir=context_dir, db=IN_DB, q=q, workers=workers, attachments=attachments)
+    elif notes_format == "db":
+        convert_db_to_intermediate(
+            context_dir=context_dir, db=IN_DB, q=q, resume=resume, workers=workers, attachments=attachments
+        )
+    else:
+        convert_db_to_pickle(context_dir=context_dir, db=IN_DB, q=q, workers=workers, attachments=attachments)
     convert_notebooks_db_to_csv(db=IN_DB, context_dir=context_dir)
 
 
@@ -192,6 +618,9 @@ if __name__ == "__main__":
     small = evernote_to_obsidian_flow.to_deployment(
         "evernote-to-obsidian-flow-small", parameters={"context_dir": "../data/small"}
     )
+    full_streaming = evernote_to_obsidian_streaming_flow.to_deployment(
+        "evernote-to-obsidian-streaming-flow", parameters={"context_dir": "../data/full"}
+    )
     db_to_pickle = db_to_pickle_flow.to_deployment("db-to-pickle-flow", parameters={"context_dir": "../data/full"})
 
-    serve(full, small, db_to_pickle)
+    serve(full, small, full_streaming, db_to_pickle)
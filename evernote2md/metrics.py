@@ -0,0 +1,230 @@
+import contextlib
+import datetime
+import functools
+import inspect
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = "metrics"
+# name of the task to run under the sampling profiler, e.g. EVERNOTE2MD_PROFILE=transform_notes
+PROFILE_ENV = "EVERNOTE2MD_PROFILE"
+PROFILE_INTERVAL_ENV = "EVERNOTE2MD_PROFILE_INTERVAL_MS"
+
+_lock = threading.Lock()
+# stages of the collection running in this context, Prefect hands the context on to the tasks a flow runs
+_collected: ContextVar[list[dict] | None] = ContextVar("collected_stages", default=None)
+_current = threading.local()
+
+
+def measured(fn):
+    """Records wall/CPU time, peak RSS, io bytes and notes/sec of a task into the metrics of the current run, if
+    metrics are collected.
+
+    CPU time is that of the task's thread plus children reaped meanwhile (yarle, worker pools). RSS and io counters
+    are process wide, so they include tasks running concurrently.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        name = fn.__name__
+        stage = {"stage": name, "statuses": {}}
+        profiler = None
+        if os.environ.get(PROFILE_ENV) == name:
+            interval = float(os.environ.get(PROFILE_INTERVAL_ENV, 5)) / 1000
+            profiler = SamplingProfiler(threading.get_ident(), interval)
+            profiler.start()
+
+        io_before = _io_counters()
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        parent, _current.stage = getattr(_current, "stage", None), stage
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            _current.stage = parent
+            wall = time.perf_counter() - wall
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            io_after = _io_counters()
+
+            stage["wall_s"] = round(wall, 4)
+            stage["cpu_s"] = round(time.thread_time() - cpu, 4)
+            stage["children_cpu_s"] = round(
+                children.ru_utime + children.ru_stime - children_before.ru_utime - children_before.ru_stime, 4
+            )
+            stage["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+            for key in ["read_bytes", "write_bytes"]:
+                stage[key] = io_after[key] - io_before[key] if io_before and io_after else None
+            if profiler is not None:
+                profiler.stop()
+                stage["profile"] = profiler
+
+            stages = _collected.get()
+            if stages is not None:
+                with _lock:
+                    stages.append(stage)
+
+        notes = _count_notes(args, kwargs, result)
+        stage["notes"] = notes
+        stage["notes_per_s"] = round(notes / wall, 1) if notes is not None and wall > 0 else None
+        logger.info(f"Stage {name} took {stage['wall_s']}s, cpu {stage['cpu_s']}s, peak rss {stage['peak_rss_mb']}MB")
+        return result
+
+    return wrapper
+
+
+def record_statuses(name: str, statuses: Counter):
+    """Attach note status counts of a transformer to the stage running in this thread."""
+    stage = getattr(_current, "stage", None)
+    if stage is not None:
+        counts = stage["statuses"].setdefault(name, Counter())
+        counts.update({str(status): count for status, count in statuses.items()})
+
+
+@contextlib.contextmanager
+def collecting() -> Iterator[list[dict]]:
+    """Stages measured within, also by the tasks started meanwhile, are appended to the yielded list."""
+    stages = []
+    token = _collected.set(stages)
+    try:
+        yield stages
+    finally:
+        _collected.reset(token)
+
+
+def collect_metrics(flow_fn):
+    """Wrap a flow taking context_dir: metrics of the tasks it runs go to <context_dir>/metrics and a Prefect artifact."""
+    signature = inspect.signature(flow_fn)
+
+    @functools.wraps(flow_fn)
+    def wrapper(*args, **kwargs):
+        context_dir = signature.bind(*args, **kwargs).arguments["context_dir"]
+        with collecting() as stages:
+            try:
+                return flow_fn(*args, **kwargs)
+            finally:
+                write_metrics(context_dir, flow_fn.__name__, stages)
+
+    return wrapper
+
+
+def write_metrics(context_dir: str, run_name: str, stages: list[dict]) -> str:
+    with _lock:
+        stages = list(stages)
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    target = os.path.join(context_dir, METRICS_DIR)
+    os.makedirs(target, exist_ok=True)
+
+    for stage in stages:
+        profiler = stage.pop("profile", None)
+        if profiler is not None:
+            stage["profile"] = profiler.write(os.path.join(target, f"profile_{stage['stage']}_{timestamp}.txt"))
+
+    path = os.path.join(target, f"{run_name}_{timestamp}.json")
+    with open(path, "w") as f:
+        json.dump({"run": run_name, "date": timestamp, "stages": stages}, f, indent=2)
+    logger.info(f"Metrics written to {path}")
+
+    _publish_artifacts(run_name, stages)
+    return path
+
+
+def _publish_artifacts(run_name: str, stages: list[dict]):
+    from prefect.artifacts import create_table_artifact
+    from prefect.context import FlowRunContext
+
+    if FlowRunContext.get() is None:
+        return
+
+    key = run_name.replace("_", "-")
+    create_table_artifact(
+        key=f"{key}-stages",
+        table=[{k: v for k, v in stage.items() if k not in ("statuses", "profile")} for stage in stages],
+        description=f"Per-stage metrics of {run_name}",
+    )
+    statuses = [
+        {"stage": stage["stage"], "transformer": name, "status": status, "notes": count}
+        for stage in stages
+        for name, counts in stage["statuses"].items()
+        for status, count in counts.items()
+    ]
+    if statuses:
+        create_table_artifact(
+            key=f"{key}-statuses", table=statuses, description=f"Note statuses per transformer of {run_name}"
+        )
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval. The output is in collapsed stack format,
+    one "frame;frame;frame count" line per stack, as read by flamegraph.pl and speedscope."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path: str) -> str:
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Profile of {sum(self.samples.values())} samples written to {path}")
+        return path
+
+
+def _io_counters() -> dict[str, int] | None:
+    # rchar/wchar count all reads and writes, including those served by the page cache
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return {"read_bytes": int(counters["rchar"]), "write_bytes": int(counters["wchar"])}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _count_notes(args, kwargs, result) -> int | None:
+    notes = kwargs.get("notes")
+    if notes is None:
+        notes = next((arg for arg in args if isinstance(arg, list)), None)
+    if notes is None and isinstance(result, tuple) and result and isinstance(result[0], list):
+        notes = result[0]
+    if notes is None and isinstance(result, list):
+        notes = result
+    if not isinstance(notes, list) or (notes and not hasattr(type(notes[0]), "note")):
+        return None
+    return len(notes)
@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+
+import pandas as pd
+from evernote.edam.type.ttypes import Notebook
+
+from evernote2md.notes_service import NoteTO
+from evernote2md.prepared.note_classifier import categorise_notebooks0, secret_notebooks
+
+
+@dataclass(frozen=True)
+class NoteFilter:
+    """Declarative selection of notes that readers push down to their source.
+
+    Notebook conditions (names, stacks, sensitivity from categorise_notebooks0) are resolved to notebook guids against
+    the notebooks of the source, so notes of other notebooks are never decoded. Note conditions (active flag, updated
+    since, in ms like Note.updated) become SQL conditions or parquet filters where the source has the columns and are
+    checked on the metadata of the notes otherwise.
+    """
+
+    notebooks: frozenset[str] | None = None
+    exclude_notebooks: frozenset[str] = frozenset()
+    stacks: frozenset[str] | None = None
+    sensitivity: frozenset[str] | None = None
+    updated_since: int | None = None
+    active: bool | None = None
+
+    @property
+    def has_notebook_conditions(self) -> bool:
+        return bool(
+            self.notebooks is not None
+            or self.exclude_notebooks
+            or self.stacks is not None
+            or self.sensitivity is not None
+        )
+
+    def notebook_mask(self, notebooks: pd.DataFrame) -> pd.Series:
+        """Which rows of a guid, name, stack frame pass the notebook conditions."""
+        mask = pd.Series(True, index=notebooks.index)
+        if self.notebooks is not None:
+            mask &= notebooks["name"].isin(self.notebooks)
+        if self.exclude_notebooks:
+            mask &= ~notebooks["name"].isin(self.exclude_notebooks)
+        if self.stacks is not None:
+            mask &= notebooks["stack"].isin(self.stacks)
+        if self.sensitivity is not None:
+            categorised = notebooks[["name", "stack"]].copy()
+            categorise_notebooks0(categorised, secret_notebooks())
+            mask &= categorised["sensitivity"].isin(self.sensitivity)
+        return mask
+
+    def notebook_guids(self, notebooks: pd.DataFrame) -> list[str] | None:
+        """guids of the notebooks that pass, None when there are no notebook conditions."""
+        if not self.has_notebook_conditions:
+            return None
+        return list(notebooks.loc[self.notebook_mask(notebooks), "guid"])
+
+    def select_notebooks(self, notebooks: list[Notebook]) -> list[Notebook]:
+        guids = self.notebook_guids(_notebooks_frame(notebooks))
+        if guids is None:
+            return notebooks
+        guids = set(guids)
+        return [nb for nb in notebooks if nb.guid in guids]
+
+    def matches_note(self, note: NoteTO) -> bool:
+        """Note conditions only, on metadata so that lazy notes stay unloaded."""
+        if self.active is not None and bool(note.active) != self.active:
+            return False
+        return self.updated_since is None or (note.updated is not None and note.updated >= self.updated_since)
+
+    def apply(self, notes: list[NoteTO]) -> list[NoteTO]:
+        """Filter notes that are already in memory, like those of the pickle."""
+        notebooks = list({note.notebook.guid: note.notebook for note in notes}.values())
+        guids = {nb.guid for nb in self.select_notebooks(notebooks)}
+        return [note for note in notes if note.notebook.guid in guids and self.matches_note(note)]
+
+    def sql_where(self, notebook_guids: list[str] | None) -> tuple[str, list]:
+        """Conditions on the notes table of the intermediate store joined with AND, and their parameters."""
+        conditions, params = [], []
+        if notebook_guids is not None:
+            conditions.append(f"notebook_guid IN ({','.join('?' * len(notebook_guids))})")
+            params += notebook_guids
+        if self.active is not None:
+            conditions.append("is_active = ?")
+            params.append(self.active)
+        if self.updated_since is not None:
+            conditions.append("updated >= ?")
+            params.append(self.updated_since)
+        return " AND ".join(conditions) or "1", params
+
+    def parquet_filters(self, notebook_guids: list[str] | None) -> list[tuple] | None:
+        filters = []
+        if notebook_guids is not None:
+            filters.append(("notebook_guid", "in", notebook_guids))
+        if self.active is not None:
+            filters.append(("active", "==", self.active))
+        if self.updated_since is not None:
+            filters.append(("updated", ">=", self.updated_since))
+        return filters or None
+
+
+def _notebooks_frame(notebooks: list[Notebook]) -> pd.DataFrame:
+    return pd.DataFrame(
+        [{"guid": nb.guid, "name": nb.name, "stack": nb.stack} for nb in notebooks], columns=["guid", "name", "stack"]
+    )
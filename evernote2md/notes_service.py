@@ -1,5 +1,5 @@
 import logging
-from dataclasses import dataclass
+from collections.abc import Iterable
 
 import pandas as pd
 from evernote.edam.type.ttypes import Note, Notebook
@@ -11,20 +11,111 @@ mostly_articles_notebooks = ["Life Mapping External", "Articles Archive", "IT Ar
 
 logger = logging.getLogger(__name__)
 
+NOTE_COLUMNS = [
+    "id",
+    "title",
+    "created",
+    "updated",
+    "tagNames",
+    "active",
+    "contentLength",
+    "content",
+    "notebook",
+    "stack",
+]
+METADATA_FIELDS = ["guid", "title", "created", "updated", "tagNames", "active", "contentLength"]
+
+
+class _Metadata:
+    """Field of the loaded note, or its copy kept in a slot of the NoteTO while the note is not loaded"""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.slot = f"_{name}"
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        note = obj._note
+        return getattr(note, self.name) if note is not None else getattr(obj, self.slot)
+
 
-@dataclass
 class NoteTO:
-    note: Note
-    notebook: Notebook
-    status: str
+    """A note with its notebook.
+
+    The thrift Note is either given up front or loaded from a note source on first access of .note or .content, a
+    source is anything with load_note(key). Metadata of notes that are not loaded lives in slots. release() drops the
+    loaded note of a note with a source, changes made to it are lost then. A source may know the digest of a note, the
+    content hash and link targets of the stored content, so that the manifest doesn't have to load it.
+    """
+
+    __slots__ = (
+        "notebook",
+        "status",
+        "_note",
+        "_source",
+        "_key",
+        "_guid",
+        "_title",
+        "_created",
+        "_updated",
+        "_tagNames",
+        "_active",
+        "_contentLength",
+        "digest",
+    )
+
+    guid = _Metadata()
+    title = _Metadata()
+    created = _Metadata()
+    updated = _Metadata()
+    tagNames = _Metadata()
+    active = _Metadata()
+    contentLength = _Metadata()
+
+    def __init__(self, note: Note, notebook: Notebook, status: str | None = None):
+        self.notebook = notebook
+        self.status = status
+        self._note = note
+        self._source = None
+        self._key = None
+        self.digest = None
+
+    @classmethod
+    def lazy(
+        cls,
+        source,
+        key,
+        notebook: Notebook,
+        status: str | None = None,
+        digest: tuple[str, str] | None = None,
+        **metadata,
+    ) -> "NoteTO":
+        """Note loaded by source.load_note(key) when needed, metadata are the METADATA_FIELDS."""
+        note = cls(None, notebook, status)
+        note._source = source
+        note._key = key
+        note.digest = digest
+        for name in METADATA_FIELDS:
+            setattr(note, f"_{name}", metadata.get(name))
+        return note
 
     @property
-    def guid(self):
-        return self.note.guid
+    def note(self) -> Note:
+        if self._note is None:
+            self._note = self._source.load_note(self._key)
+        return self._note
 
     @property
-    def title(self):
-        return self.note.title
+    def loaded(self) -> bool:
+        return self._note is not None
+
+    def release(self):
+        if self._source is None or self._note is None:
+            return
+        for name in METADATA_FIELDS:
+            setattr(self, f"_{name}", getattr(self._note, name))
+        self._note = None
 
     @property
     def notebook_name(self):
@@ -36,18 +127,47 @@ class NoteTO:
 
     def as_dict(self, include_content):
         return {
-            "id": self.note.guid,
-            "title": self.note.title,
-            "created": self.note.created,
-            "updated": self.note.updated,
-            "tagNames": self.note.tagNames,
-            "active": self.note.active,
-            "contentLength": self.note.contentLength,
-            "content": self.note.content if include_content else None,
+            "id": self.guid,
+            "title": self.title,
+            "created": self.created,
+            "updated": self.updated,
+            "tagNames": self.tagNames,
+            "active": self.active,
+            "contentLength": self.contentLength,
+            "content": self.content if include_content else None,
             "notebook": self.notebook.name,
             "stack": self.notebook.stack,
         }
 
+    def __getstate__(self):
+        # A note that is not loaded travels as its source and key, a loaded one with its possibly transformed content
+        state = {"note": self._note, "notebook": self.notebook, "status": self.status}
+        if self._source is not None:
+            state["source"] = self._source
+            state["key"] = self._key
+            state["digest"] = self.digest
+            if self._note is None:
+                state["metadata"] = {name: getattr(self, name) for name in METADATA_FIELDS}
+        return state
+
+    def __setstate__(self, state: dict):
+        # Pickles of the former NoteTO dataclass have the same note, notebook and status state
+        self.__init__(state["note"], state["notebook"], state["status"])
+        if state.get("source") is not None:
+            self._source = state["source"]
+            self._key = state["key"]
+            self.digest = state.get("digest")
+            for name, value in state.get("metadata", {}).items():
+                setattr(self, f"_{name}", value)
+
+    def __repr__(self):
+        return f"NoteTO(guid={self.guid!r}, title={self.title!r}, loaded={self.loaded})"
+
+
+def release_notes(notes: Iterable[NoteTO]):
+    for note in notes:
+        note.release()
+
 
 # todo move to source
 def read_notebooks(cnx):
@@ -1,8 +1,13 @@
+import copy
 import logging
+import re
 import traceback
 
 # noinspection PyPep8Naming
 import xml.etree.ElementTree as ET
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Any
 
@@ -11,34 +16,51 @@ from evernote.edam.type.ttypes import Note
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 
+from evernote2md.metrics import record_statuses
 from evernote2md.notes_service import NoteTO
 
 logger = logging.getLogger(__name__)
 
+LINK_COLUMNS = ["from_title", "from_guid", "to_guid", "to_old", "to_new", "status", "ts"]
+EVERNOTE_LINK_PREFIX = "evernote:///"
+EVERNOTE_HREF = re.compile(r'href="(evernote:///[^"]*)"')
+EVERNOTE_ANCHOR = re.compile(r'<a\s[^>]*href="evernote:///[^"]*"[^>]*>.*?</a>', re.DOTALL)
+
+
+MIN_PARALLEL_NOTES = 500
+
 
 class NoteTransformer:
     def transform(self, note: NoteTO) -> NoteTO | None:
         raise NotImplementedError
 
+    def wants_tree(self, note: NoteTO) -> bool:
+        # Transformers working on the parsed ENML implement transform_tree and may share the tree in a chain
+        return False
 
-def traverse_notes(notes: list[NoteTO], processor: NoteTransformer) -> list[NoteTO]:
-    statuses = []
-    out_notes = []
-    for note in tqdm(notes):
-        with logging_redirect_tqdm():
-            try:
-                note_transformed = processor.transform(note=note)
-                out_notes.append(note_transformed)
-                status = note_transformed.status
-            except Exception as e:
-                logger.error(f"Failed note {note.title} with exception {e}")
-                logger.error(traceback.format_exc())
-                status = "failed"
+    def transform_tree(self, note: NoteTO, root: ET.Element) -> NoteTO | None:
+        raise NotImplementedError
+
+    def fork(self) -> "NoteTransformer":
+        # Fresh copy shipped to a worker process, state collected there is merged back by merge()
+        return copy.copy(self)
+
+    def merge(self, other: "NoteTransformer"):
+        pass
 
-            statuses.append({"guid": note.guid, "title": note.title, "status": status})
+
+def traverse_notes(
+    notes: list[NoteTO], processor: NoteTransformer, workers: int = 1, chunk_size: int | None = None
+) -> list[NoteTO]:
+    if workers > 1 and len(notes) >= MIN_PARALLEL_NOTES:
+        out_notes, statuses = _traverse_parallel(notes, processor, workers, chunk_size)
+    else:
+        with logging_redirect_tqdm():
+            out_notes, statuses = _traverse_chunk(tqdm(notes), processor)
 
     logger.info(f"Finished processing notes by {type(processor)}, was {len(notes)}, out {len(out_notes)}")
-    processed_ratio = 1 - pd.DataFrame(statuses)["status"].isnull().mean()
+    record_statuses(type(processor).__name__, Counter(status["status"] for status in statuses))
+    processed_ratio = 1 - pd.DataFrame(statuses, columns=["guid", "title", "status"])["status"].isnull().mean()
     logger.info(f"Processed ratio: {processed_ratio}")
     for note in out_notes:
         note.status = None
@@ -46,6 +68,113 @@ def traverse_notes(notes: list[NoteTO], processor: NoteTransformer) -> list[Note
     return out_notes
 
 
+def stream_notes(notes: Iterable[NoteTO], processor: NoteTransformer) -> Iterator[NoteTO]:
+    for note in notes:
+        out_notes, _ = _traverse_chunk([note], processor)
+        for note_transformed in out_notes:
+            note_transformed.status = None
+            yield note_transformed
+
+
+def _traverse_chunk(notes, processor: NoteTransformer) -> tuple[list[NoteTO], list[dict]]:
+    statuses = []
+    out_notes = []
+    for note in notes:
+        try:
+            note_transformed = processor.transform(note=note)
+            out_notes.append(note_transformed)
+            status = note_transformed.status
+        except Exception as e:
+            logger.error(f"Failed note {note.title} with exception {e}")
+            logger.error(traceback.format_exc())
+            status = "failed"
+
+        statuses.append({"guid": note.guid, "title": note.title, "status": status})
+
+    return out_notes, statuses
+
+
+def _traverse_chunk_worker(args) -> tuple[list[NoteTO], list[dict], NoteTransformer]:
+    processor, chunk = args
+    out_notes, statuses = _traverse_chunk(chunk, processor)
+    return out_notes, statuses, processor
+
+
+def _traverse_parallel(
+    notes: list[NoteTO], processor: NoteTransformer, workers: int, chunk_size: int | None
+) -> tuple[list[NoteTO], list[dict]]:
+    chunk_size = chunk_size or max(1, len(notes) // (workers * 4))
+    chunks = [notes[i : i + chunk_size] for i in range(0, len(notes), chunk_size)]
+    logger.info(f"Processing {len(notes)} notes in {len(chunks)} chunks with {workers} workers")
+
+    statuses = []
+    out_notes = []
+    with ProcessPoolExecutor(max_workers=workers) as executor, tqdm(total=len(notes)) as progress:
+        # map keeps chunk order, so notes and link records come back in the original order
+        results = executor.map(_traverse_chunk_worker, ((processor.fork(), chunk) for chunk in chunks))
+        for chunk, (chunk_notes, chunk_statuses, chunk_processor) in zip(chunks, results, strict=True):
+            out_notes.extend(chunk_notes)
+            statuses.extend(chunk_statuses)
+            processor.merge(chunk_processor)
+            progress.update(len(chunk))
+
+    return out_notes, statuses
+
+
+class TransformerChain(NoteTransformer):
+    """Runs several transformers on a note in one pass.
+
+    When more than one stage needs the parsed ENML, the note is parsed once, the tree is shared between
+    those stages and serialized back only before a stage that reads the content, or at the end.
+    """
+
+    def __init__(self, stages: list[NoteTransformer]):
+        self.stages = stages
+        self.statuses = {type(stage).__name__: Counter() for stage in stages}
+
+    def fork(self) -> "TransformerChain":
+        return TransformerChain([stage.fork() for stage in self.stages])
+
+    def merge(self, other: "TransformerChain"):
+        for stage, other_stage in zip(self.stages, other.stages, strict=True):
+            stage.merge(other_stage)
+        for name, counts in other.statuses.items():
+            self.statuses[name].update(counts)
+
+    def transform(self, note: NoteTO) -> NoteTO | None:
+        root = None
+        final_status = None
+        for i, stage in enumerate(self.stages):
+            note.status = None
+            if stage.wants_tree(note):
+                if root is None and sum(s.wants_tree(note) for s in self.stages[i:]) > 1:
+                    status, root = parse_content(note)
+                    if not status:
+                        root = None
+                if root is not None:
+                    note = stage.transform_tree(note, root)
+                else:
+                    note = stage.transform(note)
+            else:
+                if root is not None:
+                    note.note.content = serialize_content(root)
+                    root = None
+                note = stage.transform(note)
+
+            self.statuses[type(stage).__name__][note.status] += 1
+            final_status = note.status or final_status
+
+        if root is not None:
+            note.note.content = serialize_content(root)
+        note.status = final_status
+        return note
+
+    def log_statuses(self):
+        for name, counts in self.statuses.items():
+            logger.info(f"{name} statuses: {dict(counts)}")
+            record_statuses(name, counts)
+
+
 class ArticleCleaner(NoteTransformer):
     def transform(self, note: NoteTO) -> NoteTO | None:
         if note.note.contentLength >= 50000:
@@ -61,7 +190,27 @@ class NoteLinkTransformer(NoteTransformer):
     def __init__(self):
         self.buffer = []
 
+    def fork(self) -> "NoteLinkTransformer":
+        forked = copy.copy(self)
+        forked.buffer = []
+        return forked
+
+    def merge(self, other: "NoteLinkTransformer"):
+        self.buffer.extend(other.buffer)
+
     def transform(self, note: NoteTO) -> NoteTO | None:
+        if note.content is None or note.content.startswith("Cleared note,"):
+            note.status = "unparsed"
+            return note
+
+        # Most notes have no evernote links at all, their content is left untouched without parsing
+        if not has_evernote_links(note.content):
+            note.status = "processed" if self.buffer else None
+            return note
+
+        if self.transform_anchors(note):
+            return note
+
         status, root = self.parse_content(note)
         if not status:
             note.status = "unparsed"
@@ -69,6 +218,49 @@ class NoteLinkTransformer(NoteTransformer):
         if not root:
             return note
 
+        self.transform_tree(note, root)
+        note.note.content = serialize_content(root)
+        return note
+
+    def transform_anchors(self, note: NoteTO) -> bool:
+        """Rewrite evernote <a> elements in place, parsing only the anchors themselves.
+
+        Returns False when the anchors can't be handled this way and the whole document has to be parsed.
+        """
+        content = note.content
+        matches = list(EVERNOTE_ANCHOR.finditer(content))
+        if len(matches) != content.count(EVERNOTE_LINK_PREFIX):
+            return False
+
+        records = []
+        parts = []
+        position = 0
+        for match in matches:
+            try:
+                a = ET.fromstring(match.group(0).replace("&nbsp;", " "))
+            except ET.ParseError:
+                return False
+
+            logger.debug(f"New link {a.text}")
+            if a.text is None and not len(a.findall("*")):
+                continue
+
+            records.append(self.transform_link(note, a))
+            parts.append(content[position : match.start()])
+            parts.append(ET.tostring(a, encoding="unicode"))
+            position = match.end()
+
+        logger.debug(f"Processed {len(records)} links of {note.title} in place")
+        parts.append(content[position:])
+        note.note.content = "".join(parts)
+        self.buffer.extend(records)
+        note.status = "processed" if self.buffer else None
+        return True
+
+    def wants_tree(self, note: NoteTO) -> bool:
+        return has_evernote_links(note.content) and not note.content.startswith("Cleared note,")
+
+    def transform_tree(self, note: NoteTO, root: ET.Element) -> NoteTO | None:
         logger.debug(f"Processing {note.title}")
         for a in root.findall(".//a"):
             logger.debug(f"New link {a.text}")
@@ -80,8 +272,6 @@ class NoteLinkTransformer(NoteTransformer):
 
             self.buffer.append(self.transform_link(note, a))
 
-        result = str(ET.tostring(root, xml_declaration=False, encoding="unicode"))
-        note.note.content = result
         note.status = "processed" if self.buffer else None
         return note
 
@@ -89,23 +279,7 @@ class NoteLinkTransformer(NoteTransformer):
         return None
 
     def parse_content(self, note) -> (bool, ET.Element | None):
-        if note.content is None or note.content.startswith("Cleared note,"):
-            return False, None
-
-        try:
-            root = ET.fromstring(note.content.replace("&nbsp;", " "))
-
-            # if root.text and root.text.strip():
-            #     logger.info(f'Found text in root element {root.text}, parsing it as XML')
-            #     root = ET.fromstring(root.text.strip())
-
-        except ET.ParseError as e:
-            logger.error(f'Couldnt parse note {note.title}, got error {e}"')
-            # logger.error(root.text)
-            # logger.error(list(root))
-            return False, None
-
-        return True, root
+        return parse_content(note)
 
 
 class LinkFixer(NoteLinkTransformer):
@@ -113,6 +287,8 @@ class LinkFixer(NoteLinkTransformer):
         super().__init__()
         self.note_guid_to_titles_dict = note_guid_to_titles_dict
         self.notes_trash = notes_trash
+        # one timestamp for all link records of a run, forks share it
+        self.ts = datetime.now()
 
     def transform_link(self, note, a):
         old_name = a.text
@@ -143,19 +319,50 @@ class LinkFixer(NoteLinkTransformer):
             "to_old": old_name,
             "to_new": linked_note.title if linked_note else None,
             "status": status,
-            "ts": datetime.now(),
+            "ts": self.ts,
         }
 
 
+def parse_content(note) -> (bool, ET.Element | None):
+    if note.content is None or note.content.startswith("Cleared note,"):
+        return False, None
+
+    try:
+        root = ET.fromstring(note.content.replace("&nbsp;", " "))
+
+        # if root.text and root.text.strip():
+        #     logger.info(f'Found text in root element {root.text}, parsing it as XML')
+        #     root = ET.fromstring(root.text.strip())
+
+    except ET.ParseError as e:
+        logger.error(f'Couldnt parse note {note.title}, got error {e}"')
+        # logger.error(root.text)
+        # logger.error(list(root))
+        return False, None
+
+    return True, root
+
+
+def serialize_content(root: ET.Element) -> str:
+    return str(ET.tostring(root, xml_declaration=False, encoding="unicode"))
+
+
+def has_evernote_links(content: str | None) -> bool:
+    return content is not None and EVERNOTE_LINK_PREFIX in content
+
+
 def is_evernote_link(a) -> bool:
     if "href" not in a.attrib:
         return False
 
-    return a.attrib["href"].startswith("evernote:///")
+    return a.attrib["href"].startswith(EVERNOTE_LINK_PREFIX)
 
 
 def parse_a(a) -> str | None:
-    href = a.attrib["href"]
+    return parse_href(a.attrib["href"])
+
+
+def parse_href(href: str) -> str | None:
     if href.endswith("/"):
         href = href[:-1]
 
@@ -170,6 +377,14 @@ def parse_a(a) -> str | None:
     return target_note_id
 
 
+def find_link_targets(content: str | None) -> list[str]:
+    if not has_evernote_links(content):
+        return []
+
+    targets = (parse_href(href) for href in EVERNOTE_HREF.findall(content))
+    return [target for target in targets if target]
+
+
 def find_linked_note(a, notes: dict[str, NoteTO]) -> NoteTO | None:
     target_note_id = parse_a(a)
     if target_note_id in notes:
@@ -0,0 +1,266 @@
+import hashlib
+import html
+import json
+import logging
+import mimetypes
+import re
+
+# noinspection PyPep8Naming
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from evernote2md.notes_service import NoteTO
+from evernote2md.prepared.link_corrector import is_evernote_link, parse_content
+from evernote2md.prepared.markdown_rules import apply_rules
+from evernote2md.tasks.attachments import AttachmentStore, resource_body
+
+logger = logging.getLogger(__name__)
+
+# bump when the rendering changes, cached conversions are keyed on it
+CONVERTER_VERSION = "2"
+BLOCK_TAGS = {"p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "table", "blockquote", "pre", "hr"}
+MOMENT_TOKENS = {"YYYY": "%Y", "MM": "%m", "DD": "%d", "HH": "%H", "mm": "%M", "ss": "%S"}
+TEMPLATE_BLOCK = re.compile(r"\{([a-z-]+)-block\}(.*?)\{end-\1-block\}", re.DOTALL)
+LINE_BREAK_TAG = re.compile(rf"<br\s*/?>|</(?:{'|'.join(sorted(BLOCK_TAGS))}|li|tr)\s*>", re.IGNORECASE)
+TAG = re.compile(r"<[^>]*>")
+
+
+class MarkdownConverter:
+    """Converts ENML of a note into Obsidian Markdown, following yarle's config.json and note template.
+
+    convert() returns the produced files (the note and its attachments) keyed by path relative to the stack folder,
+    laid out like yarle output: <notebook>/<title>.md and <notebook>/_resources/<title>.resources/<file>.
+    """
+
+    def __init__(self, config: dict, template: str):
+        self.config = config
+        self.template = template
+        self.date_format = self._strftime_format(config.get("dateFormat", "YYYY-MM-DD"))
+        settings = json.dumps(config, sort_keys=True) + template + CONVERTER_VERSION
+        self.version = hashlib.sha1(settings.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def from_files(cls, config_path: str, template_path: str) -> "MarkdownConverter":
+        with open(config_path) as f:
+            config = json.load(f)
+        with open(template_path, encoding="utf-8") as f:
+            template = f.read()
+        return cls(config, template)
+
+    def convert(
+        self,
+        note: NoteTO,
+        notebook_dir: str,
+        file_name: str | None = None,
+        attachment_store: AttachmentStore | None = None,
+    ) -> dict[str, bytes]:
+        file_name = file_name or self.safe_name(note.title or "Untitled")
+        resources_dir = f"{self.config.get('resourcesDir', '_resources')}/{file_name}.resources"
+        resources = {self._resource_hash(r): r for r in note.note.resources or []}
+
+        files = {}
+        attachments = {}
+        for resource_hash, resource in resources.items():
+            attachment = self._resource_file_name(resource, resource_hash, attachments.values())
+            attachments[resource_hash] = attachment
+            files[f"{notebook_dir}/{resources_dir}/{attachment}"] = resource_body(resource, attachment_store)
+
+        body = self.render_content(note, {h: f"./{resources_dir}/{name}" for h, name in attachments.items()})
+        markdown = self.render_template(note, body)
+        # same rewrites the yarle path applies after conversion
+        markdown = apply_rules(markdown)
+        files[f"{notebook_dir}/{file_name}.md"] = markdown.encode("utf-8")
+        return files
+
+    def skip(self, note: NoteTO) -> bool:
+        attributes = note.note.attributes
+        source = attributes.source if attributes else None
+        return bool(self.config.get("skipWebClips") and source and source.startswith("web.clip"))
+
+    def safe_name(self, name: str) -> str:
+        for char, replacement in self.config.get("replacementCharacterMap", {}).items():
+            name = name.replace(char, replacement)
+        return name.strip() or "Untitled"
+
+    def render_template(self, note: NoteTO, content: str) -> str:
+        config = self.config
+        attributes = note.note.attributes
+        values = {
+            "title": note.title,
+            "content": content,
+            "notebook": note.notebook.name if note.notebook else None,
+            "created-at": None if config.get("skipCreationTime") else self._fmt_time(note.note.created),
+            "updated-at": None if config.get("skipUpdateTime") else self._fmt_time(note.note.updated),
+            "source-url": None if config.get("skipSourceUrl") or not attributes else attributes.sourceURL,
+            "tags": None if config.get("skipTags") else self._fmt_tags(note.note.tagNames),
+        }
+
+        def render_block(match):
+            value = values.get(match.group(1))
+            return match.group(2).replace(f"{{{match.group(1)}}}", value) if value else ""
+
+        text = TEMPLATE_BLOCK.sub(render_block, self.template)
+        for name, value in values.items():
+            text = text.replace(f"{{{name}}}", value or "")
+        return text
+
+    def render_content(self, note: NoteTO, attachments: dict[str, str]) -> str:
+        if note.content is None:
+            return ""
+        status, root = parse_content(note)
+        if not status:
+            logger.error(f"Couldnt convert note {note.title}, keeping its text only")
+            return _text_only(note.content)
+
+        text = _Renderer(attachments).children(root)
+        text = re.sub(r"[ \t]+\n", "\n", text)
+        text = re.sub(r"\n{3,}", "\n\n", text)
+        return text.strip() + "\n"
+
+    def _fmt_time(self, timestamp: int | None) -> str | None:
+        if timestamp is None:
+            return None
+        return datetime.fromtimestamp(timestamp / 1000).strftime(self.date_format)
+
+    def _fmt_tags(self, tags: list[str] | None) -> str | None:
+        if not tags:
+            return None
+        nested = self.config.get("nestedTags", {})
+        prefix = "#" if self.config.get("useHashTags") else ""
+        formatted = []
+        for tag in tags:
+            if nested.get("separatorInEN"):
+                tag = tag.replace(nested["separatorInEN"], nested.get("replaceSeparatorWith", "/"))
+            formatted.append(prefix + tag.replace(" ", nested.get("replaceSpaceWith", "-")))
+        return " ".join(formatted)
+
+    def _resource_file_name(self, resource, resource_hash: str, taken) -> str:
+        attributes = resource.attributes
+        name = attributes.fileName if attributes and attributes.fileName else None
+        if not name:
+            name = resource_hash + (mimetypes.guess_extension(resource.mime or "") or "")
+        name = self.safe_name(name)
+        if name in taken:
+            name = f"{resource_hash[:8]}.{name}"
+        return name
+
+    @staticmethod
+    def _resource_hash(resource) -> str:
+        if resource.data.bodyHash:
+            return resource.data.bodyHash.hex()
+        return hashlib.md5(resource.data.body).hexdigest()
+
+    @staticmethod
+    def _strftime_format(moment_format: str) -> str:
+        for token, directive in MOMENT_TOKENS.items():
+            moment_format = moment_format.replace(token, directive)
+        return moment_format
+
+
+class _Renderer:
+    def __init__(self, attachments: dict[str, str]):
+        self.attachments = attachments
+
+    def children(self, el: ET.Element) -> str:
+        parts = [self.text(el.text)]
+        for child in el:
+            parts.append(self.element(child))
+            parts.append(self.text(child.tail))
+        return "".join(parts)
+
+    @staticmethod
+    def text(text: str | None) -> str:
+        # whitespace with line breaks is indentation of the ENML source, not content
+        if not text or (not text.strip() and "\n" in text):
+            return ""
+        return re.sub(r"\s+", " ", text)
+
+    def element(self, el: ET.Element) -> str:
+        tag = el.tag
+        if tag in ("b", "strong"):
+            return self.wrap(self.children(el), "**")
+        if tag in ("i", "em"):
+            return self.wrap(self.children(el), "_")
+        if tag in ("s", "strike", "del"):
+            return self.wrap(self.children(el), "~~")
+        if tag == "code":
+            return self.wrap("".join(el.itertext()), "`")
+        if tag == "br":
+            return "\n"
+        if tag == "a":
+            return self.link(el)
+        if tag == "en-todo":
+            return "- [x] " if el.attrib.get("checked") == "true" else "- [ ] "
+        if tag == "en-media":
+            target = self.attachments.get(el.attrib.get("hash", ""))
+            return f"![[{target}]]" if target else ""
+        if tag == "img":
+            return f"![]({el.attrib.get('src', '')})"
+        if tag == "en-crypt":
+            return "[encrypted content]"
+        if tag == "div":
+            return f"\n{self.children(el)}\n"
+        if tag == "p":
+            return f"\n\n{self.children(el)}\n\n"
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            return f"\n\n{'#' * int(tag[1])} {self.children(el).strip()}\n\n"
+        if tag in ("ul", "ol"):
+            return self.list(el, ordered=tag == "ol")
+        if tag == "blockquote":
+            lines = self.children(el).strip().split("\n")
+            return "\n\n" + "\n".join(f"> {line}" for line in lines) + "\n\n"
+        if tag == "pre":
+            return "\n\n```\n" + "".join(el.itertext()).strip("\n") + "\n```\n\n"
+        if tag == "hr":
+            return "\n\n---\n\n"
+        if tag == "table":
+            return self.table(el)
+        return self.children(el)
+
+    @staticmethod
+    def wrap(text: str, marker: str) -> str:
+        if not text.strip():
+            return text
+        return f"{marker}{text.strip()}{marker}"
+
+    def link(self, a: ET.Element) -> str:
+        text = self.children(a).strip()
+        href = a.attrib.get("href", "")
+        if a.attrib.get("type") == "file":
+            # resolved by LinkFixer: href holds the title of the linked note
+            return f"[[{href}]]" if text == href else f"[[{href}|{text}]]"
+        if is_evernote_link(a):
+            # keepEvernoteLinkIfNoNoteFound is off, unresolved evernote links become text
+            return text
+        if not href:
+            return text
+        return f"[{text or href}]({href})"
+
+    def list(self, el: ET.Element, ordered: bool) -> str:
+        items = []
+        for i, li in enumerate(el.findall("li"), 1):
+            marker = f"{i}. " if ordered else "- "
+            body = re.sub(r"\n\s*\n", "\n", self.children(li).strip())
+            items.append(marker + body.replace("\n", "\n" + " " * len(marker)))
+        return "\n\n" + "\n".join(items) + "\n\n"
+
+    def table(self, el: ET.Element) -> str:
+        rows = []
+        for tr in el.iter("tr"):
+            cells = [self.children(cell).strip() for cell in tr if cell.tag in ("td", "th")]
+            rows.append([re.sub(r"\s*\n\s*", " ", cell).replace("|", "\\|") for cell in cells])
+        if not rows:
+            return ""
+
+        width = max(len(row) for row in rows)
+        rows = [row + [""] * (width - len(row)) for row in rows]
+        lines = ["| " + " | ".join(rows[0]) + " |", "|" + " --- |" * width]
+        lines += ["| " + " | ".join(row) + " |" for row in rows[1:]]
+        return "\n\n" + "\n".join(lines) + "\n\n"
+
+
+def _text_only(content: str) -> str:
+    """Text of ENML that doesn't parse: tags removed, one line per block, entities decoded."""
+    text = html.unescape(TAG.sub("", LINE_BREAK_TAG.sub("\n", content)))
+    text = re.sub(r"[ \t]+\n", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip() + "\n"
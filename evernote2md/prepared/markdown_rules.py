@@ -0,0 +1,62 @@
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# (pattern, replacement) pairs applied in order to every converted Markdown file
+MARKDOWN_RULES = [
+    # embeds become plain links
+    (re.compile(r"!\[\["), "[["),
+]
+
+
+def apply_rules(text: str, rules=MARKDOWN_RULES) -> str:
+    for pattern, replacement in rules:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def rewrite_file(path: str, rules=MARKDOWN_RULES) -> bool:
+    """Apply rules to a Markdown file, replacing it atomically. Returns whether it changed."""
+    with open(path, encoding="utf-8", newline="") as f:
+        text = f.read()
+    rewritten = apply_rules(text, rules)
+    if rewritten == text:
+        return False
+
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(rewritten)
+    os.replace(tmp_path, path)
+    return True
+
+
+def post_process_markdown(folder: str, rules=MARKDOWN_RULES, workers=4) -> dict[str, int]:
+    """Rewrite every .md file under folder in a single walk, files are processed concurrently.
+
+    A file that fails is logged and left as is, the others are still processed.
+    """
+    paths = [os.path.join(root, name) for root, _, names in os.walk(folder) for name in names if name.endswith(".md")]
+
+    def process(path):
+        try:
+            return rewrite_file(path, rules), None
+        except (OSError, UnicodeDecodeError) as e:
+            return False, e
+
+    counts = {"files": len(paths), "rewritten": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for path, (rewritten, error) in zip(paths, executor.map(process, paths), strict=True):
+            if error is not None:
+                counts["failed"] += 1
+                logger.error(f"Couldnt post-process {path}: {error}")
+            elif rewritten:
+                counts["rewritten"] += 1
+
+    logger.info(
+        f"Post-processed {counts['files']} Markdown files, {counts['rewritten']} rewritten, {counts['failed']} failed"
+    )
+    return counts
@@ -5,6 +5,7 @@ import pandas as pd
 from pandas import DataFrame
 from prefect import task
 
+from evernote2md.metrics import measured
 from evernote2md.notes_service import NoteTO
 from evernote2md.prepared.link_corrector import NoteTransformer
 
@@ -15,21 +16,22 @@ class NoteClassifier(NoteTransformer):
 
 
 @task
+@measured
 def categorise_notebooks(context_dir: str):
     from evernote2md.tasks.source import NOTEBOOK_CSV
 
-    secret_notebooks = os.environ.get("SECRET_NOTEBOOKS", None)
-    if secret_notebooks:
-        secret_notebooks = secret_notebooks.split(",")
-    else:
-        secret_notebooks = []
-
-    print(secret_notebooks)
+    secret = secret_notebooks()
+    print(secret)
     notebooks_df = pd.read_csv(f"{context_dir}/{NOTEBOOK_CSV}")
-    categorise_notebooks0(notebooks_df, secret_notebooks)
+    categorise_notebooks0(notebooks_df, secret)
     notebooks_df.to_csv(f"{context_dir}/notebooks2.csv", index=False)
 
 
+def secret_notebooks() -> list[str]:
+    secret = os.environ.get("SECRET_NOTEBOOKS", None)
+    return secret.split(",") if secret else []
+
+
 def categorise_notebooks0(notebooks: DataFrame, secret_notebooks: list[str] = None):
     articles = notebooks["name"].str.contains("Articles")
     notebooks["authorship"] = np.where(articles, "other", "me")
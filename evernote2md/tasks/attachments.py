@@ -0,0 +1,139 @@
+import base64
+import copy
+import hashlib
+import io
+import logging
+import os
+import re
+import uuid
+from typing import BinaryIO, TextIO
+
+from evernote.edam.type.ttypes import Note, Resource
+from evernote_backup.note_formatter import NoteFormatter
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENTS_DIR = "attachments"
+# fmt_binary of evernote-backup breaks base64 into lines of 120 characters, that is 90 bytes of the body per line
+BASE64_LINE = 120
+ENCODE_CHUNK = 90 * 1024
+RESOURCE_MARKER = re.compile("\0(\\d+)\0")
+
+
+def resource_hash(resource: Resource) -> str:
+    if resource.data.bodyHash:
+        return resource.data.bodyHash.hex()
+    return hashlib.md5(resource.data.body).hexdigest()
+
+
+class AttachmentStore:
+    """Resource bodies stored once per content hash in root/<first two hex digits>/<hash>.
+
+    externalize() moves the bodies of a note into the store and leaves the hash in the note, so pickles and stores of
+    notes carry every image or scan once instead of once per note using it.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.counts = {"stored": 0, "duplicate": 0, "stored_bytes": 0, "duplicate_bytes": 0}
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, body: bytes, digest: str | None = None) -> str:
+        digest = digest or hashlib.md5(body).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            self.counts["duplicate"] += 1
+            self.counts["duplicate_bytes"] += len(body)
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        self.counts["stored"] += 1
+        self.counts["stored_bytes"] += len(body)
+        return digest
+
+    def externalize(self, note: Note) -> Note:
+        for resource in note.resources or []:
+            data = resource.data
+            if data is None or data.body is None:
+                continue
+            digest = self.put(data.body, resource_hash(resource))
+            data.bodyHash = bytes.fromhex(digest)
+            data.body = None
+        return note
+
+    def open(self, resource: Resource) -> BinaryIO:
+        return open(self.path(resource_hash(resource)), "rb")
+
+    def log_counts(self):
+        counts = self.counts
+        logger.info(
+            f"Attachments: stored {counts['stored']} with {counts['stored_bytes']} bytes, skipped {counts['duplicate']} "
+            f"already stored with {counts['duplicate_bytes']} bytes"
+        )
+
+
+def open_resource(resource: Resource, attachments: AttachmentStore | None) -> BinaryIO:
+    """Stream of the resource body, from the note or from the store when the note was externalized."""
+    if resource.data.body is not None or attachments is None:
+        return io.BytesIO(resource.data.body)
+    return attachments.open(resource)
+
+
+def resource_body(resource: Resource, attachments: AttachmentStore | None) -> bytes:
+    if resource.data.body is not None or attachments is None:
+        return resource.data.body
+    with attachments.open(resource) as f:
+        return f.read()
+
+
+class StreamingNoteFormatter(NoteFormatter):
+    """NoteFormatter whose formatted note leaves resource bodies out, write_note() streams them into the file base64
+    encoded chunk by chunk instead, from the note or the attachment store. The output is the same as format_note()."""
+
+    def __init__(self, attachments: AttachmentStore | None = None, add_guid=False, add_metadata=False):
+        super().__init__(add_guid=add_guid, add_metadata=add_metadata)
+        self.attachments = attachments
+        self._resources: list[Resource] = []
+
+    def write_note(self, f: TextIO, note: Note, notebook_name: str, note_tasks=None):
+        self._resources = []
+        parts = RESOURCE_MARKER.split(self.format_note(note, notebook_name, note_tasks or []))
+        # parts alternate between formatted text and the index of the resource whose body goes in between
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                f.write(part)
+            else:
+                with open_resource(self._resources[int(part)], self.attachments) as body:
+                    write_base64(f, body)
+        self._resources = []
+
+    def _fmt_resource(self, resource: Resource) -> dict:
+        formatted = super()._fmt_resource(_without_body(resource))
+        formatted["data"]["#text"] = self._fmt_raw(f"\0{len(self._resources)}\0")
+        self._resources.append(resource)
+        return formatted
+
+
+def write_base64(f: TextIO, body: BinaryIO):
+    """Same text as fmt_binary of evernote-backup, encoded and written ENCODE_CHUNK bytes at a time."""
+    f.write("\n")
+    first = True
+    while chunk := body.read(ENCODE_CHUNK):
+        encoded = base64.b64encode(chunk).decode()
+        lines = "\n".join(encoded[i : i + BASE64_LINE] for i in range(0, len(encoded), BASE64_LINE))
+        f.write(lines if first else "\n" + lines)
+        first = False
+    f.write("\n      ")
+
+
+def _without_body(resource: Resource) -> Resource:
+    resource = copy.copy(resource)
+    resource.data = copy.copy(resource.data)
+    resource.data.body = b""
+    return resource
@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+from evernote2md.notes_service import NoteTO
+from evernote2md.prepared.link_corrector import find_link_targets
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "md_cache"
+
+
+def note_cache_key(note: NoteTO, notebook_dir: str, file_name: str, converter_version: str) -> str:
+    """Hash of everything the converted files depend on: content after transforms, template inputs,
+    resources and the converter/template/config version."""
+    n = note.note
+    attributes = n.attributes
+    parts = [
+        converter_version,
+        notebook_dir,
+        file_name,
+        note.title or "",
+        note.content or "",
+        " ".join(find_link_targets(note.content)),
+        str(n.created),
+        str(n.updated),
+        " ".join(n.tagNames or []),
+        str(attributes.source if attributes else None),
+        str(attributes.sourceURL if attributes else None),
+    ]
+    for resource in n.resources or []:
+        file_name = resource.attributes.fileName if resource.attributes else None
+        body_hash = resource.data.bodyHash or hashlib.md5(resource.data.body).digest()
+        parts.append(f"{body_hash.hex()}:{resource.mime}:{file_name}")
+
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class ConversionCache:
+    """Converted files of a note stored under its cache key, evicted least recently used first."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key: str) -> dict[str, bytes] | None:
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            self.misses += 1
+            return None
+
+        files = {}
+        for root, _, names in os.walk(entry):
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, entry).replace(os.sep, "/")] = f.read()
+
+        # mtime of the entry dir is its last use
+        os.utime(entry)
+        self.hits += 1
+        return files
+
+    def put(self, key: str, files: dict[str, bytes]):
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+
+        tmp = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        for path, data in files.items():
+            full_path = os.path.join(tmp, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                f.write(data)
+
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another run stored the same entry meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for prefix in os.scandir(self.cache_dir) if os.path.isdir(self.cache_dir) else []:
+            if not prefix.is_dir() or prefix.name.startswith(".tmp-"):
+                continue
+            for entry in os.scandir(prefix.path):
+                size = sum(
+                    os.path.getsize(os.path.join(root, name))
+                    for root, _, names in os.walk(entry.path)
+                    for name in names
+                )
+                entries.append((entry.stat().st_mtime, size, entry.path))
+                total += size
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        logger.info(
+            f"Conversion cache: {self.hits} hits, {self.misses} misses, evicted {evicted} entries, {total} bytes kept"
+        )
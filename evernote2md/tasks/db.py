@@ -1,33 +1,374 @@
+import json
+import logging
+import pickle
 import sqlite3
+import threading
+from collections.abc import Callable, Iterable
+from datetime import datetime
+from itertools import islice
 
-out_db = sqlite3.connect("out.db")
-out_db.row_factory = sqlite3.Row
+import pandas as pd
+from evernote.edam.type.ttypes import Note, Notebook
 
-out_db.execute("""CREATE TABLE notebooks(
-                        guid TEXT PRIMARY KEY,
-                        name TEXT,
-                        stack TEXT
-                    )""")
+from evernote2md.note_filter import NoteFilter
+from evernote2md.notes_service import NoteTO
+from evernote2md.prepared.link_corrector import LINK_COLUMNS
+from evernote2md.tasks.incremental import content_digest
 
+logger = logging.getLogger(__name__)
 
-out_db.execute(
-    """CREATE TABLE notes(
-                    guid TEXT PRIMARY KEY,
-                    title TEXT,
-                    notebook_guid TEXT,
-                    is_active BOOLEAN,
-                    raw_note BLOB
-                )
+OUT_DB = "out.db"
+SCHEMA_VERSION = "3"
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS config(
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS notebooks(
+    guid TEXT PRIMARY KEY,
+    name TEXT,
+    stack TEXT
+);
+CREATE TABLE IF NOT EXISTS notes(
+    guid TEXT PRIMARY KEY,
+    title TEXT,
+    notebook_guid TEXT,
+    created INTEGER,
+    updated INTEGER,
+    tag_names TEXT,
+    is_active BOOLEAN,
+    content_length INTEGER,
+    raw_note BLOB,
+    content_hash TEXT,
+    links TEXT
+);
+CREATE INDEX IF NOT EXISTS notes_notebook ON notes(notebook_guid);
+CREATE INDEX IF NOT EXISTS notes_title ON notes(title);
+CREATE TABLE IF NOT EXISTS links(
+    from_title TEXT,
+    from_guid TEXT,
+    to_guid TEXT,
+    to_old TEXT,
+    to_new TEXT,
+    status TEXT,
+    ts TEXT
+);
+CREATE INDEX IF NOT EXISTS links_from ON links(from_guid);
+CREATE INDEX IF NOT EXISTS links_to ON links(to_guid);
+CREATE TABLE IF NOT EXISTS link_targets(
+    from_guid TEXT,
+    to_guid TEXT,
+    PRIMARY KEY (from_guid, to_guid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS link_targets_to ON link_targets(to_guid, from_guid);
+CREATE TABLE IF NOT EXISTS status(
+    stage TEXT,
+    key TEXT,
+    status TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (stage, key)
+);
 """
+
+NOTE_UPSERT = """
+INSERT INTO notes(
+    guid, title, notebook_guid, created, updated, tag_names, is_active, content_length, raw_note, content_hash, links
 )
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(guid) DO UPDATE SET
+    title = excluded.title,
+    notebook_guid = excluded.notebook_guid,
+    created = excluded.created,
+    updated = excluded.updated,
+    tag_names = excluded.tag_names,
+    is_active = excluded.is_active,
+    content_length = excluded.content_length,
+    raw_note = COALESCE(excluded.raw_note, notes.raw_note),
+    content_hash = COALESCE(excluded.content_hash, notes.content_hash),
+    links = COALESCE(excluded.links, notes.links)
+"""
 
-out_db.execute(
-    """CREATE TABLE config(
-                    name TEXT PRIMARY KEY,
-                    value TEXT
-                )
+# the columns of the manifest the link index keeps, in the order of INDEX_UPSERT
+INDEX_COLUMNS = ["guid", "title", "notebook_guid", "active", "updated", "content_length", "content_hash", "links"]
+
+INDEX_UPSERT = """
+INSERT INTO notes(guid, title, notebook_guid, is_active, updated, content_length, content_hash, links)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(guid) DO UPDATE SET
+    title = excluded.title,
+    notebook_guid = excluded.notebook_guid,
+    is_active = excluded.is_active,
+    updated = excluded.updated,
+    content_length = excluded.content_length,
+    content_hash = excluded.content_hash,
+    links = excluded.links
 """
-)
+
+NOTES_FRAME_QUERY = """
+SELECT n.guid AS id, n.title, n.created, n.updated, n.tag_names AS tagNames, n.is_active AS active,
+       n.content_length AS contentLength, nb.name AS notebook, nb.stack
+FROM notes n LEFT JOIN notebooks nb ON nb.guid = n.notebook_guid
+"""
+
+
+class SqliteNoteSource:
+    """Source of lazy NoteTOs that reads a note blob by guid with query and decodes it. The connection is opened on
+    first use, so the source can be pickled along with the notes."""
+
+    def __init__(self, path: str, query: str, decode: Callable[[bytes], Note] = pickle.loads):
+        self.path = path
+        self.query = query
+        self.decode = decode
+        self._cnx = None
+        self._lock = threading.Lock()
+
+    def load_note(self, guid: str) -> Note:
+        with self._lock:
+            if self._cnx is None:
+                self._cnx = sqlite3.connect(self.path, check_same_thread=False)
+            row = self._cnx.execute(self.query, (guid,)).fetchone()
+        if row is None:
+            raise KeyError(f"Note {guid} not found in {self.path}")
+        return self.decode(row[0])
+
+    def __getstate__(self):
+        return {"path": self.path, "query": self.query, "decode": self.decode}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+
+class IntermediateStore:
+    """SQLite database in WAL mode that stages hand notes, notebooks, links and statuses over, in place of the
+    pickle and CSV files. Writes are batched with executemany, one transaction per batch.
+
+    It is the link index of every notes format as well: link_targets mirrors the links column of the notes, so the
+    notes linking to some guids are found through the index on the target. update_link_index() brings the metadata of
+    the notes to the manifest of a run, notes without raw_note are known to the index only.
+    """
+
+    def __init__(self, context_dir: str, db: str = OUT_DB):
+        self.path = f"{context_dir}/{db}"
+        self.cnx = sqlite3.connect(self.path, check_same_thread=False)
+        self.cnx.row_factory = sqlite3.Row
+        self.cnx.execute("PRAGMA journal_mode=WAL")
+        self.cnx.execute("PRAGMA synchronous=NORMAL")
+        with self.cnx:
+            self.cnx.executescript(SCHEMA)
+            # stores of schema version 1 lack the digest of the notes
+            columns = {row["name"] for row in self.cnx.execute("PRAGMA table_info(notes)")}
+            for column in ["content_hash", "links"]:
+                if column not in columns:
+                    self.cnx.execute(f"ALTER TABLE notes ADD COLUMN {column} TEXT")
+            # and those of version 2 the link targets of their notes
+            version = self.cnx.execute("SELECT value FROM config WHERE name = 'schema_version'").fetchone()
+            if version is not None and int(version["value"]) < 3:
+                self._write_link_targets(self.cnx.execute("SELECT guid, links FROM notes WHERE links IS NOT NULL"))
+            self.cnx.execute(
+                "INSERT OR REPLACE INTO config(name, value) VALUES ('schema_version', ?)", (SCHEMA_VERSION,)
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.cnx.close()
+
+    def clear_notes(self):
+        with self.cnx:
+            self.cnx.execute("DELETE FROM notes")
+            self.cnx.execute("DELETE FROM notebooks")
+            self.cnx.execute("DELETE FROM link_targets")
+
+    def write_notebooks(self, notebooks: Iterable[Notebook]):
+        with self.cnx:
+            self.cnx.executemany(
+                "INSERT OR REPLACE INTO notebooks(guid, name, stack) VALUES (?, ?, ?)",
+                ((nb.guid, nb.name, nb.stack) for nb in notebooks),
+            )
+
+    def write_notes(self, notes: Iterable[NoteTO], include_raw=True, batch_size=BATCH_SIZE) -> int:
+        """Upsert notes and their notebooks. Without include_raw only the metadata columns are updated."""
+        count = 0
+        notes = iter(notes)
+        while batch := list(islice(notes, batch_size)):
+            notebooks = {note.notebook.guid: note.notebook for note in batch}
+            with self.cnx:
+                self.cnx.executemany(
+                    "INSERT OR REPLACE INTO notebooks(guid, name, stack) VALUES (?, ?, ?)",
+                    ((nb.guid, nb.name, nb.stack) for nb in notebooks.values()),
+                )
+                rows = [_note_row(note, include_raw) for note in batch]
+                self.cnx.executemany(NOTE_UPSERT, rows)
+                # the links column is last, metadata only updates keep the stored links
+                self._write_link_targets((row[0], row[-1]) for row in rows if row[-1] is not None)
+            count += len(batch)
+        return count
+
+    def update_link_index(self, manifest: pd.DataFrame) -> tuple[int, int]:
+        """Bring the notes to the manifest, returns the number of notes written and deleted. Only notes whose manifest
+        row differs from the stored one are written, notes missing from the manifest are gone from the vault."""
+        stored = {
+            row[0]: tuple(row)[1:]
+            for row in self.cnx.execute(
+                "SELECT guid, title, notebook_guid, is_active, updated, content_length, content_hash, links FROM notes"
+            )
+        }
+        changed = []
+        for row in manifest.to_dict("records"):
+            values = tuple(_sql_value(row[column]) for column in INDEX_COLUMNS)
+            if stored.pop(values[0], None) != values[1:]:
+                changed.append(values)
+        # what is left in stored are notes gone since the last update
+        deleted = [(guid,) for guid in stored]
+
+        with self.cnx:
+            self.cnx.executemany("DELETE FROM notes WHERE guid = ?", deleted)
+            self.cnx.executemany("DELETE FROM link_targets WHERE from_guid = ?", deleted)
+            self.cnx.executemany(INDEX_UPSERT, changed)
+            self._write_link_targets((values[0], values[-1]) for values in changed)
+        return len(changed), len(deleted)
+
+    def note_index(self) -> tuple[dict[str, Note], dict[str, Note]]:
+        """guid -> Note(title) for active and trashed notes, like build_note_index without the notes."""
+        notes_active, notes_trash = {}, {}
+        for row in self.cnx.execute("SELECT guid, title, is_active FROM notes WHERE is_active IS NOT NULL"):
+            index = notes_active if row["is_active"] else notes_trash
+            index[row["guid"]] = Note(guid=row["guid"], title=row["title"])
+        return notes_active, notes_trash
+
+    def backlinks(self, guids: Iterable[str]) -> set[str]:
+        """Notes linking to any of the guids."""
+        rows = self.cnx.execute(
+            "SELECT DISTINCT from_guid FROM link_targets WHERE to_guid IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(guids)),),
+        )
+        return {row["from_guid"] for row in rows}
+
+    def _write_link_targets(self, guid_links: Iterable[tuple[str, str | None]]):
+        # called within the transaction of the notes
+        guid_links = [(guid, (links or "").split()) for guid, links in guid_links]
+        self.cnx.executemany("DELETE FROM link_targets WHERE from_guid = ?", ((guid,) for guid, _ in guid_links))
+        self.cnx.executemany(
+            "INSERT OR IGNORE INTO link_targets(from_guid, to_guid) VALUES (?, ?)",
+            ((guid, target) for guid, targets in guid_links for target in targets),
+        )
+
+    def notes(self, predicate: Callable | NoteFilter | None = None, active=True) -> list[NoteTO]:
+        """Active or trashed notes, a NoteFilter predicate becomes part of the query and its active flag wins."""
+        notebooks = {
+            row["guid"]: Notebook(guid=row["guid"], name=row["name"], stack=row["stack"])
+            for row in self.cnx.execute("SELECT guid, name, stack FROM notebooks")
+        }
+
+        query = (
+            "SELECT guid, title, notebook_guid, created, updated, tag_names, is_active, content_length, content_hash, "
+            "links FROM notes "
+            "WHERE raw_note IS NOT NULL"
+        )
+        params = []
+        if isinstance(predicate, NoteFilter):
+            where, params = predicate.sql_where(predicate.notebook_guids(self.notebooks_dataframe()))
+            query += f" AND {where}"
+            if predicate.active is not None:
+                active = None
+            predicate = None
+        if active is not None:
+            query += " AND is_active = ?"
+            params.append(active)
+
+        # Notes are decoded from raw_note only when their content is accessed
+        source = SqliteNoteSource(self.path, "SELECT raw_note FROM notes WHERE guid = ?")
+        notes = []
+        for row in self.cnx.execute(query + " ORDER BY rowid", params):
+            note = NoteTO.lazy(
+                source,
+                row["guid"],
+                notebooks.get(row["notebook_guid"]),
+                guid=row["guid"],
+                title=row["title"],
+                created=row["created"],
+                updated=row["updated"],
+                tagNames=None if row["tag_names"] is None else json.loads(row["tag_names"]),
+                active=bool(row["is_active"]),
+                contentLength=row["content_length"],
+                digest=(row["content_hash"], row["links"]) if row["content_hash"] is not None else None,
+            )
+            if predicate is None or predicate(note):
+                notes.append(note)
+        return notes
+
+    def notes_dataframe(self) -> pd.DataFrame:
+        df = pd.read_sql_query(NOTES_FRAME_QUERY + " ORDER BY n.rowid", self.cnx)
+        df["active"] = df["active"].astype(bool)
+        df["tagNames"] = df["tagNames"].map(lambda tags: None if tags is None else json.loads(tags))
+        return df
+
+    def notebooks_dataframe(self) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT guid, name, stack FROM notebooks ORDER BY rowid", self.cnx)
+
+    def write_links(self, links: list[dict], from_guids: Iterable[str] | None = None):
+        """Replace links of the given notes, or all links when from_guids is None."""
+        with self.cnx:
+            if from_guids is None:
+                self.cnx.execute("DELETE FROM links")
+            else:
+                self.cnx.executemany("DELETE FROM links WHERE from_guid = ?", ((guid,) for guid in from_guids))
+            self.cnx.executemany(
+                f"INSERT INTO links({', '.join(LINK_COLUMNS)}) VALUES ({', '.join('?' * len(LINK_COLUMNS))})",
+                ([_sql_value(link.get(column)) for column in LINK_COLUMNS] for link in links),
+            )
+
+    def links_dataframe(self) -> pd.DataFrame:
+        return pd.read_sql_query(f"SELECT {', '.join(LINK_COLUMNS)} FROM links ORDER BY rowid", self.cnx)
+
+    def write_statuses(self, stage: str, statuses: dict[str, str]):
+        now = datetime.now().isoformat()
+        with self.cnx:
+            self.cnx.executemany(
+                "INSERT OR REPLACE INTO status(stage, key, status, updated_at) VALUES (?, ?, ?, ?)",
+                ((stage, key, status, now) for key, status in statuses.items()),
+            )
+
+    def statuses(self, stage: str) -> dict[str, str]:
+        rows = self.cnx.execute("SELECT key, status FROM status WHERE stage = ?", (stage,))
+        return {row["key"]: row["status"] for row in rows}
+
+    def clear_statuses(self, stage: str):
+        with self.cnx:
+            self.cnx.execute("DELETE FROM status WHERE stage = ?", (stage,))
+
+
+def _note_row(note: NoteTO, include_raw: bool) -> tuple:
+    return (
+        note.guid,
+        note.title,
+        note.notebook.guid,
+        note.created,
+        note.updated,
+        None if note.tagNames is None else json.dumps(list(note.tagNames)),
+        True if note.active is None else note.active,
+        note.contentLength,
+        *_raw_and_digest(note, include_raw),
+    )
+
+
+def _raw_and_digest(note: NoteTO, include_raw: bool) -> tuple:
+    if include_raw:
+        return pickle.dumps(note.note, protocol=pickle.HIGHEST_PROTOCOL), *content_digest(note.content)
+    # metadata only updates keep the digest of the stored raw note
+    return None, None, None
 
 
-out_db.execute("")
+def _sql_value(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, datetime | pd.Timestamp):
+        return value.isoformat()
+    # numpy scalars of frames
+    return value.item() if hasattr(value, "item") else value
@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import pandas as pd
+from prefect import task
+
+from evernote2md.metrics import measured
+from evernote2md.notes_service import NoteTO
+from evernote2md.prepared.link_corrector import find_link_targets
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_CSV = "manifest.csv"
+MANIFEST_COLUMNS = [
+    "guid",
+    "title",
+    "updated",
+    "content_hash",
+    "notebook_guid",
+    "stack",
+    "links",
+    "active",
+    "content_length",
+    "notebook",
+]
+
+
+@dataclass
+class ChangeSet:
+    added: set[str] = field(default_factory=set)
+    changed: set[str] = field(default_factory=set)
+    deleted: set[str] = field(default_factory=set)
+    retitled: set[str] = field(default_factory=set)
+    relinked: set[str] = field(default_factory=set)
+    notebooks: set[str] = field(default_factory=set)
+    stacks: set[str] = field(default_factory=set)
+
+    @property
+    def notes(self) -> set[str]:
+        return self.added | self.changed | self.relinked
+
+    def is_empty(self) -> bool:
+        return not (self.notes or self.deleted)
+
+    def select(self, notes: list[NoteTO]) -> list[NoteTO]:
+        # ENEX files are written per notebook, so every note of an affected notebook is re-exported
+        return [note for note in notes if note.notebook.guid in self.notebooks]
+
+
+def content_hash(content: str | None) -> str:
+    return hashlib.sha1((content or "").encode("utf-8")).hexdigest()
+
+
+def content_digest(content: str | None) -> tuple[str, str]:
+    """content hash and space separated link targets, as in the manifest"""
+    return content_hash(content), " ".join(find_link_targets(content))
+
+
+def build_manifest(notes: list[NoteTO], previous: pd.DataFrame | None = None) -> pd.DataFrame:
+    """Content of a note is read only when neither its source knows the digest nor the previous manifest has it for the
+    same updated and contentLength, so that incremental runs load only the changed notes."""
+    known = {}
+    if previous is not None and "content_length" in previous:
+        known = previous.set_index("guid")[["updated", "content_length", "content_hash", "links"]].to_dict("index")
+
+    rows = []
+    for note in notes:
+        digest = None if note.loaded else note.digest
+        stored = known.get(note.guid)
+        if (
+            digest is None
+            and stored
+            and _same(stored["updated"], note.updated)
+            and _same(stored["content_length"], note.contentLength)
+        ):
+            digest = stored["content_hash"], stored["links"]
+        if digest is None:
+            loaded = note.loaded
+            digest = content_digest(note.content)
+            # Lazy notes are loaded again by the stages that transform them
+            if not loaded:
+                note.release()
+
+        rows.append(
+            {
+                "guid": note.guid,
+                "title": note.title or "",
+                "updated": note.updated,
+                "content_hash": digest[0],
+                "notebook_guid": note.notebook.guid,
+                "stack": note.notebook.stack or "",
+                "links": digest[1],
+                "active": note.active,
+                "content_length": note.contentLength,
+                "notebook": note.notebook.name or "",
+            }
+        )
+    return pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+
+
+def _same(stored, value) -> bool:
+    if pd.isna(stored) or value is None:
+        return pd.isna(stored) and value is None
+    return stored == value
+
+
+def read_manifest(context_dir: str) -> pd.DataFrame | None:
+    path = f"{context_dir}/{MANIFEST_CSV}"
+    if not os.path.exists(path):
+        return None
+
+    dtypes = dict.fromkeys(MANIFEST_COLUMNS, str) | {"updated": "Int64", "active": "boolean", "content_length": "Int64"}
+    return pd.read_csv(path, dtype=dtypes, keep_default_na=False)
+
+
+@task
+@measured
+def write_manifest(context_dir: str, manifest: pd.DataFrame):
+    manifest.to_csv(f"{context_dir}/{MANIFEST_CSV}", index=False)
+
+
+def diff_manifests(
+    previous: pd.DataFrame, current: pd.DataFrame, backlinks: Callable[[set[str]], set[str]] | None = None
+) -> ChangeSet:
+    """Changes between two runs, backlinks finds the notes linking to some guids in an index instead of a scan of the
+    links of all notes."""
+    prev = previous.set_index("guid")
+    curr = current.set_index("guid")
+
+    common = curr.index.intersection(prev.index)
+    p, c = prev.loc[common], curr.loc[common]
+    modified = (
+        (p["updated"] != c["updated"])
+        | (p["content_hash"] != c["content_hash"])
+        | (p["title"] != c["title"])
+        | (p["notebook_guid"] != c["notebook_guid"])
+        | (p["stack"] != c["stack"])
+    )
+    # manifests written before the notebook name was added
+    if "notebook" in prev:
+        modified |= p["notebook"] != c["notebook"]
+
+    changes = ChangeSet(
+        added=set(curr.index.difference(prev.index)),
+        changed=set(common[modified.to_numpy()]),
+        deleted=set(prev.index.difference(curr.index)),
+        retitled=set(common[(p["title"] != c["title"]).to_numpy()]),
+    )
+
+    # Links to retitled or deleted notes have to be rewritten, links to added notes may resolve now
+    targets = changes.added | changes.deleted | changes.retitled
+    if targets:
+        if backlinks is not None:
+            linking = set(curr.index.intersection(list(backlinks(targets))))
+        else:
+            linking = set(curr.index[curr["links"].map(lambda links: not targets.isdisjoint(links.split())).to_numpy()])
+        changes.relinked = linking - changes.changed - changes.added
+
+    touched = changes.deleted | changes.changed
+    changes.notebooks = set(curr.loc[list(changes.notes), "notebook_guid"]) | set(
+        prev.loc[list(touched), "notebook_guid"]
+    )
+    changes.stacks = set(curr.loc[curr["notebook_guid"].isin(changes.notebooks), "stack"]) | set(
+        prev.loc[prev["notebook_guid"].isin(changes.notebooks), "stack"]
+    )
+    changes.stacks.discard("")
+    return changes
+
+
+@task
+@measured
+def detect_changes(context_dir: str, manifest: pd.DataFrame) -> ChangeSet | None:
+    previous = read_manifest(context_dir)
+    if previous is None:
+        logger.info("No manifest from a previous run, processing all notes")
+        return None
+
+    # db imports content_digest from here
+    from evernote2md.tasks.db import IntermediateStore
+
+    # The link index holds the links of the current notes, update_link_index runs before
+    with IntermediateStore(context_dir) as store:
+        changes = diff_manifests(previous, manifest, store.backlinks)
+    logger.info(
+        f"Detected {len(changes.added)} added, {len(changes.changed)} changed, {len(changes.deleted)} deleted notes, "
+        f"{len(changes.relinked)} notes with affected links in {len(changes.notebooks)} notebooks"
+    )
+    return changes
+
+
+def merge_links(previous: pd.DataFrame, links: list[dict], changes: ChangeSet, reprocessed: set[str]) -> list[dict]:
+    stale = reprocessed | changes.deleted
+    kept = previous[~previous["from_guid"].isin(stale)]
+    return kept.to_dict("records") + links
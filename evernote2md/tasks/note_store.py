@@ -0,0 +1,140 @@
+import logging
+import mmap
+import os
+import pickle
+from collections.abc import Callable, Iterable
+
+import pandas as pd
+from evernote.edam.type.ttypes import Note, Notebook
+
+from evernote2md.note_filter import NoteFilter
+from evernote2md.notes_service import NOTE_COLUMNS, NoteTO
+from evernote2md.tasks.incremental import content_digest
+
+logger = logging.getLogger(__name__)
+
+STORE_METADATA = "notes_meta.parquet"
+STORE_CONTENT = "notes_content.bin"
+STORE_COLUMNS = [column for column in NOTE_COLUMNS if column != "content"] + [
+    "notebook_guid",
+    "content_hash",
+    "links",
+    "offset",
+    "length",
+]
+
+
+class NoteStore:
+    """Parquet metadata table plus an append-only blob file of pickled notes addressed by (offset, length)."""
+
+    def __init__(self, context_dir: str):
+        self.metadata_path = f"{context_dir}/{STORE_METADATA}"
+        self.content_path = f"{context_dir}/{STORE_CONTENT}"
+        self._mmap = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.metadata_path) and os.path.exists(self.content_path)
+
+    def metadata(self, columns: list[str] | None = None, filters: list[tuple] | None = None) -> pd.DataFrame:
+        return pd.read_parquet(self.metadata_path, columns=columns, filters=filters)
+
+    def load_note(self, key: tuple[int, int]) -> Note:
+        offset, length = key
+        if self._mmap is None:
+            with open(self.content_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return pickle.loads(self._mmap[offset : offset + length])
+
+    def __getstate__(self):
+        # Notes that travel to other processes bring the store along, each process maps the blob file itself
+        return self.__dict__ | {"_mmap": None}
+
+    def notes(self, predicate: Callable | NoteFilter | None = None) -> list[NoteTO]:
+        """Notes with their metadata, the note itself is read from the mmapped blob file when first accessed. A
+        NoteFilter predicate is pushed down into the parquet read."""
+        filters = None
+        if isinstance(predicate, NoteFilter):
+            notebooks = self.metadata(["notebook_guid", "notebook", "stack"]).drop_duplicates("notebook_guid")
+            notebooks = notebooks.rename(columns={"notebook_guid": "guid", "notebook": "name"})
+            guids = predicate.notebook_guids(notebooks)
+            if guids == []:
+                return []
+            filters = predicate.parquet_filters(guids)
+            predicate = None
+        metadata = self.metadata(filters=filters)
+        notebooks = {}
+        notes = []
+        for row in metadata.to_dict("records"):
+            notebook = notebooks.get(row["notebook_guid"])
+            if notebook is None:
+                stack = None if pd.isna(row["stack"]) else row["stack"]
+                notebook = Notebook(guid=row["notebook_guid"], name=row["notebook"], stack=stack)
+                notebooks[row["notebook_guid"]] = notebook
+            note = NoteTO.lazy(
+                self,
+                (row["offset"], row["length"]),
+                notebook,
+                guid=row["id"],
+                title=row["title"],
+                created=row["created"],
+                updated=row["updated"],
+                tagNames=None if row["tagNames"] is None else list(row["tagNames"]),
+                active=row["active"],
+                contentLength=row["contentLength"],
+                digest=(row["content_hash"], row["links"]) if row.get("content_hash") else None,
+            )
+            if predicate is None or predicate(note):
+                notes.append(note)
+
+        return notes
+
+    def write(self, notes: Iterable[NoteTO]):
+        """Append new and updated notes to the blob file, unchanged notes keep their blob."""
+        previous = {}
+        if self.exists():
+            previous = self.metadata().set_index("id").to_dict("index")
+
+        rows = []
+        with open(self.content_path, "ab") as f:
+            for note in notes:
+                row = note.as_dict(include_content=False)
+                row["notebook_guid"] = note.notebook.guid
+                row["tagNames"] = None if row["tagNames"] is None else list(row["tagNames"])
+
+                stored = previous.get(note.guid)
+                if stored is not None and stored["updated"] == row["updated"] and stored.get("content_hash"):
+                    row["offset"], row["length"] = stored["offset"], stored["length"]
+                    row["content_hash"], row["links"] = stored["content_hash"], stored["links"]
+                else:
+                    row["content_hash"], row["links"] = content_digest(note.content)
+                    blob = pickle.dumps(note.note, protocol=pickle.HIGHEST_PROTOCOL)
+                    row["offset"], row["length"] = f.tell(), len(blob)
+                    f.write(blob)
+                rows.append(row)
+
+        metadata = pd.DataFrame(rows, columns=STORE_COLUMNS).astype({"offset": "int64", "length": "int64"})
+        for column in ["notebook", "stack"]:
+            metadata[column] = metadata[column].astype("category")
+        metadata.to_parquet(self.metadata_path, index=False)
+
+        live = int(metadata["length"].sum())
+        total = os.path.getsize(self.content_path)
+        logger.info(f"Stored {len(metadata)} notes, {live} live bytes of {total}")
+        if total > 2 * live:
+            self.compact()
+
+    def compact(self):
+        metadata = self.metadata()
+        tmp_path = self.content_path + ".tmp"
+        with open(self.content_path, "rb") as src, open(tmp_path, "wb") as dst:
+            offsets = []
+            for offset, length in zip(metadata["offset"], metadata["length"], strict=True):
+                src.seek(offset)
+                offsets.append(dst.tell())
+                dst.write(src.read(length))
+
+        metadata["offset"] = offsets
+        os.replace(tmp_path, self.content_path)
+        metadata.to_parquet(self.metadata_path, index=False)
+        self._mmap = None
+        logger.info(f"Compacted note store to {os.path.getsize(self.content_path)} bytes")
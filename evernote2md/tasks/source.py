@@ -1,14 +1,26 @@
 import datetime
+import itertools
+import lzma
 import pickle
 import sqlite3
 from collections.abc import Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from sqlite3 import Connection
 
 import pandas as pd
+from evernote.edam.type.ttypes import Note, Notebook
 from evernote_backup.note_storage import NoteBookStorage, NoteStorage
 from prefect import task
 
-from evernote2md.notes_service import NoteTO
+from evernote2md.metrics import measured
+from evernote2md.note_filter import NoteFilter
+from evernote2md.notes_service import METADATA_FIELDS, NOTE_COLUMNS, NoteTO
+from evernote2md.prepared.link_corrector import LINK_COLUMNS
+from evernote2md.tasks.attachments import ATTACHMENTS_DIR, AttachmentStore
+from evernote2md.tasks.db import OUT_DB, IntermediateStore, SqliteNoteSource
+from evernote2md.tasks.incremental import content_digest
+from evernote2md.tasks.note_store import NoteStore
 from evernote2md.tasks.transforms import logger
 
 DEFAULT_FORMAT = "csv"
@@ -18,12 +30,27 @@ NOTES_CSV = "notes.csv"
 NOTES_PICKLE = "notes.pickle"
 LINKS_CSV = "links.csv"
 NOTEBOOK_CSV = "notebooks.csv"
+IMPORT_STAGE = "import"
+DECODE_BATCH_SIZE = 200
+
+# Explicit types spare read_csv the inference, notebook and stack are dictionary encoded in parquet
+NOTES_DTYPES = {
+    "id": "string",
+    "title": "string",
+    "created": "Int64",
+    "updated": "Int64",
+    "active": "boolean",
+    "contentLength": "Int64",
+    "content": "string",
+    "notebook": "category",
+    "stack": "category",
+}
 
 
 @task
-def convert_db_to_pickle(context_dir, db, q):
-    indb = _as_sqllite(context_dir + "/" + db)
-    notes = list(_deep_notes_iterator(indb, q))
+@measured
+def convert_db_to_pickle(context_dir, db, q, workers=1, attachments=True):
+    notes = list(_externalized(_backup_notes(context_dir + "/" + db, q, workers), context_dir, attachments))
 
     x = max(n.note.updated for n in notes)
     logger.info("Last known date: %s", datetime.date.fromtimestamp(x / 1000))
@@ -32,6 +59,56 @@ def convert_db_to_pickle(context_dir, db, q):
         pickle.dump(notes, f)
 
 
+@task
+@measured
+def convert_db_to_intermediate(context_dir, db, q, resume=False, workers=1, attachments=True):
+    """Import notes into the intermediate store notebook by notebook. With resume, notebooks imported by a previous,
+    interrupted run are skipped."""
+    db_path = context_dir + "/" + db
+    indb = _as_sqllite(db_path)
+
+    with IntermediateStore(context_dir) as store:
+        if not resume:
+            store.clear_notes()
+            store.clear_statuses(IMPORT_STAGE)
+        imported = store.statuses(IMPORT_STAGE)
+
+        notebooks = [nb for nb in _select_notebooks(indb, q) if imported.get(nb.guid) != "done"]
+        notes = _filter_notes(_notes_of_notebooks(db_path, notebooks, workers), q)
+        notes = _externalized(notes, context_dir, attachments)
+        count = 0
+        # Notes arrive notebook by notebook, a notebook is done once all of its notes are written
+        by_guid = {nb.guid: nb for nb in notebooks}
+        for guid, nb_notes in itertools.groupby(notes, key=lambda note: note.notebook.guid):
+            count += store.write_notes(nb_notes)
+            store.write_notebooks([by_guid[guid]])
+            store.write_statuses(IMPORT_STAGE, {guid: "done"})
+        # and notebooks without notes
+        store.write_notebooks(notebooks)
+        store.write_statuses(IMPORT_STAGE, dict.fromkeys(by_guid, "done"))
+
+    logger.info(f"Imported {count} notes into {OUT_DB}, skipped {len(imported)} notebooks imported before")
+
+
+@task
+@measured
+def convert_db_to_store(context_dir, db, q, workers=1, attachments=True):
+    notes = _backup_notes(context_dir + "/" + db, q, workers)
+    NoteStore(context_dir).write(_externalized(notes, context_dir, attachments))
+
+
+def _externalized(notes: Iterable[NoteTO], context_dir: str, attachments=True) -> Iterable[NoteTO]:
+    """Notes with their resource bodies moved to the attachment store, each distinct body is written once."""
+    if not attachments:
+        yield from notes
+        return
+    store = AttachmentStore(f"{context_dir}/{ATTACHMENTS_DIR}")
+    for note in notes:
+        store.externalize(note.note)
+        yield note
+    store.log_counts()
+
+
 def _as_sqllite(db_path):
     try:
         cnx = sqlite3.connect(db_path)
@@ -43,20 +120,192 @@ def _as_sqllite(db_path):
     return cnx
 
 
-def _deep_notes_iterator(cnx: Connection, condition: Callable) -> Iterable[NoteTO]:
+def _deep_notes_iterator(cnx: Connection, condition: Callable | NoteFilter) -> Iterable[NoteTO]:
+    """Active notes notebook by notebook. condition is a notebook predicate or a NoteFilter, whose notebook conditions
+    skip the notes of other notebooks before they are decoded."""
     in_storage = NoteStorage(cnx)
-    in_nb_storage = NoteBookStorage(cnx)
+    for nb in _select_notebooks(cnx, condition):
+        logger.debug(f"Processing {nb.name}")
+        yield from _filter_notes((NoteTO(n, nb, status=None) for n in in_storage.iter_notes(nb.guid)), condition)
+
+
+def _backup_notes(db_path: str, condition: Callable | NoteFilter, workers=1) -> Iterable[NoteTO]:
+    """_deep_notes_iterator that decodes notes in a pool of worker processes when workers > 1"""
+    notebooks = _select_notebooks(_as_sqllite(db_path), condition)
+    return _filter_notes(_notes_of_notebooks(db_path, notebooks, workers), condition)
+
 
-    for nb in list(in_nb_storage.iter_notebooks()):
+def _notes_of_notebooks(db_path: str, notebooks: list[Notebook], workers=1) -> Iterable[NoteTO]:
+    if workers > 1:
+        yield from _parallel_notes_iterator(db_path, notebooks, workers)
+        return
+
+    in_storage = NoteStorage(_as_sqllite(db_path))
+    for nb in notebooks:
         logger.debug(f"Processing {nb.name}")
-        if condition(nb):
-            for n in in_storage.iter_notes(nb.guid):
-                yield NoteTO(n, nb, status=None)
+        for n in in_storage.iter_notes(nb.guid):
+            yield NoteTO(n, nb, status=None)
+
+
+def _parallel_notes_iterator(
+    db_path: str, notebooks: list[Notebook], workers: int, batch_size=DECODE_BATCH_SIZE
+) -> Iterable[NoteTO]:
+    """Active notes of the notebooks, decompressed by worker processes that read batches of guids over their own
+    read-only connection. Batches are yielded in notebook and title order like NoteStorage.iter_notes. At most two
+    batches per worker are in flight."""
+    cnx = _as_sqllite(db_path)
+    batches = (
+        (nb, guids[start : start + batch_size])
+        for nb in notebooks
+        for guids in [_note_guids(cnx, nb.guid)]
+        for start in range(0, len(guids), batch_size)
+    )
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_read_only, initargs=(db_path,)) as executor:
+        pending = {}
+        for nb, guids in batches:
+            if len(pending) >= 2 * workers:
+                yield from _oldest_batch(pending)
+            pending[executor.submit(_decompress_batch, guids)] = nb
+        while pending:
+            yield from _oldest_batch(pending)
+
+
+def _oldest_batch(pending: dict) -> Iterable[NoteTO]:
+    # pending keeps submission order
+    future = next(iter(pending))
+    nb = pending.pop(future)
+    for guid, title, raw_pickle in future.result():
+        try:
+            yield NoteTO(pickle.loads(raw_pickle), nb, status=None)
+        except Exception:
+            logger.warning(f"Note '{title}' [{guid}] is corrupt")
+
+
+def _note_guids(cnx: Connection, notebook_guid: str) -> list[str]:
+    # Same selection and order as NoteStorage.iter_notes
+    rows = cnx.execute(
+        "SELECT guid, title FROM notes WHERE notebook_guid = ? AND is_active = 1 AND raw_note IS NOT NULL",
+        (notebook_guid,),
+    )
+    return [row["guid"] for row in sorted(rows, key=lambda row: row["title"])]
+
+
+_worker_cnx: Connection | None = None
+
+
+def _open_read_only(db_path: str):
+    global _worker_cnx
+    _worker_cnx = sqlite3.connect(Path(db_path).absolute().as_uri() + "?mode=ro", uri=True)
+
+
+def _decompress_batch(guids: list[str]) -> list[tuple[str, str, bytes]]:
+    # lzma takes nearly all of the decoding time, the pickles are loaded by the parent, so notes are not pickled twice
+    rows = _worker_cnx.execute(
+        f"SELECT guid, title, raw_note FROM notes WHERE guid IN ({','.join('?' * len(guids))})", guids
+    )
+    by_guid = {guid: (title, raw_note) for guid, title, raw_note in rows}
+    decompressed = []
+    for guid in guids:
+        if guid not in by_guid:
+            # deleted or expunged by a sync running since the guids were listed
+            logger.warning(f"Note [{guid}] disappeared from the backup db while reading it, skipping it")
+            continue
+        title, raw_note = by_guid[guid]
+        if raw_note is None:
+            logger.warning(f"Note '{title}' [{guid}] has no content anymore, skipping it")
+            continue
+        try:
+            decompressed.append((guid, title, lzma.decompress(raw_note)))
+        except Exception:
+            logger.warning(f"Note '{title}' [{guid}] is corrupt")
+    return decompressed
+
+
+def _select_notebooks(cnx: Connection, condition: Callable | NoteFilter) -> list[Notebook]:
+    notebooks = list(NoteBookStorage(cnx).iter_notebooks())
+    if isinstance(condition, NoteFilter):
+        return condition.select_notebooks(notebooks)
+    return [nb for nb in notebooks if condition(nb)]
+
+
+def _filter_notes(notes: Iterable[NoteTO], condition: Callable | NoteFilter) -> Iterable[NoteTO]:
+    if not isinstance(condition, NoteFilter):
+        return notes
+    return (note for note in notes if condition.matches_note(note))
+
+
+def _decode_backup_note(raw_note: bytes) -> Note:
+    return pickle.loads(lzma.decompress(raw_note))
+
+
+def _lazy_notes_iterator(cnx: Connection, db_path: str, condition: Callable | NoteFilter) -> Iterable[NoteTO]:
+    """Like _deep_notes_iterator, but every note is released after its metadata and digest are taken and decoded again
+    from the backup db when its content is needed."""
+    source = SqliteNoteSource(db_path, "SELECT raw_note FROM notes WHERE guid = ?", _decode_backup_note)
+    for note in _deep_notes_iterator(cnx, condition):
+        n = note.note
+        metadata = {name: getattr(n, name) for name in METADATA_FIELDS}
+        yield NoteTO.lazy(source, n.guid, note.notebook, digest=content_digest(n.content), **metadata)
+
+
+def read_note_index(cnx: Connection) -> tuple[dict[str, Note], dict[str, Note]]:
+    """guid -> Note(title) for active and trashed notes, read from the table columns without decoding note blobs"""
+    notes, notes_trash = {}, {}
+    for row in cnx.execute("select guid, title, is_active from notes where raw_note is not NULL"):
+        index = notes if row["is_active"] else notes_trash
+        index[row["guid"]] = Note(guid=row["guid"], title=row["title"])
+
+    return notes, notes_trash
+
+
+@task
+@measured
+def update_link_index(context_dir: str, manifest: pd.DataFrame) -> tuple[dict[str, Note], dict[str, Note]]:
+    with IntermediateStore(context_dir) as store:
+        written, deleted = store.update_link_index(manifest)
+        logger.info(f"Updated link index: {written} notes written, {deleted} deleted")
+        return store.note_index()
 
 
 @task
+@measured
+def read_note_titles(context_dir: str, notes_format: str, db: str) -> tuple[dict[str, Note], dict[str, Note]]:
+    """guid -> Note(title) for active and trashed notes of the source, read from its metadata without decoding notes"""
+    if notes_format == "backup":
+        return read_note_index(_as_sqllite(f"{context_dir}/{db}"))
+    if notes_format == "store":
+        frame = NoteStore(context_dir).metadata(["id", "title", "active"])
+    elif notes_format == "db":
+        with IntermediateStore(context_dir) as store:
+            frame = store.notes_dataframe()
+    else:
+        raise Exception(f"unsupported format: {notes_format}")
+
+    notes, notes_trash = {}, {}
+    for guid, title, active in zip(frame["id"], frame["title"], frame["active"], strict=True):
+        if not pd.isna(active):
+            index = notes if active else notes_trash
+            index[guid] = Note(guid=guid, title=title)
+    return notes, notes_trash
+
+
+def notes_frame(notes: list[NoteTO], include_content=False) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(
+        (note.as_dict(include_content=include_content) for note in notes), columns=NOTE_COLUMNS
+    )
+    return df.astype(NOTES_DTYPES)
+
+
+@task
+@measured
 def write_notes_dataframe(context_dir, notes: list[NoteTO], include_content=False, format=DEFAULT_FORMAT):
-    df = pd.DataFrame([note.as_dict(include_content=include_content) for note in notes])
+    if format == "db":
+        with IntermediateStore(context_dir) as store:
+            store.write_notes(notes, include_raw=False)
+        return
+
+    df = notes_frame(notes, include_content=include_content)
     if format == "parquet":
         df.to_parquet(f"{context_dir}/{NOTES_PARQUET}")
     elif format == "csv":
@@ -66,37 +315,84 @@ def write_notes_dataframe(context_dir, notes: list[NoteTO], include_content=Fals
 
 
 @task
-def write_links_dataframe(context_dir, links: list[dict]):
-    pd.DataFrame(links).to_csv(f"{context_dir}/{LINKS_CSV}", index=False)
+@measured
+def write_links_dataframe(context_dir, links: list[dict], format=DEFAULT_FORMAT):
+    if format == "db":
+        with IntermediateStore(context_dir) as store:
+            store.write_links(links)
+    else:
+        pd.DataFrame(links, columns=LINK_COLUMNS).to_csv(f"{context_dir}/{LINKS_CSV}", index=False)
 
 
 @task
-def read_pickled_notes(context_dir: str, predicate: Callable) -> list[NoteTO]:
+@measured
+def read_pickled_notes(context_dir: str, predicate: Callable | NoteFilter | None) -> list[NoteTO]:
     with open(f"{context_dir}/{NOTES_PICKLE}", "rb") as f:
         res = pickle.load(f)
 
     logger.info(f"Load {len(res)} notes from pickle file")
     if predicate is None:
         return res
+    if isinstance(predicate, NoteFilter):
+        return predicate.apply(res)
     return [n for n in res if predicate(n)]
 
 
 @task
+@measured
+def read_db_notes(context_dir: str, predicate: Callable | NoteFilter | None) -> list[NoteTO]:
+    with IntermediateStore(context_dir) as store:
+        res = store.notes(predicate)
+    logger.info(f"Load {len(res)} notes from {OUT_DB}")
+    return res
+
+
+@task
+@measured
+def read_backup_notes(
+    context_dir: str, db: str, q: Callable | NoteFilter, predicate: Callable | None = None
+) -> list[NoteTO]:
+    db_path = context_dir + "/" + db
+    res = [n for n in _lazy_notes_iterator(_as_sqllite(db_path), db_path, q) if predicate is None or predicate(n)]
+    logger.info(f"Load {len(res)} notes from {db}")
+    return res
+
+
+@task
+@measured
+def read_stored_notes(context_dir: str, predicate: Callable | NoteFilter | None) -> list[NoteTO]:
+    res = NoteStore(context_dir).notes(predicate)
+    logger.info(f"Load {len(res)} notes from note store")
+    return res
+
+
+@task
+@measured
 def read_notes_dataframe(context_dir: str, format=DEFAULT_FORMAT) -> pd.DataFrame:
     if format == "csv":
-        return pd.read_csv(f"{context_dir}/{NOTES_CSV}")
+        return pd.read_csv(f"{context_dir}/{NOTES_CSV}", dtype=NOTES_DTYPES)
     elif format == "parquet":
         return pd.read_parquet(f"{context_dir}/{NOTES_PARQUET}")
+    elif format == "store":
+        return NoteStore(context_dir).metadata()
+    elif format == "db":
+        with IntermediateStore(context_dir) as store:
+            return store.notes_dataframe()
     else:
         raise Exception(f"unsupported format: {format}")
 
 
 @task
-def read_links_dataframe(context_dir: str):
+@measured
+def read_links_dataframe(context_dir: str, format=DEFAULT_FORMAT):
+    if format == "db":
+        with IntermediateStore(context_dir) as store:
+            return store.links_dataframe()
     return pd.read_csv(f"{context_dir}/{LINKS_CSV}")
 
 
 @task
+@measured
 def convert_notebooks_db_to_csv(db: str, context_dir: str):
     cnx = _as_sqllite(context_dir + "/" + db)
 
@@ -1,46 +1,62 @@
 import logging
 from typing import Any
 
-import pandas as pd
 from evernote.edam.type.ttypes import Note
 from prefect import task
 
+from evernote2md.metrics import measured
 from evernote2md.notes_service import NoteTO
-from evernote2md.prepared.link_corrector import ArticleCleaner, LinkFixer, traverse_notes
+from evernote2md.prepared.link_corrector import ArticleCleaner, LinkFixer, TransformerChain, traverse_notes
 from evernote2md.prepared.note_classifier import NoteClassifier
 
 logger = logging.getLogger(__name__)
 
 
 @task(persist_result=False)
-def clean_articles(notes) -> list[NoteTO]:
-    notes_cleaned = traverse_notes(notes, processor=ArticleCleaner())
+@measured
+def clean_articles(notes, workers: int = 1) -> list[NoteTO]:
+    notes_cleaned = traverse_notes(notes, processor=ArticleCleaner(), workers=workers)
     return notes_cleaned
 
 
 @task
-def fix_links(notes_df: pd.DataFrame, notes: list[NoteTO]) -> tuple[list[NoteTO], list[Any]]:
-    from evernote2md.prepared.link_corrector import traverse_notes
+@measured
+def fix_links(
+    note_index: tuple[dict[str, Note], dict[str, Note]], notes: list[NoteTO], workers: int = 1
+) -> tuple[list[NoteTO], list[Any]]:
+    link_fixer = LinkFixer(*note_index)
+    notes_fixed_links = traverse_notes(notes, link_fixer, workers=workers)
+    return notes_fixed_links, link_fixer.buffer
 
-    notes_p = _note_metadata(notes_df, active=True)
-    notes_trash = _note_metadata(notes_df, active=True)
-    link_fixer = LinkFixer(notes_p, notes_trash)
 
-    notes_fixed_links = traverse_notes(notes, link_fixer)
-    return notes_fixed_links, link_fixer.buffer
+@task(persist_result=False)
+@measured
+def transform_notes(
+    note_index: tuple[dict[str, Note], dict[str, Note]], notes: list[NoteTO], workers: int = 1
+) -> tuple[list[NoteTO], list[Any]]:
+    """clean_articles, fix_links and enrich_data fused into a single pass over the notes"""
+    link_fixer = LinkFixer(*note_index)
+    chain = TransformerChain([ArticleCleaner(), link_fixer, NoteClassifier()])
+
+    notes_transformed = traverse_notes(notes, chain, workers=workers)
+    chain.log_statuses()
+    return notes_transformed, link_fixer.buffer
 
 
-def _note_metadata(notes_df: pd.DataFrame, active=True) -> dict[Any, Note]:
-    notes_parquet = notes_df.query("active == @active")
-    mapping = {}
-    for note in notes_parquet.itertuples():
-        # noinspection PyUnresolvedReferences
-        mapping[note.id] = Note(guid=note.id, title=note.title)
+def build_note_index(notes: list[NoteTO]) -> tuple[dict[str, Note], dict[str, Note]]:
+    """guid -> Note(title) for active and trashed notes, built from the loaded notes in one pass"""
+    notes_active, notes_trash = {}, {}
+    for note in notes:
+        active = note.active
+        if active is not None:
+            index = notes_active if active else notes_trash
+            index[note.guid] = Note(guid=note.guid, title=note.title)
 
-    return mapping
+    return notes_active, notes_trash
 
 
 @task
-def enrich_data(links_fixed: list[NoteTO]) -> list[NoteTO]:
-    notes_enriched = traverse_notes(notes=links_fixed, processor=NoteClassifier())
+@measured
+def enrich_data(links_fixed: list[NoteTO], workers: int = 1) -> list[NoteTO]:
+    notes_enriched = traverse_notes(notes=links_fixed, processor=NoteClassifier(), workers=workers)
     return notes_enriched
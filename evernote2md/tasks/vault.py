@@ -0,0 +1,97 @@
+import logging
+import os
+import shutil
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class VaultWriter:
+    """Writes converted files into a vault folder, touching only files whose content changed.
+
+    Changed files are replaced atomically by rename. finish() removes the files that were not written in this run.
+    """
+
+    def __init__(self, target_dir: str):
+        self.target_dir = target_dir
+        self.written = set()
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    def write(self, path: str, data: bytes):
+        full_path = os.path.normpath(os.path.join(self.target_dir, path))
+        self.written.add(full_path)
+
+        if os.path.isfile(full_path):
+            if os.path.getsize(full_path) == len(data) and _read(full_path) == data:
+                self.counts["unchanged"] += 1
+                return
+            self.counts["updated"] += 1
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            self.counts["created"] += 1
+
+        tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+
+    def finish(self, folders: list[str] | None = None) -> dict[str, int]:
+        """Delete files not written in this run, only inside the given subfolders if any, and log the counts."""
+        roots = [self.target_dir] if folders is None else [os.path.join(self.target_dir, f) for f in folders]
+        for root in roots:
+            for dir_path, _, names in os.walk(root, topdown=False):
+                for name in names:
+                    path = os.path.normpath(os.path.join(dir_path, name))
+                    if path not in self.written:
+                        os.remove(path)
+                        self.counts["deleted"] += 1
+                if dir_path != self.target_dir and not os.listdir(dir_path):
+                    os.rmdir(dir_path)
+
+        counts = self.counts
+        logger.info(
+            f"Wrote {self.target_dir}: {counts['created']} created, {counts['updated']} updated, "
+            f"{counts['deleted']} deleted, {counts['unchanged']} unchanged"
+        )
+        return counts
+
+
+def sync_folder(source_dir: str, target_dir: str) -> dict[str, int]:
+    """Make target_dir mirror source_dir, rewriting only what differs."""
+    writer = VaultWriter(target_dir)
+    for dir_path, _, names in os.walk(source_dir):
+        for name in names:
+            path = os.path.join(dir_path, name)
+            writer.write(os.path.relpath(path, source_dir), _read(path))
+    return writer.finish()
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def prune_vault(root: str, folders: dict[str, set[str]]) -> list[str]:
+    """Remove stack folders of root and notebook folders of a stack that are not in folders, stack -> notebooks."""
+    removed = []
+    if not os.path.isdir(root):
+        return removed
+    for stack in os.listdir(root):
+        stack_dir = os.path.join(root, stack)
+        if not os.path.isdir(stack_dir):
+            continue
+        notebooks = folders.get(stack)
+        if notebooks is None:
+            removed.append(stack_dir)
+            continue
+        removed += [
+            os.path.join(stack_dir, notebook)
+            for notebook in os.listdir(stack_dir)
+            if notebook not in notebooks and os.path.isdir(os.path.join(stack_dir, notebook))
+        ]
+
+    for folder in removed:
+        shutil.rmtree(folder)
+    if removed:
+        logger.info(f"Removed {len(removed)} folders of deleted or renamed stacks and notebooks from {root}")
+    return removed
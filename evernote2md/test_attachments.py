@@ -0,0 +1,94 @@
+import copy
+import hashlib
+import io
+import random
+
+from evernote.edam.type.ttypes import Data, Note, NoteAttributes, Resource, ResourceAttributes
+from evernote_backup.note_formatter import NoteFormatter
+
+from evernote2md.flow import ENEX_HEAD, ENEX_TAIL, _write_export_file
+from evernote2md.tasks.attachments import ENCODE_CHUNK, AttachmentStore, StreamingNoteFormatter
+
+
+def build_resource(body: bytes, file_name="a.png"):
+    data = Data(body=body, bodyHash=hashlib.md5(body).digest(), size=len(body))
+    return Resource(data=data, mime="image/png", attributes=ResourceAttributes(fileName=file_name))
+
+
+def build_note(*bodies: bytes):
+    resources = [build_resource(body, f"{i}.png") for i, body in enumerate(bodies)]
+    return Note(guid="g", title="A & <B>", content="<en-note>x</en-note>", created=1, updated=2, resources=resources)
+
+
+def test_streamed_note_is_formatted_like_format_note():
+    rnd = random.Random(1)
+    note = build_note(rnd.randbytes(3 * ENCODE_CHUNK + 7), b"", rnd.randbytes(90))
+    expected = NoteFormatter(add_guid=False, add_metadata=False).format_note(note, "NB", [])
+
+    f = io.StringIO()
+    StreamingNoteFormatter(add_guid=False, add_metadata=False).write_note(f, note, "NB")
+    assert f.getvalue() == expected
+
+
+def test_externalized_bodies_are_stored_once_and_streamed_back(tmp_path):
+    body = random.Random(2).randbytes(1000)
+    first, second = build_note(body), build_note(body)
+    expected = NoteFormatter().format_note(copy.deepcopy(first), "NB", [])
+
+    store = AttachmentStore(str(tmp_path))
+    store.externalize(first)
+    store.externalize(second)
+
+    assert first.resources[0].data.body is None
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == [hashlib.md5(body).hexdigest()]
+    assert store.counts["stored"] == 1 and store.counts["duplicate"] == 1
+
+    f = io.StringIO()
+    StreamingNoteFormatter(store).write_note(f, second, "NB")
+    assert f.getvalue() == expected
+
+
+def build_full_note(guid: str, rnd: random.Random) -> Note:
+    attributes = ResourceAttributes(
+        sourceURL="https://example.com/a?b=1&c=2",
+        timestamp=1700000000000,
+        latitude=52.5,
+        longitude=13.4,
+        altitude=34.0,
+        cameraMake="Make",
+        cameraModel="Model <1>",
+        recoType="unknown",
+        fileName="scan & photo.jpg",
+        attachment=True,
+    )
+    body = rnd.randbytes(ENCODE_CHUNK + 1)
+    data = Data(body=body, bodyHash=hashlib.md5(body).digest(), size=len(body))
+    scan = Resource(data=data, mime="image/jpeg", width=640, height=480, duration=0, attributes=attributes)
+    return Note(
+        guid=guid,
+        title=f"Note {guid} & <more>",
+        content='<?xml version="1.0" encoding="UTF-8"?><en-note><div>x &amp; <en-media hash="h"/></div></en-note>',
+        created=1600000000000,
+        updated=1700000000000,
+        notebookGuid="nb",
+        active=True,
+        tagGuids=["t1"],
+        tagNames=["tag & more"],
+        attributes=NoteAttributes(author="Me", sourceURL="https://example.com", reminderOrder=3, contentClass="c"),
+        resources=[build_resource(rnd.randbytes(90)), scan],
+    )
+
+
+def test_enex_file_is_byte_for_byte_the_one_of_evernote_backup(tmp_path):
+    rnd = random.Random(3)
+    notes = [build_full_note("a", rnd), build_full_note("b", rnd)]
+    stock = NoteFormatter(add_guid=True, add_metadata=True)
+    expected = "".join(stock.format_note(copy.deepcopy(note), "NB", []) for note in notes)
+    expected = ENEX_HEAD + '<en-export application="Evernote" version="10.134.4">\n' + expected + ENEX_TAIL
+
+    store = AttachmentStore(str(tmp_path / "attachments"))
+    store.externalize(notes[1])
+    formatter = StreamingNoteFormatter(store, add_guid=True, add_metadata=True)
+    _write_export_file(tmp_path / "NB.enex", "NB", notes, formatter)
+
+    assert (tmp_path / "NB.enex").read_bytes() == expected.encode("utf-8")
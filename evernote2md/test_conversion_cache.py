@@ -0,0 +1,25 @@
+import os
+
+from evernote2md.tasks.conversion_cache import ConversionCache, note_cache_key
+from evernote2md.test_notes import build_note
+
+
+def test_key_changes_with_content_and_version():
+    key = note_cache_key(build_note("g", "T", content="<en-note/>"), "A", "T", "v1")
+    assert key == note_cache_key(build_note("g", "T", content="<en-note/>"), "A", "T", "v1")
+    assert key != note_cache_key(build_note("g", "T", content="<en-note>x</en-note>"), "A", "T", "v1")
+    assert key != note_cache_key(build_note("g", "T", content="<en-note/>"), "A", "T", "v2")
+
+
+def test_cache_roundtrip_and_lru_eviction(tmp_path):
+    cache = ConversionCache(str(tmp_path), max_bytes=150)
+    cache.put("aa1", {"A/T.md": b"x" * 100})
+    cache.put("bb2", {"A/U.md": b"y" * 100, "A/_resources/U.resources/p.png": b"z"})
+    os.utime(tmp_path / "aa" / "aa1", (0, 0))
+
+    assert cache.get("bb2") == {"A/U.md": b"y" * 100, "A/_resources/U.resources/p.png": b"z"}
+    assert cache.get("cc3") is None
+
+    cache.evict()
+    assert cache.get("aa1") is None
+    assert cache.get("bb2") is not None
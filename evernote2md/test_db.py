@@ -0,0 +1,124 @@
+import pickle
+from datetime import datetime
+
+from evernote2md.tasks.db import IntermediateStore
+from evernote2md.tasks.incremental import build_manifest, content_hash, diff_manifests
+from evernote2md.test_notes import build_note, link_to
+
+
+def manifest(*notes):
+    return build_manifest(list(notes))
+
+
+def test_notes_round_trip_and_frame(tmp_path):
+    with IntermediateStore(str(tmp_path)) as store:
+        store.write_notes([build_note("a"), build_note("b")], batch_size=1)
+        # metadata only update keeps the stored note
+        store.write_notes([build_note("a", title="A2", updated=2)], include_raw=False)
+
+        notes = store.notes()
+        assert [n.guid for n in notes] == ["a", "b"]
+        assert notes[1].notebook.stack == "Core"
+        frame = store.notes_dataframe()
+        assert list(frame["title"]) == ["A2", "B"]
+        assert list(frame["stack"]) == ["Core", "Core"]
+        assert frame["active"].all()
+
+
+def test_links_and_statuses(tmp_path):
+    link = {"from_title": "A", "from_guid": "a", "to_guid": "b", "to_old": "x", "to_new": "B", "status": "ok"}
+    with IntermediateStore(str(tmp_path)) as store:
+        store.write_links([link | {"ts": datetime(2024, 1, 1)}, link | {"from_guid": "c", "to_guid": None}])
+        store.write_links([link | {"to_new": "B2"}], from_guids=["a"])
+
+        links = store.links_dataframe()
+        assert sorted(links["from_guid"]) == ["a", "c"]
+        assert list(links.loc[links["from_guid"] == "a", "to_new"]) == ["B2"]
+
+        store.write_statuses("import", {"nb": "done"})
+    assert IntermediateStore(str(tmp_path)).statuses("import") == {"nb": "done"}
+
+
+def test_notes_load_lazily_and_release(tmp_path):
+    with IntermediateStore(str(tmp_path)) as store:
+        store.write_notes([build_note("a"), build_note("b")])
+        notes = store.notes()
+
+    a, b = notes
+    assert not a.loaded and a.title == "A" and a.updated == 1
+    assert a.content == "<en-note/>" and a.loaded
+    assert a.notebook is b.notebook
+
+    a.note.content = "<en-note>changed</en-note>"
+    assert pickle.loads(pickle.dumps(a)).content == "<en-note>changed</en-note>"
+    copy_b = pickle.loads(pickle.dumps(b))
+    assert not copy_b.loaded and copy_b.title == "B" and copy_b.content == "<en-note/>"
+
+    a.release()
+    assert not a.loaded and a.title == "A" and a.content == "<en-note/>"
+
+
+def test_manifest_of_db_notes_loads_nothing(tmp_path):
+    with IntermediateStore(str(tmp_path)) as store:
+        store.write_notes([build_note("a")])
+        # metadata only updates keep the digest of the stored note
+        store.write_notes([build_note("a", title="A2")], include_raw=False)
+        notes = store.notes()
+
+    manifest = build_manifest(notes)
+    assert not notes[0].loaded
+    assert manifest.loc[0, "title"] == "A2"
+    assert manifest.loc[0, "content_hash"] == content_hash("<en-note/>")
+
+
+def test_link_index_writes_only_changed_notes(tmp_path):
+    a, b, c = build_note("a", content=link_to("b", "c")), build_note("b", content=link_to("c")), build_note("c")
+    with IntermediateStore(str(tmp_path)) as store:
+        assert store.update_link_index(manifest(a, b, c)) == (3, 0)
+        assert store.update_link_index(manifest(a, b, c)) == (0, 0)
+        assert store.backlinks({"c"}) == {"a", "b"}
+
+        assert store.update_link_index(manifest(a, build_note("b", "B renamed"), build_note("c", active=False))) == (
+            2,
+            0,
+        )
+        active, trash = store.note_index()
+        assert {guid: note.title for guid, note in active.items()} == {"a": "A", "b": "B renamed"}
+        assert set(trash) == {"c"}
+        assert store.backlinks({"c"}) == {"a"}
+
+        assert store.update_link_index(manifest(a)) == (0, 2)
+        # links to notes that are gone stay, their notes have to be relinked
+        assert store.backlinks({"b", "c"}) == {"a"}
+        assert store.note_index() == ({"a": active["a"]}, {})
+
+
+def test_link_index_of_imported_notes(tmp_path):
+    notes = [build_note("a", content=link_to("b")), build_note("b")]
+    with IntermediateStore(str(tmp_path)) as store:
+        store.write_notes(notes)
+        assert store.backlinks({"b"}) == {"a"}
+        # the imported notes are indexed already
+        assert store.update_link_index(build_manifest(store.notes())) == (0, 0)
+        assert [note.guid for note in store.notes()] == ["a", "b"]
+
+
+def test_backlinks_from_index_match_scan(tmp_path):
+    previous = manifest(build_note("a", content=link_to("b")), build_note("b"), build_note("c", content=link_to("a")))
+    current = manifest(build_note("a", content=link_to("b")), build_note("b", "B renamed"), build_note("c"))
+    with IntermediateStore(str(tmp_path)) as store:
+        store.update_link_index(current)
+        changes = diff_manifests(previous, current, store.backlinks)
+
+    assert changes == diff_manifests(previous, current)
+    assert changes.relinked == {"a"}
+
+
+def test_link_targets_of_schema_version_2_are_filled_in(tmp_path):
+    with IntermediateStore(str(tmp_path)) as store, store.cnx:
+        store.write_notes([build_note("a", content=link_to("b")), build_note("b")])
+        store.cnx.execute("DELETE FROM link_targets")
+        store.cnx.execute("UPDATE config SET value = '2' WHERE name = 'schema_version'")
+
+    with IntermediateStore(str(tmp_path)) as store:
+        assert store.backlinks({"b"}) == {"a"}
@@ -0,0 +1,189 @@
+import os
+import pickle
+
+import pandas as pd
+import pytest
+from evernote.edam.type.ttypes import Notebook
+from evernote_backup.note_storage import NoteStorage
+
+from benchmarks.corpus import CorpusSpec, write_corpus
+from evernote2md.flow import (
+    ALL_NOTES,
+    ENEX_FOLDER,
+    IN_DB,
+    PROJECT_ROOT,
+    YARLE_WORK_DIR,
+    evernote_to_obsidian_flow,
+    evernote_to_obsidian_streaming_flow,
+    export_enex2,
+    specific_notebook,
+    stream_db_to_enex,
+    yarle,
+)
+from evernote2md.tasks.incremental import MANIFEST_CSV
+from evernote2md.tasks.source import (
+    LINKS_CSV,
+    NOTEBOOK_CSV,
+    NOTES_CSV,
+    NOTES_PICKLE,
+    convert_db_to_pickle,
+    convert_notebooks_db_to_csv,
+    read_pickled_notes,
+)
+from evernote2md.tasks.transforms import build_note_index, transform_notes
+from evernote2md.test_notes import build_note, link_to
+
+YARLE_INSTALLED = os.path.exists(os.path.join(PROJECT_ROOT, "node_modules", "yarle-evernote-to-md"))
+
+
+def md_files(folder):
+    return sorted(os.path.relpath(os.path.join(d, n), folder) for d, _, names in os.walk(folder) for n in names)
+
+
+@pytest.mark.skipif(not YARLE_INSTALLED, reason="yarle is not installed")
+def test_serial_stacks_hold_only_their_own_notebooks(tmp_path):
+    nb_a = Notebook(guid="nb-a", name="A", stack="One")
+    nb_b = Notebook(guid="nb-b", name="B", stack="Two")
+    notes = [build_note("a", "Note A", notebook=nb_a), build_note("b", "Note B", notebook=nb_b)]
+    export_enex2.fn(notes, str(tmp_path), ENEX_FOLDER)
+
+    # like convert_stacks with a single yarle worker, twice, a second run must not carry the first one over
+    for _ in range(2):
+        for stack in ["One", "Two"]:
+            yarle.fn(str(tmp_path), root_source=ENEX_FOLDER, source=stack, target=stack)
+
+    assert md_files(tmp_path / "md" / "One") == ["A/Note A.md"]
+    assert md_files(tmp_path / "md" / "Two") == ["B/Note B.md"]
+
+
+def write_context(context_dir, notes):
+    notebooks = {note.notebook.guid: note.notebook for note in notes}
+    rows = [{"guid": nb.guid, "name": nb.name, "stack": nb.stack} for nb in notebooks.values()]
+    pd.DataFrame(rows).to_csv(context_dir / NOTEBOOK_CSV, index=False)
+    with open(context_dir / NOTES_PICKLE, "wb") as f:
+        pickle.dump(notes, f)
+
+
+def test_filtered_run_resolves_links_to_other_notes_and_keeps_the_manifest(tmp_path):
+    nb_a = Notebook(guid="nb-a", name="A", stack="One")
+    nb_b = Notebook(guid="nb-b", name="B", stack="One")
+    write_context(
+        tmp_path,
+        [build_note("a", "Note A", notebook=nb_a, content=link_to("b")), build_note("b", "Note B", notebook=nb_b)],
+    )
+    evernote_to_obsidian_flow(str(tmp_path), converter="native")
+    persisted = {name: (tmp_path / name).read_bytes() for name in [MANIFEST_CSV, LINKS_CSV, NOTES_CSV]}
+
+    evernote_to_obsidian_flow(str(tmp_path), converter="native", note_filter=specific_notebook("A"))
+
+    assert "[[Note B]]" in (tmp_path / "md" / "One" / "A" / "Note A.md").read_text()
+    assert {name: (tmp_path / name).read_bytes() for name in persisted} == persisted
+
+
+def test_filtered_run_decodes_only_the_selected_notes(tmp_path, monkeypatch):
+    write_corpus(CorpusSpec(notes=60, notebooks=4, stacks=2, resource_ratio=0, articles_ratio=0), str(tmp_path))
+    convert_notebooks_db_to_csv.fn(IN_DB, str(tmp_path))
+    decoded = []
+
+    class CountingStorage(NoteStorage):
+        def iter_notes(self, notebook_guid):
+            decoded.append(notebook_guid)
+            yield from super().iter_notes(notebook_guid)
+
+    monkeypatch.setattr("evernote2md.tasks.source.NoteStorage", CountingStorage)
+    evernote_to_obsidian_flow(
+        str(tmp_path), notes_format="backup", converter="native", note_filter=specific_notebook("Notebook 0")
+    )
+
+    notebooks = pd.read_csv(tmp_path / NOTEBOOK_CSV)
+    assert decoded == list(notebooks.loc[notebooks["name"] == "Notebook 0", "guid"])
+    markdown = [path.read_text() for path in (tmp_path / "md").rglob("*.md")]
+    assert markdown and any("[[" in text for text in markdown)
+    assert not any("evernote:///" in text for text in markdown)
+
+
+def test_native_run_removes_folders_of_renamed_notebooks(tmp_path):
+    nb_a = Notebook(guid="nb-a", name="A", stack="One")
+    nb_b = Notebook(guid="nb-b", name="B", stack="One")
+    write_context(tmp_path, [build_note("a", "Note A", notebook=nb_a), build_note("b", "Note B", notebook=nb_b)])
+    evernote_to_obsidian_flow(str(tmp_path), converter="native")
+
+    nb_b.name = "C"
+    write_context(tmp_path, [build_note("a", "Note A", notebook=nb_a), build_note("b", "Note B", notebook=nb_b)])
+    evernote_to_obsidian_flow(str(tmp_path), incremental=True, converter="native")
+
+    assert md_files(tmp_path / "md" / "One") == ["A/Note A.md", "C/Note B.md"]
+
+
+@pytest.mark.skipif(not YARLE_INSTALLED, reason="yarle is not installed")
+def test_deleted_notebook_leaves_neither_enex_nor_markdown(tmp_path):
+    nb_a = Notebook(guid="nb-a", name="A", stack="One")
+    nb_b = Notebook(guid="nb-b", name="B", stack="One")
+    nb_c = Notebook(guid="nb-c", name="C", stack="Two")
+    notes = [
+        build_note("a", "Note A", notebook=nb_a),
+        build_note("b", "Note B", notebook=nb_b),
+        build_note("c", "Note C", notebook=nb_c),
+    ]
+    write_context(tmp_path, notes)
+    evernote_to_obsidian_flow(str(tmp_path))
+
+    write_context(tmp_path, notes[:1])
+    evernote_to_obsidian_flow(str(tmp_path), incremental=True)
+
+    assert md_files(tmp_path / ENEX_FOLDER) == ["One/A.enex"]
+    assert md_files(tmp_path / "md") == ["One/A/Note A.md"]
+
+
+def test_streamed_enex_files_match_the_pickle_path(tmp_path):
+    write_corpus(CorpusSpec(notes=200, notebooks=6, stacks=2, resource_ratio=0.2, articles_ratio=0.1), str(tmp_path))
+
+    # the pickle of db_to_pickle_flow, in backup db order, not the one of the corpus
+    convert_db_to_pickle.fn(str(tmp_path), IN_DB, ALL_NOTES, attachments=False)
+    notes = read_pickled_notes.fn(str(tmp_path), predicate=None)
+    transformed, links = transform_notes.fn(build_note_index(notes), notes)
+    export_enex2.fn(transformed, str(tmp_path), "from_pickle")
+    stream_db_to_enex.fn(str(tmp_path), IN_DB, ALL_NOTES, "streamed")
+
+    files = md_files(tmp_path / "from_pickle")
+    assert len(files) > 6 and md_files(tmp_path / "streamed") == files
+    for name in files:
+        assert (tmp_path / "streamed" / name).read_bytes() == (tmp_path / "from_pickle" / name).read_bytes(), name
+    streamed = pd.read_csv(tmp_path / LINKS_CSV).query("status == 'success'")
+    resolved = {(link["from_guid"], link["to_guid"]) for link in links if link["status"] == "success"}
+    assert set(zip(streamed["from_guid"], streamed["to_guid"], strict=True)) == resolved
+
+
+def folders(path):
+    return {(p.parent.name, p.stem) for p in path.glob("*/*") if p.is_dir() or p.suffix == ".enex"}
+
+
+@pytest.mark.skipif(not YARLE_INSTALLED, reason="yarle is not installed")
+def test_concurrent_yarle_runs_convert_each_stack_on_its_own(tmp_path):
+    write_corpus(CorpusSpec(notes=40, notebooks=6, stacks=3, resource_ratio=0, articles_ratio=0), str(tmp_path))
+    convert_notebooks_db_to_csv.fn(IN_DB, str(tmp_path))
+
+    evernote_to_obsidian_streaming_flow(str(tmp_path), yarle_workers=3)
+
+    stacks = folders(tmp_path / ENEX_FOLDER)
+    assert len({stack for stack, _ in stacks}) == 3
+    assert folders(tmp_path / "md") == stacks
+    # the work dirs of the stacks are gone
+    assert not list((tmp_path / YARLE_WORK_DIR).iterdir())
+
+
+@pytest.mark.skipif(not YARLE_INSTALLED, reason="yarle is not installed")
+@pytest.mark.parametrize("loose", [True, False])
+def test_pipelined_export_converts_every_stack_once_exported(tmp_path, loose):
+    notebooks = [Notebook(guid=f"nb-{i}", name=f"N{i}", stack=f"S{i % 3}") for i in range(6)]
+    notes = [build_note(f"n{i}", f"Note {i}", notebook=notebooks[i % 6]) for i in range(12)]
+    if loose:
+        notes.append(build_note("loose", "Loose note", notebook=Notebook(guid="nb-loose", name="Loose", stack=None)))
+    write_context(tmp_path, notes)
+
+    evernote_to_obsidian_flow(str(tmp_path), yarle_workers=2)
+
+    enex = [f"S{i % 3}/N{i}.enex" for i in range(6)] + (["Loose.enex"] if loose else [])
+    assert md_files(tmp_path / ENEX_FOLDER) == sorted(enex)
+    # notebooks outside of stacks are exported only
+    assert md_files(tmp_path / "md") == sorted(f"S{i % 3}/N{i % 6}/Note {i}.md" for i in range(12))
@@ -0,0 +1,74 @@
+from evernote.edam.type.ttypes import Note, Notebook
+
+from evernote2md.notes_service import NoteTO
+from evernote2md.tasks.incremental import build_manifest, diff_manifests
+from evernote2md.test_notes import NB, build_note, link_to
+
+NB_B = Notebook(guid="nb-b", name="B", stack="Maps")
+
+
+def corpus(**overrides):
+    notes = {
+        "a": build_note("a", "A", content=link_to("b")),
+        "b": build_note("b", "B", notebook=NB_B),
+        "c": build_note("c", "C", notebook=NB_B),
+    }
+    notes.update(overrides)
+    return build_manifest([note for note in notes.values() if note is not None])
+
+
+def test_unchanged_corpus_has_no_changes():
+    changes = diff_manifests(corpus(), corpus())
+    assert changes.is_empty()
+    assert not changes.notebooks
+
+
+def test_changed_content_affects_only_its_notebook():
+    changes = diff_manifests(corpus(), corpus(c=build_note("c", "C", notebook=NB_B, content="<en-note>x</en-note>")))
+    assert changes.changed == {"c"}
+    assert not changes.relinked
+    assert changes.notebooks == {"nb-b"}
+    assert changes.stacks == {"Maps"}
+
+
+def test_retitled_note_relinks_backlinks():
+    changes = diff_manifests(corpus(), corpus(b=build_note("b", "B renamed", notebook=NB_B, updated=2)))
+    assert changes.retitled == {"b"}
+    assert changes.relinked == {"a"}
+    assert changes.notebooks == {"nb", "nb-b"}
+
+
+def test_deleted_note_relinks_backlinks():
+    changes = diff_manifests(corpus(), corpus(b=None))
+    assert changes.deleted == {"b"}
+    assert changes.relinked == {"a"}
+    assert changes.stacks == {"Core", "Maps"}
+
+
+class CountingSource:
+    def __init__(self, notes):
+        self.notes = {note.guid: note for note in notes}
+        self.loads = 0
+
+    def load_note(self, guid):
+        self.loads += 1
+        return self.notes[guid]
+
+
+def lazy_notes(source):
+    return [
+        NoteTO.lazy(source, n.guid, NB, guid=n.guid, title=n.title, updated=n.updated, contentLength=n.contentLength)
+        for n in source.notes.values()
+    ]
+
+
+def test_manifest_hashes_only_notes_changed_since_the_previous_one():
+    notes = [Note(guid=guid, title=guid, content=link_to("b"), updated=1, contentLength=10) for guid in "ab"]
+    source = CountingSource(notes)
+    previous = build_manifest(lazy_notes(source))
+    assert source.loads == 2
+
+    source.notes["b"] = Note(guid="b", title="b", content="<en-note/>", updated=2, contentLength=10)
+    manifest = build_manifest(lazy_notes(source), previous)
+    assert source.loads == 3
+    assert list(manifest["links"]) == ["b", ""]
@@ -0,0 +1,71 @@
+import hashlib
+
+from evernote.edam.type.ttypes import Data, Note, NoteAttributes, Notebook, Resource, ResourceAttributes
+
+from evernote2md.flow import YARLE_CONFIG, YARLE_TEMPLATE
+from evernote2md.notes_service import NoteTO
+from evernote2md.prepared.markdown_converter import MarkdownConverter
+from evernote2md.prepared.markdown_rules import post_process_markdown
+
+NB = Notebook(guid="nb", name="Maps", stack="Core")
+
+
+def convert(content, **kwargs):
+    converter = MarkdownConverter.from_files(YARLE_CONFIG, YARLE_TEMPLATE)
+    note = NoteTO(Note(guid="g", title="Note: A", content=content, **kwargs), NB, None)
+    return converter.convert(note, "Maps")
+
+
+def test_converts_formatting_and_links():
+    files = convert(
+        """<en-note><div><b>Bold</b> and <i>italic</i></div><div><a href="B_newname" type="file">B_newname</a></div>"""
+        """<div><a href="https://example.com">site</a></div><ul><li>one</li><li>two</li></ul></en-note>""",
+        tagNames=["a_b c"],
+    )
+
+    md = files["Maps/Note_ A.md"].decode()
+    assert "**Bold** and _italic_" in md
+    assert "[[B_newname]]" in md
+    assert "[site](https://example.com)" in md
+    assert "- one\n- two" in md
+    assert "#a---b-c" in md
+
+
+def test_template_blocks_follow_config():
+    md = convert("<en-note><div>x</div></en-note>", created=864000000, attributes=NoteAttributes())["Maps/Note_ A.md"]
+    assert b"Created at: 1970-01-11" in md
+    assert b"Source URL" not in md
+
+
+def test_unparsable_note_keeps_its_text_only():
+    md = convert("<en-note><div>Fish &amp; chips<br/>no closing tag</div><div><b>menu</en-note>")["Maps/Note_ A.md"]
+    assert b"Fish & chips\nno closing tag\nmenu" in md
+    assert b"<" not in md.split(b"---")[-1]
+
+
+def test_attachments_written_next_to_note():
+    body = b"\x89PNG"
+    resource = Resource(
+        data=Data(body=body, bodyHash=hashlib.md5(body).digest()),
+        mime="image/png",
+        attributes=ResourceAttributes(fileName="pic.png"),
+    )
+    content = f'<en-note><div><en-media hash="{hashlib.md5(body).hexdigest()}" type="image/png"/></div></en-note>'
+
+    files = convert(content, resources=[resource])
+    assert files["Maps/_resources/Note_ A.resources/pic.png"] == body
+    assert b"[[./_resources/Note_ A.resources/pic.png]]" in files["Maps/Note_ A.md"]
+
+
+def test_post_process_rewrites_embeds_and_reports_failures(tmp_path):
+    (tmp_path / "A").mkdir()
+    (tmp_path / "A" / "a.md").write_text("see ![[b]] and ![[c|C]]\n", encoding="utf-8")
+    (tmp_path / "A" / "b.md").write_text("[[a]]\n", encoding="utf-8")
+    (tmp_path / "A" / "broken.md").write_bytes(b"\xff\xfe![[x]]")
+    (tmp_path / "A" / "p.png").write_bytes(b"![[")
+
+    counts = post_process_markdown(str(tmp_path), workers=2)
+
+    assert counts == {"files": 3, "rewritten": 1, "failed": 1}
+    assert (tmp_path / "A" / "a.md").read_text(encoding="utf-8") == "see [[b]] and [[c|C]]\n"
+    assert (tmp_path / "A" / "p.png").read_bytes() == b"![["
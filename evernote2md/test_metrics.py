@@ -0,0 +1,42 @@
+import json
+from collections import Counter
+
+from evernote2md import metrics
+from evernote2md.metrics import collecting, measured, record_statuses, write_metrics
+
+
+@measured
+def transform(notes):
+    record_statuses("Fixer", Counter([None, "processed", "processed"]))
+    return notes
+
+
+def test_measured_stages_are_written_to_metrics_file(tmp_path, monkeypatch):
+    monkeypatch.setenv(metrics.PROFILE_ENV, "transform")
+
+    class Note:
+        note = None
+
+    with collecting() as stages:
+        transform([Note(), Note(), Note()])
+    path = write_metrics(str(tmp_path), "test_run", stages)
+
+    with open(path) as f:
+        stage = json.load(f)["stages"][0]
+    assert stage["stage"] == "transform"
+    assert stage["notes"] == 3
+    assert stage["statuses"] == {"Fixer": {"None": 1, "processed": 2}}
+    assert stage["wall_s"] >= 0 and stage["peak_rss_mb"] > 0
+    assert stage["profile"].endswith(".txt")
+
+
+def test_stages_are_recorded_only_while_collecting():
+    transform([])
+    with collecting() as stages:
+        transform([])
+        with collecting() as inner:
+            transform([])
+        transform([])
+    transform([])
+
+    assert len(stages) == 2 and len(inner) == 1
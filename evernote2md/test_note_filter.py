@@ -0,0 +1,52 @@
+import pandas as pd
+from evernote.edam.type.ttypes import Note, Notebook
+
+from evernote2md.note_filter import NoteFilter
+from evernote2md.notes_service import NoteTO
+from evernote2md.tasks.db import IntermediateStore
+from evernote2md.tasks.note_store import NoteStore
+
+NOTEBOOKS = [
+    Notebook(guid="core", name="Ideas", stack="Core"),
+    Notebook(guid="articles", name="IT Articles", stack=None),
+    Notebook(guid="daily", name="Dailys", stack="Journal"),
+]
+
+
+def build_notes():
+    return [
+        NoteTO(Note(guid=f"{nb.guid}{i}", title=f"{nb.name} {i}", content="<en-note/>", updated=i, active=True), nb)
+        for nb in NOTEBOOKS
+        for i in range(3)
+    ]
+
+
+def test_notebook_conditions():
+    notebooks = pd.DataFrame([{"guid": nb.guid, "name": nb.name, "stack": nb.stack} for nb in NOTEBOOKS])
+
+    assert NoteFilter().notebook_guids(notebooks) is None
+    assert NoteFilter(stacks=frozenset(["Core"])).notebook_guids(notebooks) == ["core"]
+    assert NoteFilter(exclude_notebooks=frozenset(["Dailys"])).notebook_guids(notebooks) == ["core", "articles"]
+    assert NoteFilter(sensitivity=frozenset(["public"])).notebook_guids(notebooks) == ["articles"]
+    assert NoteFilter(sensitivity=frozenset(["private"])).notebook_guids(notebooks) == ["daily"]
+    # an empty set of values is a condition no notebook meets, everywhere
+    for empty in [NoteFilter(sensitivity=frozenset()), NoteFilter(stacks=frozenset())]:
+        assert empty.has_notebook_conditions
+        assert empty.notebook_guids(notebooks) == []
+        assert empty.apply(build_notes()) == []
+
+
+def test_readers_push_filters_down(tmp_path):
+    notes = build_notes()
+    NoteStore(str(tmp_path)).write(notes)
+    with IntermediateStore(str(tmp_path)) as store:
+        store.write_notes(notes)
+
+        note_filter = NoteFilter(stacks=frozenset(["Core", "Journal"]), updated_since=2)
+        expected = ["core2", "daily2"]
+        assert [n.guid for n in note_filter.apply(notes)] == expected
+        assert [n.guid for n in store.notes(note_filter)] == expected
+        assert [n.guid for n in NoteStore(str(tmp_path)).notes(note_filter)] == expected
+
+        assert store.notes(NoteFilter(active=False)) == []
+        assert NoteStore(str(tmp_path)).notes(NoteFilter(notebooks=frozenset(["Nothing"]))) == []
@@ -0,0 +1,62 @@
+import pickle
+
+from evernote.edam.type.ttypes import Notebook
+
+from evernote2md.note_filter import NoteFilter
+from evernote2md.notes_service import NoteTO
+from evernote2md.tasks.incremental import build_manifest, content_hash
+from evernote2md.tasks.note_store import NoteStore
+from evernote2md.test_notes import build_note
+
+
+def test_store_loads_content_lazily(tmp_path):
+    loose = Notebook(guid="nb", name="A", stack=None)
+    NoteStore(str(tmp_path)).write(
+        [build_note(guid, notebook=loose, content=f"<en-note>{guid}</en-note>", tagNames=["t"]) for guid in "ab"]
+    )
+
+    notes = NoteStore(str(tmp_path)).notes()
+    assert [n.title for n in notes] == ["A", "B"]
+    assert notes[0].as_dict(include_content=False)["tagNames"] == ["t"]
+    assert notes[0]._note is None
+    assert notes[1].content == "<en-note>b</en-note>"
+    assert notes[0].notebook is notes[1].notebook
+    assert notes[0].notebook.stack is None
+
+
+def test_store_appends_only_updated_notes(tmp_path):
+    store = NoteStore(str(tmp_path))
+    store.write([build_note("a", content="x" * 1000), build_note("b", content="y" * 1000)])
+    size = (tmp_path / "notes_content.bin").stat().st_size
+
+    store.write([build_note("a", content="x" * 1000), build_note("b", content="z" * 1000, updated=2)])
+    assert size < (tmp_path / "notes_content.bin").stat().st_size < 2 * size
+    assert [n.content[0] for n in NoteStore(str(tmp_path)).notes()] == ["x", "z"]
+
+
+def test_stored_note_pickles_as_note_to(tmp_path):
+    NoteStore(str(tmp_path)).write([build_note("a", content="<en-note>a</en-note>")])
+
+    note = pickle.loads(pickle.dumps(NoteStore(str(tmp_path)).notes()[0]))
+    assert isinstance(note, NoteTO)
+    assert note.content == "<en-note>a</en-note>"
+
+
+def test_manifest_of_stored_notes_loads_nothing(tmp_path):
+    content = '<en-note><a href="evernote:///view/1/s1/b/b/">b</a></en-note>'
+    NoteStore(str(tmp_path)).write([build_note("a", content=content)])
+
+    notes = NoteStore(str(tmp_path)).notes()
+    manifest = build_manifest(notes)
+    assert not notes[0].loaded
+    assert manifest.loc[0, "content_hash"] == content_hash(content)
+    assert manifest.loc[0, "links"] == "b"
+
+
+def test_store_without_notes(tmp_path):
+    store = NoteStore(str(tmp_path))
+    store.write([])
+    assert store.notes() == [] and store.notes(NoteFilter(notebooks=frozenset(["A"]), active=True)) == []
+
+    store.write([build_note("a", content="<en-note>a</en-note>")])
+    assert [n.content for n in NoteStore(str(tmp_path)).notes()] == ["<en-note>a</en-note>"]
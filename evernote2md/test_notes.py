@@ -1,10 +1,21 @@
+import copyreg
 import logging
+import pickle
 import uuid
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 
+from evernote.edam.type.ttypes import Note as EvernoteNote
+from evernote.edam.type.ttypes import Notebook
+
 from evernote2md.notes_service import NoteTO
-from evernote2md.prepared.link_corrector import LinkFixer, find_linked_note
+from evernote2md.prepared.link_corrector import (
+    LinkFixer,
+    NoteTransformer,
+    TransformerChain,
+    find_linked_note,
+    traverse_notes,
+)
 
 # Create a logger
 logger = logging.getLogger()
@@ -36,6 +47,22 @@ def build_noteto(title, content=None):
     return NoteTO(note=Note(title=title, content=content, guid=str(uuid.uuid4())), notebook=None, status="success")
 
 
+NB = Notebook(guid="nb", name="A", stack="Core")
+
+
+def build_note(guid, title=None, notebook=NB, content="<en-note/>", **fields) -> NoteTO:
+    """NoteTO of an evernote Note, the title defaults to the upper cased guid and fields are further Note fields."""
+    fields = {"created": 1, "updated": 1, "active": True, "contentLength": len(content)} | fields
+    note = EvernoteNote(guid=guid, title=title or guid.upper(), content=content, **fields)
+    return NoteTO(note, notebook, status=None)
+
+
+def link_to(*guids) -> str:
+    """ENML with an evernote link to each of the guids, the text of a link is its guid."""
+    links = "".join(f'<div><a href="evernote:///view/9214951/s86/{guid}/{guid}/">{guid}</a></div>' for guid in guids)
+    return f"<en-note>{links}</en-note>"
+
+
 def test_fix_links():
     en_note = """
         <en-note><div><a href="evernote:///view/9214951/s86/eac75a87-f509-4eb3-a53c-9718cc6437d9/eac75a87-f509-4eb3-a53c-9718cc6437d9/" style="color: #69aa35;">B</a></div></en-note>
@@ -105,3 +132,76 @@ def xtest_evernote_wrapped_in_cdata():
     p.note_guid_to_titles_dict = {"b": build_noteto(title="B_newname")}
     x = p.transform(build_noteto(title="B", content=content))
     assert ">B_newname<" in x.content
+
+
+def test_parallel_traverse_keeps_order_and_links():
+    content = """<en-note><div><a href="evernote:///view/9214951/s86/b/x/">B</a></div></en-note>"""
+    notes = [build_noteto(title=f"N{i}", content=content if i % 3 == 0 else "<en-note/>") for i in range(600)]
+    p = LinkFixer(note_guid_to_titles_dict={"b": build_noteto(title="B_newname").note}, notes_trash={})
+
+    x = traverse_notes(notes, p, workers=2, chunk_size=50)
+    assert [n.title for n in x] == [n.title for n in notes]
+    assert [r["from_title"] for r in p.buffer] == [f"N{i}" for i in range(0, 600, 3)]
+    assert ">B_newname<" in x[0].content
+
+
+def test_note_without_links_is_not_reserialized():
+    content = (
+        """<!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd"><en-note><div><br /></div></en-note>"""
+    )
+    x = LinkFixer(note_guid_to_titles_dict={}, notes_trash={}).transform(build_noteto(title="A", content=content))
+    assert x.content == content
+
+
+def test_evernote_link_rewritten_in_place():
+    content = """<!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd"><en-note><div>a&nbsp;b<br /></div><div><a href="evernote:///view/9214951/s86/b/x/" rev="en_rl_none"><span style="color:#69aa35;">B</span></a> tail</div></en-note>"""
+    p = LinkFixer(note_guid_to_titles_dict={"b": build_noteto(title="B_newname").note}, notes_trash={})
+    x = p.transform(build_noteto(title="A", content=content))
+    assert x.content == content.replace(
+        """<a href="evernote:///view/9214951/s86/b/x/" rev="en_rl_none"><span style="color:#69aa35;">B</span></a>""",
+        """<a href="B_newname" rev="en_rl_none" type="file">B_newname</a>""",
+    )
+    assert len(p.buffer) == 1
+
+
+def test_unusual_anchor_falls_back_to_tree():
+    content = """<en-note><div><a href='evernote:///view/9214951/s86/b/x/'>B</a></div></en-note>"""
+    p = LinkFixer(note_guid_to_titles_dict={"b": build_noteto(title="B_newname").note}, notes_trash={})
+    x = p.transform(build_noteto(title="A", content=content))
+    assert ">B_newname<" in x.content
+    assert len(p.buffer) == 1
+
+
+class DivCounter(NoteTransformer):
+    def wants_tree(self, note):
+        return True
+
+    def transform_tree(self, note, root):
+        note.status = f"divs={len(root.findall('.//div'))}"
+        return note
+
+
+def test_chain_shares_tree_between_stages():
+    content = """<en-note><div><a href="evernote:///view/9214951/s86/b/x/">B</a></div></en-note>"""
+    p = LinkFixer(note_guid_to_titles_dict={"b": build_noteto(title="B_newname").note}, notes_trash={})
+    chain = TransformerChain([p, DivCounter()])
+
+    x = chain.transform(build_noteto(title="A", content=content))
+    assert ">B_newname<" in x.content
+    assert x.status == "divs=1"
+    assert len(p.buffer) == 1
+    assert chain.statuses["LinkFixer"]["processed"] == 1
+
+
+def test_unpickles_dataclass_note_to():
+    class OldNoteTO:
+        # what the former NoteTO dataclass pickled to
+        def __reduce_ex__(self, protocol):
+            note = EvernoteNote(guid="g", title="T", content="<en-note/>")
+            return copyreg._reconstructor, (NoteTO, object, None), {"note": note, "notebook": None, "status": "success"}
+
+    note = pickle.loads(pickle.dumps(OldNoteTO()))
+    assert isinstance(note, NoteTO)
+    assert (note.guid, note.title, note.content, note.status) == ("g", "T", "<en-note/>", "success")
+    note.release()
+    assert note.loaded
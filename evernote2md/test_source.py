@@ -0,0 +1,32 @@
+from benchmarks.corpus import CorpusSpec, write_corpus
+from evernote2md.flow import ALL_NOTES
+from evernote2md.tasks.source import (
+    _as_sqllite,
+    _backup_notes,
+    _decompress_batch,
+    _deep_notes_iterator,
+    _note_guids,
+    _open_read_only,
+    _select_notebooks,
+)
+
+
+def test_parallel_decoding_matches_serial(tmp_path):
+    write_corpus(CorpusSpec(notes=300, notebooks=4), str(tmp_path))
+    db_path = str(tmp_path / "en_backup.db")
+
+    serial = [(n.guid, n.notebook.guid, n.content) for n in _deep_notes_iterator(_as_sqllite(db_path), ALL_NOTES)]
+    parallel = [(n.guid, n.notebook.guid, n.content) for n in _backup_notes(db_path, ALL_NOTES, workers=2)]
+    assert parallel == serial
+
+
+def test_batch_skips_notes_deleted_since_listing(tmp_path):
+    write_corpus(CorpusSpec(notes=10, notebooks=1), str(tmp_path))
+    db_path = str(tmp_path / "en_backup.db")
+    cnx = _as_sqllite(db_path)
+    guids = _note_guids(cnx, _select_notebooks(cnx, ALL_NOTES)[0].guid)
+    with cnx:
+        cnx.execute("DELETE FROM notes WHERE guid = ?", (guids[3],))
+
+    _open_read_only(db_path)
+    assert [guid for guid, _, _ in _decompress_batch(guids)] == guids[:3] + guids[4:]
@@ -0,0 +1,21 @@
+from evernote2md.tasks.transforms import build_note_index, fix_links
+from evernote2md.test_notes import build_note, link_to
+
+
+def test_links_resolve_to_active_notes_and_report_trashed_ones():
+    notes = [
+        build_note("a", "A", content=link_to("b", "t", "gone")),
+        build_note("b", "B"),
+        build_note("t", "Trashed", active=False),
+    ]
+    active, trash = build_note_index(notes)
+    assert set(active) == {"a", "b"} and set(trash) == {"t"}
+
+    fixed, links = fix_links.fn((active, trash), notes[:1])
+
+    assert [(link["to_old"], link["status"]) for link in links] == [
+        ("b", "success"),
+        ("t", "trash"),
+        ("gone", "fail"),
+    ]
+    assert ">B<" in fixed[0].content and ">t<" in fixed[0].content
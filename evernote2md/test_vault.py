@@ -0,0 +1,42 @@
+import os
+
+from evernote2md.tasks.vault import VaultWriter, prune_vault, sync_folder
+
+
+def test_sync_folder_touches_only_changed_files(tmp_path):
+    source, target = tmp_path / "src", tmp_path / "md"
+    (source / "A").mkdir(parents=True)
+    (source / "A" / "a.md").write_bytes(b"a")
+    (source / "A" / "b.md").write_bytes(b"b")
+    assert sync_folder(str(source), str(target)) == {"created": 2, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    os.utime(target / "A" / "a.md", (0, 0))
+    (source / "A" / "b.md").write_bytes(b"bb")
+    (source / "A" / "b.md").rename(source / "A" / "c.md")
+    (source / "A" / "a.md").write_bytes(b"a")
+
+    assert sync_folder(str(source), str(target)) == {"created": 1, "updated": 0, "unchanged": 1, "deleted": 1}
+    assert os.stat(target / "A" / "a.md").st_mtime == 0
+    assert sorted(os.listdir(target / "A")) == ["a.md", "c.md"]
+
+
+def test_finish_deletes_only_inside_written_folders(tmp_path):
+    for folder in ["A", "B"]:
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "old.md").write_bytes(b"x")
+
+    writer = VaultWriter(str(tmp_path))
+    writer.write("A/new.md", b"y")
+    assert writer.finish(["A"])["deleted"] == 1
+
+    assert os.listdir(tmp_path / "A") == ["new.md"]
+    assert os.listdir(tmp_path / "B") == ["old.md"]
+
+
+def test_prune_vault_removes_unknown_stacks_and_notebooks(tmp_path):
+    for folder in ["One/A", "One/Old", "Gone/B"]:
+        (tmp_path / folder).mkdir(parents=True)
+        (tmp_path / folder / "n.md").write_bytes(b"x")
+
+    prune_vault(str(tmp_path), {"One": {"A"}, "Two": {"C"}})
+    assert [str(p.relative_to(tmp_path)) for p in sorted(tmp_path.rglob("*"))] == ["One", "One/A", "One/A/n.md"]
@@ -0,0 +1,113 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from graph.link_graph import LinkGraph
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_PARQUET = "notes_analytics.parquet"
+
+
+def pagerank(graph: LinkGraph, damping=0.85, tol=1e-6, max_iter=100) -> np.ndarray:
+    """Power iteration over the edge arrays, parallel links add weight like in networkx.pagerank."""
+    n = graph.n_nodes
+    if n == 0:
+        return np.zeros(0)
+
+    out_degree = np.bincount(graph.sources, minlength=n).astype(float)
+    dangling = out_degree == 0
+    weights = 1.0 / out_degree[graph.sources]
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        spread = np.bincount(graph.targets, weights=rank[graph.sources] * weights, minlength=n)
+        updated = damping * (spread + rank[dangling].sum() / n) + (1 - damping) / n
+        converged = np.abs(updated - rank).sum() < n * tol
+        rank = updated
+        if converged:
+            break
+    return rank
+
+
+def label_propagation(graph: LinkGraph, max_iter=50, seed=0) -> np.ndarray:
+    """Community labels by label propagation on the undirected graph.
+
+    Every round, a random half of the nodes takes the label most frequent among its neighbours, keeping its own label
+    on ties when it is one of the most frequent and picking a random one otherwise. Updating only half avoids the label
+    oscillation of fully synchronous rounds. Labels are renumbered by community size, 0 is the largest.
+    """
+    n = graph.n_nodes
+    loops = graph.sources == graph.targets
+    nodes = np.concatenate([graph.sources[~loops], graph.targets[~loops]])
+    neighbours = np.concatenate([graph.targets[~loops], graph.sources[~loops]])
+    rng = np.random.default_rng(seed)
+
+    labels = np.arange(n)
+    for _ in range(max_iter):
+        best = _most_frequent_neighbour_label(n, nodes, labels[neighbours], labels, rng)
+        if np.array_equal(best, labels):
+            break
+        labels = np.where(rng.random(n) < 0.5, best, labels)
+
+    _, codes, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    rank_by_size = np.empty_like(sizes)
+    rank_by_size[np.argsort(-sizes, kind="stable")] = np.arange(len(sizes))
+    return rank_by_size[codes]
+
+
+def _most_frequent_neighbour_label(n: int, nodes: np.ndarray, labels_of_neighbours, labels: np.ndarray, rng):
+    pairs, counts = np.unique(nodes.astype(np.int64) * n + labels_of_neighbours, return_counts=True)
+    if not len(pairs):
+        return labels.copy()
+    pair_nodes, pair_labels = pairs // n, pairs % n
+    # per node: highest count first, then its own label, then a random one among equal counts
+    order = np.lexsort((rng.random(len(pairs)), pair_labels != labels[pair_nodes], -counts, pair_nodes))
+    first = order[np.r_[True, pair_nodes[order][1:] != pair_nodes[order][:-1]]]
+    best = labels.copy()
+    best[pair_nodes[first]] = pair_labels[first]
+    return best
+
+
+def linked_communities(graph: LinkGraph, communities: np.ndarray) -> np.ndarray:
+    """Number of communities other than its own a node links to or is linked from."""
+    nodes = np.concatenate([graph.sources, graph.targets])
+    other = communities[np.concatenate([graph.targets, graph.sources])]
+    foreign = other != communities[nodes]
+    pairs = np.unique(nodes[foreign].astype(np.int64) * graph.n_nodes + other[foreign])
+    return np.bincount(pairs // graph.n_nodes, minlength=graph.n_nodes)
+
+
+def note_analytics(graph: LinkGraph, notes: pd.DataFrame, hub_quantile=0.99, min_hub_degree=3) -> pd.DataFrame:
+    """One row per note, keyed by id like NotesWide."""
+    n = graph.n_nodes
+    in_degree = np.bincount(graph.targets, minlength=n)
+    out_degree = np.bincount(graph.sources, minlength=n)
+    degree = in_degree + out_degree
+    communities = label_propagation(graph)
+    community_sizes = np.bincount(communities, minlength=n)
+    linked = linked_communities(graph, communities)
+    hub_degree = max(np.quantile(degree, hub_quantile), min_hub_degree) if n else min_hub_degree
+
+    metrics = pd.DataFrame(
+        {
+            "id": graph.guids,
+            "pagerank": pagerank(graph),
+            "in_degree": in_degree,
+            "out_degree": out_degree,
+            "component": graph.components(),
+            "main_component": graph.main_component(),
+            "community": communities,
+            "community_size": community_sizes[communities],
+            "communities_linked": linked,
+            "is_hub": degree >= hub_degree,
+            "is_bridge": linked >= 2,
+        }
+    )
+    # guids that are link targets but not notes only shape the metrics of the notes
+    analytics = metrics[metrics["id"].isin(notes["id"])]
+    logger.info(
+        f"Analytics of {len(analytics)} notes: {len(np.unique(communities))} communities, "
+        f"{int(analytics['is_hub'].sum())} hubs, {int(analytics['is_bridge'].sum())} bridges"
+    )
+    return analytics.reset_index(drop=True)
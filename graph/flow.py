@@ -1,14 +1,20 @@
-import json
+import logging
 import os
 
-import networkx as nx
 import pandas as pd
 from prefect import flow, task
 
-from evernote2md.tasks.source import read_links_dataframe, read_notes_dataframe
+from evernote2md.metrics import collect_metrics, measured
+from evernote2md.tasks.source import DEFAULT_FORMAT, read_links_dataframe, read_notes_dataframe
+from graph.analytics import ANALYTICS_PARQUET, note_analytics
+from graph.link_graph import LinkGraph
+from graph.writers import write_d3_json, write_graphml
+
+logger = logging.getLogger(__name__)
 
 
 @task
+@measured
 def build_cosma(context_dir):
     notes = read_notes_dataframe(context_dir)
     links = read_links_dataframe(context_dir)
@@ -21,60 +27,48 @@ def build_cosma(context_dir):
 
 
 @task
-def build_graph_ml(context_dir, notes, links):
-    vertices = list(notes["id"])
-    edges = links[["from_guid", "to_guid"]]
-    edges = [(e[1], e[2]) for e in edges.itertuples()]
-
-    G = nx.MultiDiGraph()
-    G.add_nodes_from(vertices)
-    G.add_edges_from(edges)
-
-    connected_components = sorted(nx.connected_components(G.to_undirected()), key=len, reverse=True)
-    largest_component = connected_components[0]
+@measured
+def build_graph_ml(context_dir, notes, links, graphml=True, compact=False, compress=False) -> LinkGraph:
+    graph = LinkGraph.from_frames(notes, links)
+    main = graph.main_component()
+    logger.info(f"Link graph of {graph.n_nodes} notes and {graph.n_edges} links, main component of {main.sum()} notes")
 
-    G_main = G.subgraph(largest_component).copy()
-    nx.write_graphml(G, f"{context_dir}/notes.graphml")
-    nx.write_graphml(G_main, f"{context_dir}/notes_main.graphml")
-    # nx.write_gexf(G, 'notes.gexf')
-    return G_main
+    if graphml:
+        write_graphml(graph, f"{context_dir}/notes.graphml", compact=compact, compress=compress)
+        write_graphml(graph.subgraph(main), f"{context_dir}/notes_main.graphml", compact=compact, compress=compress)
+    return graph
 
 
 @task
-def build_d3_json(context_dir, notes, links, G_main):
+@measured
+def build_d3_json(context_dir, notes, links, graph: LinkGraph, compact=False, compress=False):
     output_json = context_dir + "/d3.json"
+    main = graph.main_component()
 
-    print(G_main.nodes)
-
-    nodes_list = [{"id": row["title"], "group": 1} for index, row in notes.iterrows() if row["id"] in G_main.nodes]
-    links = links.query("~to_guid.isnull()")
-
-    # Process links DataFrame
-    links_list = [
-        {
-            "source": row["from_title"],
-            "target": row["to_new"] if pd.notna(row["to_new"]) else row["to_old"],
-            "value": 1,  # Assuming a default value of 1 for all links; adjust as necessary
-        }
-        for index, row in links.iterrows()
-        if row["from_guid"] in G_main.nodes and row["to_guid"] in G_main.nodes
-    ]
+    notes = notes[graph.contains(notes["id"], main)]
+    links = links[links["to_guid"].notna()]
+    links = links[graph.contains(links["from_guid"], main) & graph.contains(links["to_guid"], main)]
+    targets = links["to_new"].where(links["to_new"].notna(), links["to_old"])
 
-    # Combine into a single dictionary
-    output_dict = {"nodes": nodes_list, "links": links_list}
+    write_d3_json(output_json, notes["title"], links["from_title"], targets, compact=compact, compress=compress)
+    logger.info(f"Data successfully written to {output_json}")
 
-    # Write to JSON file
-    with open(output_json, "w", encoding="utf-8") as json_file:
-        json.dump(output_dict, json_file, indent=4, ensure_ascii=False)
 
-    print(f"Data successfully written to {output_json}")
+@task
+@measured
+def build_graph_analytics(context_dir, notes, graph: LinkGraph) -> pd.DataFrame:
+    analytics = note_analytics(graph, notes)
+    analytics.to_parquet(f"{context_dir}/{ANALYTICS_PARQUET}", index=False)
+    return analytics
 
 
 @flow
-def build_graph_stuff(context_dir):
-    notes = read_notes_dataframe(context_dir)
-    links = read_links_dataframe(context_dir)
-
-    G_main = build_graph_ml(context_dir, notes, links)
-    build_d3_json(context_dir, notes, links, G_main)
+@collect_metrics
+def build_graph_stuff(context_dir, format=DEFAULT_FORMAT, compact=False, compress=False):
+    notes = read_notes_dataframe(context_dir, format=format)
+    links = read_links_dataframe(context_dir, format=format)
+
+    graph = build_graph_ml(context_dir, notes, links, compact=compact, compress=compress)
+    build_d3_json(context_dir, notes, links, graph, compact=compact, compress=compress)
+    build_graph_analytics(context_dir, notes, graph)
     # build_cosma()
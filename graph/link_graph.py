@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+
+class LinkGraph:
+    """Directed multigraph of note links backed by arrays: node i is guids[i], edge k goes from sources[k] to
+    targets[k]. Components are labelled with a vectorized union-find."""
+
+    def __init__(self, guids: np.ndarray, sources: np.ndarray, targets: np.ndarray):
+        self.guids = guids
+        self.sources = sources
+        self.targets = targets
+        self.index = pd.Index(guids)
+        self._components = None
+
+    @classmethod
+    def from_frames(cls, notes: pd.DataFrame, links: pd.DataFrame) -> "LinkGraph":
+        """Nodes are the notes plus any other guid links point at, links without a target guid are left out."""
+        links = links[links["from_guid"].notna() & links["to_guid"].notna()]
+        endpoints = np.concatenate(
+            [
+                notes["id"].to_numpy(dtype=object),
+                links["from_guid"].to_numpy(dtype=object),
+                links["to_guid"].to_numpy(dtype=object),
+            ]
+        )
+        codes, guids = pd.factorize(endpoints)
+        n_notes, n_links = len(notes), len(links)
+        sources = codes[n_notes : n_notes + n_links]
+        targets = codes[n_notes + n_links :]
+        return cls(np.asarray(guids, dtype=object), sources.astype(np.int64), targets.astype(np.int64))
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.guids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.sources)
+
+    def node_ids(self, guids) -> np.ndarray:
+        """Integer ids of guids, -1 for guids not in the graph."""
+        return self.index.get_indexer(pd.Index(guids, dtype=object))
+
+    def components(self) -> np.ndarray:
+        """Label of the weakly connected component of every node, the smallest node id in the component."""
+        if self._components is None:
+            self._components = connected_components(self.n_nodes, self.sources, self.targets)
+        return self._components
+
+    def main_component(self) -> np.ndarray:
+        """Boolean node mask of the largest weakly connected component."""
+        labels = self.components()
+        if not len(labels):
+            return np.zeros(0, dtype=bool)
+        sizes = np.bincount(labels, minlength=self.n_nodes)
+        return labels == np.argmax(sizes)
+
+    def contains(self, guids, mask: np.ndarray | None = None) -> np.ndarray:
+        """Boolean array telling which guids are nodes of the graph, or of the nodes selected by mask."""
+        ids = self.node_ids(guids)
+        found = ids >= 0
+        if mask is not None:
+            found[found] = mask[ids[found]]
+        return found
+
+    def subgraph(self, mask: np.ndarray) -> "LinkGraph":
+        """Nodes selected by mask and the edges between them, node ids are renumbered."""
+        keep = mask[self.sources] & mask[self.targets]
+        renumber = np.cumsum(mask) - 1
+        return LinkGraph(self.guids[mask], renumber[self.sources[keep]], renumber[self.targets[keep]])
+
+
+def connected_components(n_nodes: int, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Union-find over all edges at once: hook the larger root onto the smaller one, then compress paths,
+    until no edge joins two different roots."""
+    parent = np.arange(n_nodes)
+    while True:
+        roots_s, roots_t = parent[sources], parent[targets]
+        joining = roots_s != roots_t
+        if not joining.any():
+            return parent
+
+        low = np.minimum(roots_s[joining], roots_t[joining])
+        high = np.maximum(roots_s[joining], roots_t[joining])
+        np.minimum.at(parent, high, low)
+
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
@@ -0,0 +1,46 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+from networkx.algorithms.link_analysis.pagerank_alg import _pagerank_python
+
+from graph.analytics import label_propagation, note_analytics, pagerank
+from graph.link_graph import LinkGraph
+
+
+def graph_of(edges, nodes):
+    notes = pd.DataFrame({"id": nodes})
+    links = pd.DataFrame(edges, columns=["from_guid", "to_guid"])
+    return notes, LinkGraph.from_frames(notes, links)
+
+
+def test_pagerank_matches_networkx():
+    rng = np.random.default_rng(1)
+    edges = [(f"n{a}", f"n{b}") for a, b in zip(rng.integers(0, 60, 200), rng.integers(0, 60, 200), strict=True)]
+    _, graph = graph_of(edges, [f"n{i}" for i in range(60)])
+
+    G = nx.MultiDiGraph()
+    G.add_nodes_from(graph.guids)
+    G.add_edges_from(edges)
+    # nx.pagerank needs scipy, the pure Python variant computes the same
+    expected = _pagerank_python(G, tol=1e-10)
+    ranks = pagerank(graph, tol=1e-10, max_iter=500)
+    assert np.allclose(ranks, [expected[guid] for guid in graph.guids], atol=1e-6)
+
+
+def test_communities_hubs_and_bridges():
+    cliques = [(f"{c}{i}", f"{c}{j}") for c in "abc" for i in range(5) for j in range(5) if i < j]
+    spokes = [("hub", "a0"), ("hub", "b0"), ("hub", "c0")]
+    nodes = [f"{c}{i}" for c in "abc" for i in range(5)] + ["hub"]
+    notes, graph = graph_of(cliques + spokes, nodes)
+
+    communities = label_propagation(graph)
+    index = dict(zip(graph.guids, communities, strict=True))
+    assert len({index[f"a{i}"] for i in range(5)}) == 1
+    assert len({index[f"b{i}"] for i in range(5)}) == 1
+    assert len({index["a0"], index["b0"], index["c0"]}) == 3
+
+    analytics = note_analytics(graph, notes, hub_quantile=0.9).set_index("id")
+    assert len(analytics) == len(nodes)
+    assert analytics.loc["hub", "is_bridge"]
+    assert analytics.loc["a0", "out_degree"] + analytics.loc["a0", "in_degree"] == 5
+    assert analytics["main_component"].all()
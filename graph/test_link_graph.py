@@ -0,0 +1,34 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from graph.link_graph import LinkGraph, connected_components
+
+
+def test_components_match_networkx():
+    rng = np.random.default_rng(0)
+    sources, targets = rng.integers(0, 300, 250), rng.integers(0, 300, 250)
+
+    labels = connected_components(300, sources, targets)
+
+    G = nx.Graph()
+    G.add_nodes_from(range(300))
+    G.add_edges_from(zip(sources, targets, strict=True))
+    for component in nx.connected_components(G):
+        component = list(component)
+        assert (labels[component] == min(component)).all()
+    assert len(set(labels)) == nx.number_connected_components(G)
+
+
+def test_graph_from_frames():
+    notes = pd.DataFrame({"id": ["a", "b", "c", "d"]})
+    links = pd.DataFrame({"from_guid": ["a", "b", "c", "d"], "to_guid": ["b", "x", None, None]})
+
+    graph = LinkGraph.from_frames(notes, links)
+    main = graph.main_component()
+
+    assert list(graph.guids) == ["a", "b", "c", "d", "x"]
+    assert graph.n_edges == 2
+    assert list(graph.contains(["a", "x", "c", "zzz"], main)) == [True, True, False, False]
+    sub = graph.subgraph(main)
+    assert list(sub.guids[sub.sources]) == ["a", "b"] and list(sub.guids[sub.targets]) == ["b", "x"]
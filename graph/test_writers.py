@@ -0,0 +1,36 @@
+import gzip
+import json
+
+import networkx as nx
+import pandas as pd
+
+from graph.link_graph import LinkGraph
+from graph.writers import write_d3_json, write_graphml
+
+
+def build_graph():
+    notes = pd.DataFrame({"id": ["a", "b", "c&d"]})
+    links = pd.DataFrame({"from_guid": ["a", "a", "b"], "to_guid": ["b", "b", "c&d"]})
+    return LinkGraph.from_frames(notes, links)
+
+
+def test_graphml_reads_back_in_networkx(tmp_path):
+    for compact in [False, True]:
+        write_graphml(build_graph(), str(tmp_path / "g.graphml"), compact=compact)
+        G = nx.read_graphml(str(tmp_path / "g.graphml"), force_multigraph=True)
+        assert list(G.nodes) == ["a", "b", "c&d"]
+        assert sorted(G.edges(keys=True)) == [("a", "b", 0), ("a", "b", 1), ("b", "c&d", 0)]
+
+
+def test_d3_json_is_valid_in_all_layouts(tmp_path):
+    expected = {
+        "nodes": [{"id": "A", "group": 1}, {"id": "B", "group": 1}],
+        "links": [{"source": "A", "target": "B", "value": 1}],
+    }
+    for compact in [False, True]:
+        write_d3_json(str(tmp_path / "d3.json"), ["A", "B"], ["A"], ["B"], compact=compact, compress=True)
+        with gzip.open(tmp_path / "d3.json.gz", "rt", encoding="utf-8") as f:
+            assert json.load(f) == expected
+
+    write_d3_json(str(tmp_path / "empty.json"), [], [], [])
+    assert json.loads((tmp_path / "empty.json").read_text()) == {"nodes": [], "links": []}
@@ -0,0 +1,93 @@
+import gzip
+import json
+from collections.abc import Iterable
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+import pandas as pd
+
+from graph.link_graph import LinkGraph
+
+CHUNK_SIZE = 10000
+
+GRAPHML_HEAD = (
+    "<?xml version='1.0' encoding='utf-8'?>\n"
+    '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+    'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">'
+)
+
+
+def open_output(path: str, compress=False):
+    """Text file for writing, gzipped with a .gz suffix when compress is set."""
+    if compress:
+        return gzip.open(path + ".gz", "wt", encoding="utf-8", compresslevel=6)
+    return open(path, "w", encoding="utf-8")
+
+
+def write_graphml(graph: LinkGraph, path: str, compact=False, compress=False):
+    """Write the graph as GraphML chunk by chunk, laid out like networkx.write_graphml of a MultiDiGraph: parallel
+    edges between two nodes get ids 0, 1, ..."""
+    indent, newline = ("", "") if compact else ("  ", "\n")
+    guids = [quoteattr(str(guid)) for guid in graph.guids]
+    keys = pd.DataFrame({"s": graph.sources, "t": graph.targets}).groupby(["s", "t"]).cumcount().to_numpy()
+
+    with open_output(path, compress) as f:
+        f.write(GRAPHML_HEAD + newline)
+        f.write(f'{indent}<graph edgedefault="directed">{newline}')
+        for start in range(0, graph.n_nodes, CHUNK_SIZE):
+            f.write("".join(f"{indent * 2}<node id={guid} />{newline}" for guid in guids[start : start + CHUNK_SIZE]))
+        for start in range(0, graph.n_edges, CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            edges = zip(graph.sources[start:end], graph.targets[start:end], keys[start:end], strict=True)
+            f.write(
+                "".join(
+                    f'{indent * 2}<edge source={guids[s]} target={guids[t]} id="{key}" />{newline}'
+                    for s, t, key in edges
+                )
+            )
+        f.write(f"{indent}</graph>{newline}</graphml>{newline}")
+
+
+def write_d3_json(path: str, node_ids: Iterable, sources: Iterable, targets: Iterable, compact=False, compress=False):
+    """Write {"nodes": [{"id", "group"}], "links": [{"source", "target", "value"}]} item by item."""
+    if compact:
+        separators, indent, separator = (",", ":"), "", ","
+        head, middle, tail = '{"nodes":[', '],"links":[', "]}"
+    else:
+        separators, indent, separator = (", ", ": "), "        ", ",\n"
+        head, middle, tail = '{\n    "nodes": [\n', '\n    ],\n    "links": [\n', "\n    ]\n}\n"
+
+    def dump(item):
+        return indent + json.dumps(item, ensure_ascii=False, separators=separators, default=_json_default)
+
+    with open_output(path, compress) as f:
+        f.write(head)
+        _write_items(f, (dump({"id": node_id, "group": 1}) for node_id in node_ids), separator)
+        f.write(middle)
+        # Assuming a default value of 1 for all links; adjust as necessary
+        links = (
+            {"source": source, "target": target, "value": 1} for source, target in zip(sources, targets, strict=True)
+        )
+        _write_items(f, (dump(link) for link in links), separator)
+        f.write(tail)
+
+
+def _write_items(f, items: Iterable[str], separator: str):
+    batch = []
+    first = True
+    for item in items:
+        batch.append(item)
+        if len(batch) == CHUNK_SIZE:
+            f.write(("" if first else separator) + separator.join(batch))
+            batch, first = [], False
+    if batch:
+        f.write(("" if first else separator) + separator.join(batch))
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA:
+        return None
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")